@@ -0,0 +1,142 @@
+"""
+admission.py
+
+Memory admission for calibration jobs.
+- Estimates a job's peak resident memory from the frames' header geometry
+  (NAXIS1/NAXIS2, BITPIX, BZERO/BSCALE) before any pixel data is decoded
+- Picks in-memory execution (every frame decoded once into a cube) when that
+  fits the job's memory budget, otherwise tiled execution over memory-mapped
+  frames with a band size sized to what is left
+- Rejects only what cannot be bounded at all (PCA superbias over a cube that
+  does not fit), so the number of frames is limited by memory, not by a cap
+
+Memory-mapped file pages are not counted: they are file-backed and the kernel
+reclaims them under pressure, unlike the decoded arrays estimated here.
+"""
+
+import numpy as np
+import os
+from astropy.io import fits
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+from .stacking import DEFAULT_BAND_MEMORY_MB, DEFAULT_STACK_WORKERS, auto_band_height, band_memory_mb
+
+# Memory one calibration job may use, overridable per deployment
+DEFAULT_JOB_MEMORY_MB = float(os.environ.get('JOB_MEMORY_MB', 2048))
+
+# Interpreter, numpy/astropy and pipeline bookkeeping outside the pixel arrays
+_BASE_OVERHEAD_MB = 200
+
+# Full-frame float64 arrays alive around the master (master, stats temporaries, preview)
+_OUTPUT_COPIES = 4
+
+# The smallest band worth running the tiled engine with
+_MIN_BAND_MEMORY_MB = 16
+
+# Methods that need every frame at once (no tiled path)
+FULL_CUBE_METHODS = ('superbias',)
+
+# superbias: the float64 cube plus the flattened copy and PCA working set
+_SUPERBIAS_COPIES = 3
+
+_MB = 1024 * 1024
+
+
+def frame_geometry(path: str) -> Tuple[Tuple[int, int], np.dtype]:
+    """(height, width) and the decoded dtype FrameStack would use, from the header alone."""
+    header = fits.getheader(path)
+    shape = (int(header['NAXIS2']), int(header['NAXIS1']))
+    bitpix = int(header['BITPIX'])
+    bzero = float(header.get('BZERO', 0.0))
+    bscale = float(header.get('BSCALE', 1.0))
+    # Same rule as FrameStack.cube_dtype: scaled 8/16-bit ADU is exact in float32
+    exact = bitpix in (8, 16) and bscale == 1.0 and bzero.is_integer()
+    return shape, np.dtype(np.float32 if exact else np.float64)
+
+
+@dataclass
+class ExecutionPlan:
+    """How a job will run and what it is expected to cost."""
+    admitted: bool
+    in_memory: bool
+    band_height: int
+    band_memory_mb: float
+    estimated_peak_mb: float
+    budget_mb: float
+    reason: str
+
+    def summary(self) -> dict:
+        return {
+            'mode': 'in_memory' if self.in_memory else 'tiled',
+            'band_height': self.band_height,
+            'estimated_peak_mb': round(self.estimated_peak_mb, 1),
+            'budget_mb': self.budget_mb,
+        }
+
+
+def plan_execution(file_list: Sequence[str], method: str, light_files: Sequence[str] = (),
+                   dark_optimization: bool = False, band_height: Optional[int] = None,
+                   workers: Optional[int] = None, memory_mb: Optional[float] = None) -> ExecutionPlan:
+    """
+    Estimate peak memory for stacking `file_list` with `method` and choose the execution mode.
+    light_files: lights the job opens (dark scaling / dark optimization)
+    dark_optimization: lights are also stacked (band by band) after subtracting the scaled dark
+    band_height: explicit band height (stackingBandHeight); sized from the budget when None
+    workers: band workers (stackingWorkers, default STACK_WORKERS); each holds its own band
+    memory_mb: job budget (default JOB_MEMORY_MB)
+    """
+    budget = memory_mb if memory_mb is not None else DEFAULT_JOB_MEMORY_MB
+    shape, cube_dtype = frame_geometry(file_list[0])
+    height, width = shape
+    n_frames = len(file_list)
+    frame_mb = height * width / _MB
+    cube_mb = n_frames * frame_mb * cube_dtype.itemsize
+    fixed_mb = _BASE_OVERHEAD_MB + _OUTPUT_COPIES * frame_mb * 8
+    lights_mb = 0.0
+    n_lights = len(light_files)
+    if n_lights:
+        _, light_dtype = frame_geometry(light_files[0])
+        lights_mb = n_lights * frame_mb * light_dtype.itemsize
+        # Per-light medians decode one float32 frame at a time
+        fixed_mb += frame_mb * 4
+
+    if method in FULL_CUBE_METHODS:
+        peak = fixed_mb + cube_mb + _SUPERBIAS_COPIES * n_frames * frame_mb * 8
+        admitted = peak <= budget
+        reason = (f"{method} needs all {n_frames} frames in memory (~{peak:.0f} MB)"
+                  + ("" if admitted else f", over the {budget:.0f} MB job budget"))
+        return ExecutionPlan(admitted, True, height, 0.0, peak, budget, reason)
+
+    workers = max(1, int(workers if workers is not None else DEFAULT_STACK_WORKERS))
+    band_mb = min(DEFAULT_BAND_MEMORY_MB, max(_MIN_BAND_MEMORY_MB, budget - fixed_mb - cube_mb - lights_mb))
+    in_memory = fixed_mb + cube_mb + band_mb <= budget
+    if not in_memory:
+        band_mb = min(DEFAULT_BAND_MEMORY_MB, max(_MIN_BAND_MEMORY_MB, budget - fixed_mb))
+    optimize_lights = dark_optimization and n_lights
+    if optimize_lights:
+        # Lights are stacked band by band after the master; the band budget is shared with them
+        band_mb = band_mb / 2
+    if band_height is None:
+        # Every stacking worker holds its own band, so they share the band budget
+        band_height = auto_band_height(max(n_frames, n_lights if dark_optimization else 0), height, width,
+                                       memory_mb=band_mb / workers)
+    band_height = int(max(1, min(band_height, height)))
+    # What the bands really hold: one per worker (at most one worker per band), plus the lights' band
+    workers = min(workers, -(-height // band_height))
+    band_mb = workers * band_memory_mb(n_frames, band_height, width)
+    if optimize_lights:
+        band_mb += band_memory_mb(n_lights, band_height, width)
+    peak = fixed_mb + band_mb
+    if in_memory:
+        peak += cube_mb
+    admitted = peak <= budget
+    if in_memory:
+        reason = f"{n_frames} frames of {width}x{height} fit in memory (~{peak:.0f} MB of {budget:.0f} MB)"
+    else:
+        reason = (f"{n_frames} frames of {width}x{height} need ~{cube_mb:.0f} MB decoded; "
+                  f"stacking memory-mapped in {band_height}-row bands"
+                  f"{f' on {workers} workers' if workers > 1 else ''} (~{peak:.0f} MB of {budget:.0f} MB)")
+    if not admitted:
+        reason += "; frames are too large for the job budget even one band at a time"
+    return ExecutionPlan(admitted, in_memory, band_height, band_mb, peak, budget, reason)
@@ -1,11 +1,10 @@
 import os
 import asyncio
-from astropy.io import fits
 from supabase import create_client
 import json
 from fits_analysis import analyze_fits_headers
 from db import init_db, get_db
-from supabase_io import list_files, download_file
+from supabase_io import list_files, fetch_header
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
@@ -59,27 +58,25 @@ def main():
         if not user_id or not project_id:
             print(f"[SKIP] Could not parse user/project from {path}")
             continue
-        local_path = f"/tmp/{os.path.basename(path)}"
         try:
-            download_file(BUCKET, path, local_path)
-            with fits.open(local_path) as hdul:
-                header = hdul[0].header
-                analysis = analyze_fits_headers(header)
-                is_valid = analysis.confidence >= 0.7 and not any('Missing' in w or 'must' in w for w in analysis.warnings)
-                metadata = analysis.metadata
-                metadata['frame_type'] = analysis.type
-                metadata['valid'] = is_valid
-                if not is_valid:
-                    metadata['rejection_reason'] = '; '.join(analysis.warnings)
-                asyncio.run(save_fits_metadata(path, project_id, user_id, metadata))
-                key = f"{frame_type or 'unknown'}"
-                if key not in summary:
-                    summary[key] = {'used': 0, 'rejected': 0}
-                if is_valid:
-                    summary[key]['used'] += 1
-                else:
-                    summary[key]['rejected'] += 1
-                print(f"[{'OK' if is_valid else 'REJECT'}] {path} ({analysis.type})")
+            # Only the header is validated, so fetch just its blocks instead of the whole file
+            header = fetch_header(BUCKET, path)
+            analysis = analyze_fits_headers(header)
+            is_valid = analysis.confidence >= 0.7 and not any('Missing' in w or 'must' in w for w in analysis.warnings)
+            metadata = analysis.metadata
+            metadata['frame_type'] = analysis.type
+            metadata['valid'] = is_valid
+            if not is_valid:
+                metadata['rejection_reason'] = '; '.join(analysis.warnings)
+            asyncio.run(save_fits_metadata(path, project_id, user_id, metadata))
+            key = f"{frame_type or 'unknown'}"
+            if key not in summary:
+                summary[key] = {'used': 0, 'rejected': 0}
+            if is_valid:
+                summary[key]['used'] += 1
+            else:
+                summary[key]['rejected'] += 1
+            print(f"[{'OK' if is_valid else 'REJECT'}] {path} ({analysis.type})")
         except Exception as e:
             print(f"[ERROR] {path}: {e}")
     print("\nSummary:")
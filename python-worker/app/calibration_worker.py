@@ -16,182 +16,69 @@ References:
 
 import numpy as np
 from astropy.io import fits
-from ccdproc import Combiner
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Union
 import argparse
 import os
 import warnings
-from astropy.nddata import CCDData
 import astropy.units as u
 import matplotlib.pyplot as plt
 import tempfile
 from .supabase_io import download_file, upload_file, get_public_url, list_files
+from .stacking import stack_tiled, auto_band_height, TILED_METHODS
+from .frame_stack import FrameStack
+from .cosmetic_masking import repair_bad_pixels
+from .frame_statistics import compute_frame_statistics
 import astroscrappy
 import time
 
 # --- Stacking Methods ---
-def load_ccd_list(file_list):
-    """Load FITS files as CCDData objects (for ccdproc Combiner)."""
-    return [CCDData.read(f, unit="adu") for f in file_list]
-
 def load_numpy_list(file_list):
     """Load FITS files as numpy arrays (for custom stacking)."""
     return [fits.getdata(f) for f in file_list]
 
-def stack_frames(file_list: List[str], method: str = 'median', sigma_clip: Optional[float] = None) -> np.ndarray:
+def stack_frames(file_list: Union[List[str], FrameStack], method: str = 'median', sigma_clip: Optional[float] = None, band_height: Optional[int] = None, workers: Optional[int] = None, **stack_options) -> np.ndarray:
     """
-    Stack FITS files using the specified method.
+    Stack FITS files (paths or the job's FrameStack) using the specified method.
     method: 'mean', 'median', 'sigma', 'winsorized', 'linear_fit', 'minmax', 'adaptive', 'superbias', 'entropy_weighted', 'percentile_clip'
     sigma_clip: threshold for sigma clipping (if used)
+    band_height: rows per band for the tiled engine (auto-sized from STACK_BAND_MEMORY_MB when None)
+    workers: processes combining bands in parallel (default STACK_WORKERS, 1 = single process)
+    stack_options: method-specific kernel options, e.g. iterations=3 for 'linear_fit' refitting, or
+        low_thresh/high_thresh/center/scale/max_iters/rejection_map for 'sigma' (see stacking.sigma_clip_combine)
     'superbias': PCA-based bias modeling (PixInsight-style)
     'entropy_weighted': Entropy-weighted averaging for optimal signal preservation
     'percentile_clip': Percentile-based outlier rejection (ideal for small datasets)
+    Per-pixel methods run through the out-of-core tiled engine (see stacking.py).
     """
     print(f"[LOG] stack_frames START: {len(file_list)} files, method={method}, sigma_clip={sigma_clip}", flush=True)
     t0 = time.time()
-    if method in ['mean', 'median', 'sigma']:
-        ccd_list = load_ccd_list(file_list)
-        print(f"[LOG] Loaded CCD list for stacking. Length: {len(ccd_list)}", flush=True)
-        comb = Combiner(ccd_list)
-        if method == 'mean':
-            print(f"[LOG] Performing mean combine", flush=True)
-            return comb.average_combine().data
-        elif method == 'median':
-            print(f"[LOG] Performing median combine", flush=True)
-            return comb.median_combine().data
-        elif method == 'sigma':
-            if sigma_clip is None:
-                sigma_clip = 3.0
-            print(f"[LOG] Performing sigma clipping with threshold {sigma_clip}", flush=True)
-            comb.sigma_clipping(low_thresh=sigma_clip, high_thresh=sigma_clip)
-            return comb.average_combine().data
-    # numpy-based methods
-    data = load_numpy_list(file_list)
-    print(f"[LOG] Loaded numpy list for stacking. Shape: {[d.shape for d in data]}", flush=True)
-    arr = np.stack(data, axis=0)
-    print(f"[LOG] Stacked numpy array shape: {arr.shape}", flush=True)
-    if method == 'winsorized':
-        if sigma_clip is None:
-            sigma_clip = 3.0
-        med = np.median(arr, axis=0)
-        std = np.std(arr, axis=0)
-        lower = med - sigma_clip * std
-        upper = med + sigma_clip * std
-        arr_winsor = np.clip(arr, lower, upper)
-        return np.mean(arr_winsor, axis=0)
-    elif method == 'minmax':
-        if arr.shape[0] <= 2:
-            print("[WARN] Not enough frames for minmax rejection, falling back to mean.")
-            return np.mean(arr, axis=0)
-        arr_sorted = np.sort(arr, axis=0)
-        arr_trimmed = arr_sorted[1:-1, ...]
-        return np.mean(arr_trimmed, axis=0)
-    elif method == 'linear_fit':
-        if sigma_clip is None:
-            sigma_clip = 3.0
-        n_frames = arr.shape[0]
-        x = np.arange(n_frames)
-        arr_flat = arr.reshape(n_frames, -1)
-        fit = np.polyfit(x, arr_flat, 1)
-        fit_vals = np.outer(x, fit[0]) + fit[1]
-        residuals = arr_flat - fit_vals
-        std = np.std(residuals, axis=0)
-        mask = np.abs(residuals) < (sigma_clip * std)
-        result = np.zeros(arr_flat.shape[1])
-        for i in range(arr_flat.shape[1]):
-            valid = arr_flat[mask[:, i], i]
-            if valid.size > 0:
-                result[i] = np.mean(valid)
-            else:
-                result[i] = np.mean(arr_flat[:, i])
-        return result.reshape(arr.shape[1:])
-    elif method == 'adaptive':
+    if method in TILED_METHODS:
+        result = stack_tiled(file_list, method=method, sigma_clip=sigma_clip, band_height=band_height, workers=workers, **stack_options)
+        print(f"[LOG] stack_frames END: method={method}, elapsed {time.time() - t0:.2f}s", flush=True)
+        return result
+    if method == 'adaptive':
         # Analyze frames and select the best stacking method and parameters
         print(f"[adaptive] Analyzing frames for adaptive stacking...", flush=True)
-        stats = analyze_frames(file_list)
-        rec_method, rec_sigma, reason = recommend_stacking(stats, user_method='median')
-        print(f"[adaptive] Selected method: {rec_method}, sigma: {rec_sigma}, reason: {reason}", flush=True)
-        # Call stack_frames recursively with the recommended method and sigma
-        result = stack_frames(file_list, method=rec_method, sigma_clip=rec_sigma)
+        stack, owned = FrameStack.wrap(file_list)
+        try:
+            stats = analyze_frames(stack)
+            rec_method, rec_sigma, reason = recommend_stacking(stats, user_method='median')
+            print(f"[adaptive] Selected method: {rec_method}, sigma: {rec_sigma}, reason: {reason}", flush=True)
+            # Call stack_frames recursively with the recommended method and sigma
+            result = stack_frames(stack, method=rec_method, sigma_clip=rec_sigma, band_height=band_height, workers=workers)
+        finally:
+            if owned:
+                stack.close()
         print(f"[adaptive] Adaptive stacking complete using method '{rec_method}'", flush=True)
         return result
-    elif method == 'entropy_weighted':
-        # Entropy-Weighted Averaging
-        print(f"[entropy_weighted] Starting entropy-weighted stacking...", flush=True)
-        arr = arr.astype(np.float64)
-        n_frames, height, width = arr.shape
-        
-        # Compute entropy for each pixel across all frames
-        print(f"[entropy_weighted] Computing entropy weights for {n_frames} frames...", flush=True)
-        
-        # For each pixel position, calculate entropy across frames
-        # Entropy = -sum(p * log2(p)) where p is the probability of each value
-        # We'll use normalized histograms to estimate probabilities
-        weights = np.zeros((n_frames, height, width), dtype=np.float64)
-        
-        # Process in chunks to manage memory
-        chunk_size = 1000  # Process 1000 pixels at a time
-        total_pixels = height * width
-        
-        for start_idx in range(0, total_pixels, chunk_size):
-            end_idx = min(start_idx + chunk_size, total_pixels)
-            
-            # Convert to flat indices
-            pixel_indices = np.unravel_index(range(start_idx, end_idx), (height, width))
-            pixel_values = arr[:, pixel_indices[0], pixel_indices[1]]  # Shape: (n_frames, n_pixels_in_chunk)
-            
-            # For each pixel across frames, compute entropy-based weights
-            for i, (y, x) in enumerate(zip(pixel_indices[0], pixel_indices[1])):
-                pixel_series = arr[:, y, x]
-                
-                # Compute entropy using histogram approach
-                # Use fewer bins for noisy data to avoid overestimating entropy
-                bins = min(16, len(np.unique(pixel_series)))
-                if bins < 2:
-                    # All values are the same, equal weights
-                    weights[:, y, x] = 1.0
-                else:
-                    hist, _ = np.histogram(pixel_series, bins=bins)
-                    # Normalize to get probabilities
-                    hist = hist.astype(np.float64)
-                    hist = hist / hist.sum()
-                    # Remove zeros to avoid log(0)
-                    hist = hist[hist > 0]
-                    # Calculate entropy
-                    entropy = -np.sum(hist * np.log2(hist))
-                    
-                    # Convert entropy to weights
-                    # Lower entropy (more consistent) = higher weight
-                    # Higher entropy (more random) = lower weight
-                    max_entropy = np.log2(bins)  # Maximum possible entropy for this number of bins
-                    
-                    # Normalize entropy to [0, 1] and invert so low entropy = high weight
-                    normalized_entropy = entropy / max_entropy if max_entropy > 0 else 0
-                    consistency_score = 1.0 - normalized_entropy
-                    
-                    # Apply weights based on how close each frame's value is to the median
-                    median_val = np.median(pixel_series)
-                    deviations = np.abs(pixel_series - median_val)
-                    max_dev = np.max(deviations) if np.max(deviations) > 0 else 1.0
-                    frame_weights = 1.0 - (deviations / max_dev)
-                    
-                    # Combine consistency score with frame-specific weights
-                    weights[:, y, x] = frame_weights * consistency_score
-        
-        # Ensure weights are positive and normalized per pixel
-        weights = np.maximum(weights, 0.001)  # Minimum weight to avoid division by zero
-        weight_sums = np.sum(weights, axis=0)
-        weight_sums[weight_sums == 0] = 1.0  # Avoid division by zero
-        
-        # Compute weighted average
-        print(f"[entropy_weighted] Computing weighted average...", flush=True)
-        weighted_sum = np.sum(arr * weights, axis=0)
-        result = weighted_sum / weight_sums
-        
-        print(f"[entropy_weighted] Entropy-weighted stacking complete", flush=True)
-        print(f"[entropy_weighted] Weight stats: min={np.min(weights):.4f}, max={np.max(weights):.4f}, mean={np.mean(weights):.4f}", flush=True)
-        return result
     elif method == 'superbias':
+        # PCA needs every frame at once, so superbias keeps the in-memory path
+        stack, owned = FrameStack.wrap(file_list)
+        try:
+            arr = stack.read_band(0, stack.shape[0])
+        finally:
+            if owned:
+                stack.close()
         try:
             from sklearn.decomposition import PCA
         except ImportError:
@@ -213,69 +100,25 @@ def stack_frames(file_list: List[str], method: str = 'median', sigma_clip: Optio
         print(f"[superbias] PCA explained variance ratio: {pca.explained_variance_ratio_}", flush=True)
         print(f"[LOG] stack_frames END (superbias): elapsed {time.time() - t0:.2f}s", flush=True)
         return superbias
-    elif method == 'percentile_clip':
-        # Percentile clipping: reject pixels outside specified percentile range
-        if sigma_clip is None:
-            # Default: keep middle 60% (reject bottom 20% and top 20%)
-            low_percentile = 20.0
-            high_percentile = 80.0
-        else:
-            # Use sigma_clip as percentile range around median
-            # e.g., sigma_clip=30 means keep middle 70% (reject bottom 15% and top 15%)
-            low_percentile = (100.0 - sigma_clip) / 2.0
-            high_percentile = 100.0 - low_percentile
-        
-        print(f"[percentile_clip] Using percentile range: {low_percentile}%-{high_percentile}%", flush=True)
-        
-        n_frames, height, width = arr.shape
-        result = np.zeros((height, width), dtype=np.float64)
-        
-        # For each pixel position, sort values and apply percentile clipping
-        for y in range(height):
-            for x in range(width):
-                pixel_values = arr[:, y, x]
-                
-                # Calculate percentile thresholds
-                p_low = np.percentile(pixel_values, low_percentile)
-                p_high = np.percentile(pixel_values, high_percentile)
-                
-                # Keep only values within percentile range
-                valid_mask = (pixel_values >= p_low) & (pixel_values <= p_high)
-                valid_values = pixel_values[valid_mask]
-                
-                # Average the remaining values
-                if len(valid_values) > 0:
-                    result[y, x] = np.mean(valid_values)
-                else:
-                    # Fallback to median if all values rejected (shouldn't happen normally)
-                    result[y, x] = np.median(pixel_values)
-        
-        print(f"[percentile_clip] Percentile clipping complete", flush=True)
-        return result
     else:
         raise ValueError(f"Unknown stacking method: {method}")
-    print(f"[LOG] stack_frames END: method={method}, elapsed {time.time() - t0:.2f}s", flush=True)
 
 # --- Cosmetic Correction (Stub) ---
-def cosmetic_correction(data: np.ndarray, method: str = 'hot_pixel_map', threshold: float = 5.0, la_cosmic_params: dict = None, bad_pixel_map: np.ndarray = None) -> np.ndarray:
+def cosmetic_correction(data: np.ndarray, method: str = 'hot_pixel_map', threshold: float = 5.0, la_cosmic_params: dict = None, bad_pixel_map: np.ndarray = None, tile_rows: Optional[int] = None) -> np.ndarray:
     """
     Remove hot/cold pixels or cosmetic defects.
     method: 'hot_pixel_map', 'la_cosmic', etc.
     threshold: N-sigma for hot/cold pixel detection (default 5.0)
     la_cosmic_params: dict of extra params for astroscrappy
     bad_pixel_map: boolean numpy array (True=bad pixel)
+    tile_rows: row-tile height for the bad-pixel repair (see cosmetic_masking.repair_bad_pixels)
+    Bad pixels are repaired from their good neighbours only; flagged neighbours are left out.
     """
     # Apply BPM first if provided
     if bad_pixel_map is not None:
         mask = bad_pixel_map.astype(bool)
         if np.any(mask):
-            padded = np.pad(data, 1, mode='reflect')
-            corrected = data.copy()
-            idxs = np.argwhere(mask)
-            for y, x in idxs:
-                neighborhood = padded[y:y+3, x:x+3]
-                corrected[y, x] = np.median(neighborhood)
-            data = corrected
+            data = repair_bad_pixels(data, mask, tile_rows=tile_rows)
     if method == 'hot_pixel_map':
         # Compute mean and std of the image
         mean = np.mean(data)
@@ -286,15 +129,8 @@ def cosmetic_correction(data: np.ndarray, method: str = 'hot_pixel_map', thresho
         mask = hot_mask | cold_mask
         if not np.any(mask):
             return data  # No correction needed
-        # Pad data for edge pixels
-        padded = np.pad(data, 1, mode='reflect')
-        corrected = data.copy()
-        # Replace each bad pixel with median of 3x3 neighborhood
-        idxs = np.argwhere(mask)
-        for y, x in idxs:
-            neighborhood = padded[y:y+3, x:x+3]
-            corrected[y, x] = np.median(neighborhood)
-        return corrected
+        # Replace each bad pixel with the median of its good 3x3 neighbours
+        return repair_bad_pixels(data, mask, tile_rows=tile_rows)
     elif method == 'la_cosmic':
         # Use astroscrappy to remove cosmic rays
         # threshold is mapped to sigclip
@@ -316,16 +152,17 @@ def cosmetic_correction(data: np.ndarray, method: str = 'hot_pixel_map', thresho
     return data
 
 # --- Main Calibration Worker Entrypoint ---
-def create_master_frame(file_list: List[str], method: str = 'median', sigma_clip: Optional[float] = None, cosmetic: bool = False, cosmetic_method: str = 'hot_pixel_map', cosmetic_threshold: float = 0.5, la_cosmic_params: dict = None, bad_pixel_map: np.ndarray = None, **kwargs) -> np.ndarray:
+def create_master_frame(file_list: Union[List[str], FrameStack], method: str = 'median', sigma_clip: Optional[float] = None, cosmetic: bool = False, cosmetic_method: str = 'hot_pixel_map', cosmetic_threshold: float = 0.5, la_cosmic_params: dict = None, bad_pixel_map: np.ndarray = None, **kwargs) -> np.ndarray:
     print(f"[LOG] Entered create_master_frame with {len(file_list)} files, method={method}, sigma_clip={sigma_clip}, cosmetic={cosmetic}, cosmetic_method={cosmetic_method}", flush=True)
-    print(f"[LOG] File list: {file_list}", flush=True)
-    stacked = stack_frames(file_list, method, sigma_clip)
+    print(f"[LOG] File list: {file_list.paths if isinstance(file_list, FrameStack) else file_list}", flush=True)
+    stacked = stack_frames(file_list, method, sigma_clip, band_height=kwargs.get('band_height'), workers=kwargs.get('workers'), **(kwargs.get('stack_options') or {}))
     print(f"[LOG] Finished stacking frames. Shape: {stacked.shape}, dtype: {stacked.dtype}", flush=True)
     if cosmetic:
         print(f"[LOG] Starting cosmetic correction: method={cosmetic_method}, threshold={cosmetic_threshold}", flush=True)
         stacked = cosmetic_correction(stacked, cosmetic_method, cosmetic_threshold, la_cosmic_params, bad_pixel_map)
         print(f"[LOG] Finished cosmetic correction.", flush=True)
-    print(f"[LOG] Returning master frame. Stats: min={np.min(stacked)}, max={np.max(stacked)}, mean={np.mean(stacked):.2f}, median={np.median(stacked):.2f}, std={np.std(stacked):.2f}", flush=True)
+    stats = compute_frame_statistics(stacked)
+    print(f"[LOG] Returning master frame. Stats: min={stats.min}, max={stats.max}, mean={stats.mean:.2f}, median={stats.median:.2f}, std={stats.std:.2f}", flush=True)
     return stacked
 
 # --- Save Master Frame ---
@@ -333,30 +170,57 @@ def save_master_frame(data: np.ndarray, out_path: str, header: Optional[Dict] =
     hdu = fits.PrimaryHDU(data, header=fits.Header(header) if header else None)
     hdu.writeto(out_path, overwrite=True)
 
-def analyze_frames(file_list):
-    """Analyze frames for variance, outliers, and count."""
-    data = load_numpy_list(file_list)
-    arr = np.stack(data, axis=0).astype(np.float64)
-    n_frames = arr.shape[0]
-    mean = np.mean(arr, axis=0)
-    std = np.std(arr, axis=0)
-    # Outlier detection: count pixels > 5 sigma from mean in any frame
-    outlier_count = 0
-    for i in range(n_frames):
-        outlier_count += np.sum(np.abs(arr[i] - mean) > 5 * std)
-    total_pixels = np.prod(arr.shape[1:]) * n_frames
+def analyze_frames(file_list, band_height: Optional[int] = None):
+    """
+    Analyze frames for variance, outliers, and count.
+    file_list: paths or the job's FrameStack; frames are read band by band.
+    """
+    stack, owned = FrameStack.wrap(file_list)
+    try:
+        n_frames = len(stack)
+        height, width = stack.shape
+        if band_height is None:
+            band_height = auto_band_height(n_frames, height, width)
+        outlier_count = 0
+        std_sum = 0.0
+        # Running global mean / sum of squared deviations, merged band by band (Chan et al.)
+        total_n = 0
+        global_mean = 0.0
+        global_m2 = 0.0
+        for y0, y1, arr in stack.iter_bands(band_height):
+            mean = np.mean(arr, axis=0)
+            std = np.std(arr, axis=0)
+            # Outlier detection: count pixels > 5 sigma from mean in any frame
+            outlier_count += int(np.sum(np.abs(arr - mean) > 5 * std))
+            std_sum += float(np.sum(std))
+            band_n = arr.size
+            band_mean = float(np.mean(arr))
+            band_m2 = float(np.sum((arr - band_mean) ** 2))
+            delta = band_mean - global_mean
+            new_n = total_n + band_n
+            global_mean += delta * band_n / new_n
+            global_m2 += band_m2 + delta * delta * total_n * band_n / new_n
+            total_n = new_n
+    finally:
+        if owned:
+            stack.close()
+    total_pixels = height * width * n_frames
     outlier_ratio = outlier_count / total_pixels
-    global_var = np.var(arr)
     return {
         'n_frames': n_frames,
-        'global_var': global_var,
+        'global_var': global_m2 / total_n,
         'outlier_ratio': outlier_ratio,
-        'mean': np.mean(arr),
-        'std': np.mean(std),
+        'mean': global_mean,
+        'std': std_sum / (height * width),
     }
 
 def recommend_stacking(stats, user_method, user_sigma=None):
-    """Recommend stacking method and sigma threshold based on stats and user choice."""
+    """
+    Recommend stacking method and sigma threshold based on stats and user choice.
+    stats: analyze_frames() output, or a FrameStack to analyze.
+    """
+    if isinstance(stats, FrameStack):
+        stats = analyze_frames(stats)
     n = stats['n_frames']
     outlier_ratio = stats['outlier_ratio']
     var = stats['global_var']
@@ -406,20 +270,28 @@ def save_master_preview(data: np.ndarray, out_path: str):
     vmin, vmax = np.percentile(data, [1, 99])
     plt.imsave(out_path, np.clip((data - vmin) / (vmax - vmin), 0, 1), cmap='gray')
 
-def estimate_dark_scaling_factor(dark_file_list: List[str], light_file_list: Optional[List[str]] = None) -> float:
+def estimate_dark_scaling_factor(dark_file_list: Union[List[str], FrameStack], light_file_list: Optional[Union[List[str], FrameStack]] = None) -> float:
     """
     Estimate a scaling factor for dark frames.
     If light frames are provided, use the ratio of median(light) / median(dark) as the scaling factor.
     If not, return 1.0.
+    Either argument may be a FrameStack already opened for the job.
     """
-    if not light_file_list or len(light_file_list) == 0:
+    if light_file_list is None or len(light_file_list) == 0:
         return 1.0
-    # Load and stack all darks and lights
-    dark_data = load_numpy_list(dark_file_list)
-    light_data = load_numpy_list(light_file_list)
     # Use median of all pixels as a robust background estimator
-    median_dark = float(np.median(np.stack(dark_data)))
-    median_light = float(np.median(np.stack(light_data)))
+    darks, owns_darks = FrameStack.wrap(dark_file_list)
+    try:
+        median_dark = darks.median()
+    finally:
+        if owns_darks:
+            darks.close()
+    lights, owns_lights = FrameStack.wrap(light_file_list)
+    try:
+        median_light = lights.median()
+    finally:
+        if owns_lights:
+            lights.close()
     if median_dark == 0:
         return 1.0
     scaling_factor = median_light / median_dark
@@ -0,0 +1,72 @@
+"""
+cancellation.py
+
+In-process cancellation tokens for running jobs.
+- The job worker registers a CancelToken for every job it claims; stage
+  loops check token.cancelled, an attribute read instead of a jobs-table
+  round trip per frame
+- /jobs/cancel sets the token directly when the job runs in the same
+  process, and NOTIFYs job_cancel so the worker running it on another node
+  sets its token too (CancellationRegistry.listen)
+- The jobs row stays the durable record ('cancelled'): a queued job that is
+  cancelled is simply never claimed
+"""
+
+from typing import Dict, Optional
+
+CANCEL_CHANNEL = 'job_cancel'
+
+
+class CancelToken:
+    """Set once when the job is cancelled; cheap to check from any loop."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def is_cancelled(self) -> bool:
+        # Awaitable form for callbacks such as StreamingPipeline.run(is_cancelled=...)
+        return self.cancelled
+
+
+class CancellationRegistry:
+    """Tokens of the jobs running in this process, by job id."""
+
+    def __init__(self):
+        self._tokens: Dict[str, CancelToken] = {}
+
+    def token(self, job_id: str) -> CancelToken:
+        """The job's token, registering one if the job has none yet."""
+        if job_id not in self._tokens:
+            self._tokens[job_id] = CancelToken(job_id)
+        return self._tokens[job_id]
+
+    def get(self, job_id: str) -> Optional[CancelToken]:
+        return self._tokens.get(job_id)
+
+    def release(self, job_id: str):
+        self._tokens.pop(job_id, None)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel the job if it runs in this process; returns whether it does."""
+        token = self._tokens.get(job_id)
+        if token is None:
+            return False
+        token.cancel()
+        print(f"[CANCEL] Cancellation signalled to running job {job_id}", flush=True)
+        return True
+
+    async def listen(self, conn):
+        """Apply cancellations NOTIFYed by other nodes on `conn` (a dedicated connection)."""
+        await conn.add_listener(CANCEL_CHANNEL, lambda _conn, _pid, _channel, job_id: self.cancel(job_id))
+
+
+async def notify_cancel(conn, job_id: str):
+    await conn.execute("select pg_notify($1, $2)", CANCEL_CHANNEL, job_id)
+
+
+# Registry shared by the API process and its embedded worker
+cancellation_registry = CancellationRegistry()
@@ -0,0 +1,77 @@
+"""
+compute_executor.py
+
+Managed executor for CPU-heavy job stages.
+- Stages (stacking, cosmic-ray detection, pattern removal, analysis...) run in
+  a bounded process pool and are awaited with run_in_executor, so the event
+  loop keeps serving /health, /jobs/status and other users' requests
+- The pool size is the per-node concurrency limit (JOB_PROCESSES, default
+  half the cores); further stages queue until a process is free
+- JOB_PROCESSES=0 runs stages in a thread instead (development, tests)
+
+Stage functions must be importable module-level functions with picklable
+arguments and results; see job_stages.py.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+# Stage processes per node
+DEFAULT_JOB_PROCESSES = int(os.environ.get('JOB_PROCESSES', max(1, (os.cpu_count() or 2) // 2)))
+
+
+class ComputeExecutor:
+    """Bounded process pool shared by every job on this node, created on first use."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = DEFAULT_JOB_PROCESSES if max_workers is None else int(max_workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._active = 0
+
+    @property
+    def active(self) -> int:
+        """Stages submitted and not yet finished (running or queued)."""
+        return self._active
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn: workers must not inherit the event loop, DB connections or threads of the API process
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) off the event loop and return its result."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        self._active += 1
+        try:
+            return await loop.run_in_executor(self._get_pool(), call)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for the next stage
+            print(f"[EXECUTOR] Process pool broke while running {getattr(fn, '__name__', fn)}; restarting it", flush=True)
+            self.shutdown(wait=False)
+            raise
+        finally:
+            self._active -= 1
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+# Executor shared by the API process; shut down from the app lifespan
+compute_executor = ComputeExecutor()
+
+
+async def run_cpu(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Await a CPU-heavy stage on the shared executor."""
+    return await compute_executor.run(fn, *args, **kwargs)
@@ -1,5 +1,12 @@
 import numpy as np
 
+# Row offsets / column offsets of the 3x3 neighbourhood used by repair_bad_pixels
+_NEIGHBOUR_DY = np.repeat([-1, 0, 1], 3)
+_NEIGHBOUR_DX = np.tile([-1, 0, 1], 3)
+
+# Pixels covered by one tile when repair_bad_pixels picks the tile height itself
+_REPAIR_TILE_PIXELS = 4 * 1024 * 1024
+
 def compute_bad_pixel_mask(dark_stack, sigma=5, min_bad_fraction=0.5):
     """
     Returns a 2D mask of bad pixels.
@@ -47,4 +54,52 @@ def apply_masks(image, bad_pixel_mask, bad_col_mask, bad_row_mask, fill_value=np
     for row, is_bad in enumerate(bad_row_mask):
         if is_bad:
             masked[row, :] = fill_value
-    return masked 
\ No newline at end of file
+    return masked 
+
+
+def _reflect(index, size):
+    # Same edge handling as np.pad(mode='reflect') for a one-pixel border
+    index = np.abs(index)
+    index = np.where(index > size - 1, 2 * (size - 1) - index, index)
+    return np.clip(index, 0, size - 1)
+
+
+def repair_bad_pixels(image, bad_mask, tile_rows=None):
+    """
+    Returns a copy of image with every bad pixel replaced by the median of its
+    good 3x3 neighbours.
+    - bad_mask: same shape as image, nonzero = bad
+    - Neighbours that are themselves bad are left out of the median; a pixel
+      with no good neighbour falls back to the median of the whole 3x3
+      neighbourhood
+    - Edges use reflected neighbours, like np.pad(mode='reflect')
+    - Neighbourhoods are gathered for all bad pixels of a row tile at once;
+      tile_rows bounds the tile height (default: about 4M pixels per tile)
+    """
+    bad_mask = np.asarray(bad_mask).astype(bool)
+    corrected = image.copy()
+    if not bad_mask.any():
+        return corrected
+    height, width = image.shape
+    if tile_rows is None:
+        tile_rows = max(1, _REPAIR_TILE_PIXELS // width)
+    for y0 in range(0, height, tile_rows):
+        ys, xs = np.nonzero(bad_mask[y0:y0 + tile_rows])
+        if ys.size == 0:
+            continue
+        ys += y0
+        rows = _reflect(ys[:, None] + _NEIGHBOUR_DY, height)
+        cols = _reflect(xs[:, None] + _NEIGHBOUR_DX, width)
+        values = image[rows, cols].astype(np.float64)
+        good = ~bad_mask[rows, cols]
+        n_good = np.count_nonzero(good, axis=1)
+        # Bad neighbours sort to the end as NaN; the median is read off the first n_good values
+        ordered = np.sort(np.where(good, values, np.nan), axis=1)
+        lower = np.take_along_axis(ordered, np.maximum(n_good - 1, 0)[:, None] // 2, axis=1)[:, 0]
+        upper = np.take_along_axis(ordered, (n_good // 2)[:, None], axis=1)[:, 0]
+        medians = (lower + upper) / 2
+        isolated = n_good == 0
+        if isolated.any():
+            medians[isolated] = np.median(values[isolated], axis=1)
+        corrected[ys, xs] = medians
+    return corrected
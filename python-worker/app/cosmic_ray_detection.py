@@ -14,6 +14,10 @@ from scipy.signal import medfilt2d
 import logging
 from typing import Tuple, Optional, Dict, Any
 import warnings
+try:
+    from .fits_io import MemmapImage
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import MemmapImage
 
 logger = logging.getLogger(__name__)
 
@@ -328,10 +332,11 @@ class CosmicRayDetector:
         try:
             logger.info(f"Processing FITS file: {fits_path}")
             
-            # Load FITS file
-            with fits.open(fits_path) as hdul:
-                data = hdul[0].data.astype(np.float64)
-                header = hdul[0].header
+            # Load FITS file; the detectors work in floating point, so decode
+            # straight from the stored integers into one float64 copy
+            with MemmapImage(fits_path) as image:
+                data = image.pixels().astype(np.float64)
+                header = image.header
                 
                 # Extract camera parameters from header if available
                 if 'GAIN' in header:
@@ -585,9 +590,9 @@ class CosmicRayDetector:
                 logger.info(f"Processing file {i+1}/{len(fits_paths)}: {fits_path}")
                 
                 # Load FITS file
-                with fits.open(fits_path) as hdul:
-                    data = hdul[0].data.astype(np.float64)
-                    header = hdul[0].header
+                with MemmapImage(fits_path) as image:
+                    data = image.pixels().astype(np.float64)
+                    header = image.header
                 
                 # Auto-tune parameters if requested
                 original_params = {}
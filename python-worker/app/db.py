@@ -1,27 +1,93 @@
+import asyncio
 import asyncpg
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# App-wide connection pool sizes (per process)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+
+# Prepared statements cached per connection; set 0 behind a transaction-mode pooler (pgbouncer :6543)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+
+_pool = None
+_pool_loop = None
+
+async def init_pool():
+    """Create the app-wide pool (FastAPI lifespan / worker startup)."""
+    global _pool, _pool_loop
+    if _pool is None:
+        _pool_loop = asyncio.get_running_loop()
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        )
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+@asynccontextmanager
+async def acquire():
+    """
+    A pooled connection, or a one-off connection when no pool was created (scripts)
+    or the caller runs its own event loop (background threads); pooled connections
+    belong to the loop that created the pool.
+    """
+    if _pool is not None and asyncio.get_running_loop() is _pool_loop:
+        async with _pool.acquire() as conn:
+            yield conn
+    else:
+        conn = await get_db()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
 async def init_db():
-    # Create database connection
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Create fits_metadata table if it doesn't exist
+    async with acquire() as conn:
+        await _create_tables(conn)
+
+async def _create_tables(conn):
+    # fits_metadata and its frame-catalog columns and indexes are owned by the supabase
+    # migrations; startup only creates the worker's own tables
+    # Job status rows, plus the queue columns used by job_queue.py
     await conn.execute('''
-        CREATE TABLE IF NOT EXISTS fits_metadata (
-            file_path TEXT PRIMARY KEY,
-            project_id TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            metadata JSONB NOT NULL,
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT,
+            error TEXT,
+            result JSONB,
+            diagnostics JSONB,
+            warnings JSONB,
+            progress INTEGER,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    await conn.close()
+    await conn.execute('''
+        ALTER TABLE jobs
+            ADD COLUMN IF NOT EXISTS job_type TEXT,
+            ADD COLUMN IF NOT EXISTS payload JSONB,
+            ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS locked_by TEXT,
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (priority DESC, created_at)
+            WHERE status = 'queued'
+    ''')
 
 async def get_db():
-    return await asyncpg.connect(DATABASE_URL) 
\ No newline at end of file
+    """A dedicated connection the caller closes (LISTEN, one-off scripts); prefer acquire()."""
+    return await asyncpg.connect(DATABASE_URL, statement_cache_size=DB_STATEMENT_CACHE_SIZE)
@@ -0,0 +1,204 @@
+"""
+fits_cache.py
+
+Content-addressed on-disk cache for frames downloaded from Supabase storage.
+- refs/<sha256(bucket/path)>.json records the object's ETag and the
+  content hash it resolved to; blobs/<sha256>.fits holds the bytes, so
+  identical uploads under different paths are stored once
+- A hit (same ETag as the stored ref) is a local file copy; a changed
+  ETag is a miss and replaces the ref
+- Blobs and refs are written to a temp file and os.replace()d into place,
+  so readers never see partial files; a per-object flock keeps concurrent
+  worker processes from downloading the same object twice
+- The cache is capped at FITS_CACHE_MB; least recently used blobs (by
+  mtime, refreshed on every hit) are evicted first
+- fetch() runs a blocking download under the lock; async callers use the
+  same steps (lookup, try_lock, store, deliver) around an awaited transfer
+  so no thread is held for the length of a download
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import IO, Callable, Optional
+
+DEFAULT_FITS_CACHE_DIR = os.environ.get('FITS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'stellar_fits_cache'))
+
+# Cache size cap; 0 disables the cache
+DEFAULT_FITS_CACHE_MB = float(os.environ.get('FITS_CACHE_MB', 10240))
+
+FITS_EXTENSIONS = ('.fit', '.fits', '.fts')
+
+_HASH_CHUNK = 1 << 20
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FitsCache:
+    """Shared by every process that points at the same directory."""
+
+    def __init__(self, cache_dir: str = DEFAULT_FITS_CACHE_DIR, max_mb: float = DEFAULT_FITS_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        for sub in ('refs', 'blobs', 'tmp', 'locks'):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+
+    @staticmethod
+    def cacheable(path: str) -> bool:
+        return path.lower().endswith(FITS_EXTENSIONS)
+
+    def _key(self, bucket: str, path: str) -> str:
+        return hashlib.sha256(f"{bucket}/{path}".encode()).hexdigest()
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, 'blobs', content_hash + '.fits')
+
+    def tmp_path(self) -> str:
+        return os.path.join(self.cache_dir, 'tmp', uuid.uuid4().hex)
+
+    def _lock_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, 'locks', name + '.lock')
+
+    @contextmanager
+    def _lock(self, name: str, blocking: bool = True):
+        with open(self._lock_path(name), 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_ref(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.cache_dir, 'refs', key + '.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_ref(self, key: str, ref: dict):
+        tmp = self.tmp_path()
+        with open(tmp, 'w') as f:
+            json.dump(ref, f)
+        os.replace(tmp, os.path.join(self.cache_dir, 'refs', key + '.json'))
+
+    def _copy_out(self, content_hash: str, local_path: str) -> bool:
+        blob = self._blob_path(content_hash)
+        try:
+            # Once open, the copy survives a concurrent eviction of the blob
+            with open(blob, 'rb') as src, open(local_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, _HASH_CHUNK)
+            os.utime(blob)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def lookup(self, bucket: str, path: str, local_path: str, etag: str) -> bool:
+        """Copy the object to local_path if the cache holds it at this ETag."""
+        ref = self._read_ref(self._key(bucket, path))
+        return bool(ref and ref.get('etag') == etag and self._copy_out(ref['blob'], local_path))
+
+    def try_lock(self, bucket: str, path: str) -> Optional[IO]:
+        """Take the object's fill lock without blocking: a handle for unlock(), or None if it is held."""
+        handle = open(self._lock_path(self._key(bucket, path)), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+        return handle
+
+    @staticmethod
+    def unlock(handle: IO):
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+    def store(self, bucket: str, path: str, etag: str, tmp_path: str) -> str:
+        """Move a downloaded tmp_path() file into the cache under this ETag (fill lock held); returns its hash."""
+        content_hash = _sha256_file(tmp_path)
+        os.replace(tmp_path, self._blob_path(content_hash))
+        self._write_ref(self._key(bucket, path), {'bucket': bucket, 'path': path, 'etag': etag, 'blob': content_hash})
+        return content_hash
+
+    def deliver(self, bucket: str, path: str, content_hash: str, local_path: str):
+        """Evict down to the cap (keeping content_hash) and copy the stored object to local_path."""
+        self.evict(keep=content_hash)
+        if not self._copy_out(content_hash, local_path):
+            raise FileNotFoundError(f"Cached blob for {bucket}/{path} vanished before it was copied")
+
+    def fetch(self, bucket: str, path: str, local_path: str, etag: str,
+              download: Callable[[str], None]) -> bool:
+        """
+        Write the object to local_path, from the cache when its ETag matches.
+        download(tmp_path) fetches the object on a miss. Returns True on a hit.
+        """
+        if self.lookup(bucket, path, local_path, etag):
+            return True
+        with self._lock(self._key(bucket, path)):
+            # Another process may have fetched it while we waited for the lock
+            if self.lookup(bucket, path, local_path, etag):
+                return True
+            tmp = self.tmp_path()
+            try:
+                download(tmp)
+                content_hash = self.store(bucket, path, etag, tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self.deliver(bucket, path, content_hash, local_path)
+        return False
+
+    def size_bytes(self) -> int:
+        total = 0
+        with os.scandir(os.path.join(self.cache_dir, 'blobs')) as entries:
+            for entry in entries:
+                total += entry.stat().st_size
+        return total
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used blobs until the cache fits max_bytes."""
+        with self._lock('evict', blocking=False) as locked:
+            if not locked:
+                return  # another process is evicting
+            with os.scandir(os.path.join(self.cache_dir, 'blobs')) as it:
+                blobs = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in it]
+            total = sum(size for _, size, _ in blobs)
+            for _, size, blob in sorted(blobs):
+                if total <= self.max_bytes:
+                    break
+                if keep and os.path.basename(blob) == keep + '.fits':
+                    continue
+                try:
+                    os.remove(blob)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+
+_cache: Optional[FitsCache] = None
+
+
+def get_fits_cache() -> Optional[FitsCache]:
+    """Process-wide cache, or None when FITS_CACHE_MB is 0."""
+    global _cache
+    if DEFAULT_FITS_CACHE_MB <= 0:
+        return None
+    if _cache is None:
+        _cache = FitsCache()
+    return _cache
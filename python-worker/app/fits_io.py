@@ -0,0 +1,160 @@
+"""
+fits_io.py
+
+Low-level FITS access helpers shared by the stacking and analysis modules.
+- Opens image HDUs memory-mapped so pixel data is paged in on demand
+- Applies BZERO/BSCALE per row band instead of materialising a scaled copy
+- load_image() hands whole images to the analysis modules as read-only
+  arrays in their stored width (uint16 stays 2 bytes/pixel); kernels promote
+  to float only where they need it
+- HeaderReader parses a primary header from the leading bytes of a file, so
+  remote headers can be read with range requests (fetch_header)
+"""
+
+import numpy as np
+from astropy.io import fits
+from typing import Optional, Tuple
+
+FITS_BLOCK = 2880
+FITS_CARD = 80
+
+# First range request covers this many blocks; each further request doubles it
+HEADER_FIRST_BLOCKS = 2
+
+# Give up on files whose primary header runs past this (not a FITS file)
+HEADER_MAX_BLOCKS = 256
+
+
+class HeaderReader:
+    """
+    Accumulates the leading bytes of a FITS file until the primary header's
+    END card, e.g. from successive HTTP range requests (next_range()).
+    """
+
+    def __init__(self, first_blocks: int = HEADER_FIRST_BLOCKS):
+        self.buffer = bytearray()
+        self.end: Optional[int] = None
+        self._scanned = 0
+        self._blocks = first_blocks
+
+    def next_range(self) -> str:
+        """Range header value for the next blocks to fetch."""
+        start = len(self.buffer)
+        stop = start + self._blocks * FITS_BLOCK - 1
+        self._blocks *= 2
+        return f"bytes={start}-{stop}"
+
+    def feed(self, chunk: bytes) -> bool:
+        """Append bytes; True once the END card has been seen."""
+        self.buffer += chunk
+        if self._scanned == 0 and len(self.buffer) >= FITS_CARD and not self.buffer.startswith(b'SIMPLE  ='):
+            raise ValueError("Not a FITS file (no SIMPLE card)")
+        while self.end is None and self._scanned + FITS_CARD <= len(self.buffer):
+            card = bytes(self.buffer[self._scanned:self._scanned + FITS_CARD])
+            self._scanned += FITS_CARD
+            if card[:3] == b'END' and not card[3:].strip():
+                # The header is padded to a whole number of blocks
+                self.end = -(-self._scanned // FITS_BLOCK) * FITS_BLOCK
+        if self.end is None and len(self.buffer) > HEADER_MAX_BLOCKS * FITS_BLOCK:
+            raise ValueError(f"No END card in the first {HEADER_MAX_BLOCKS} FITS blocks")
+        return self.end is not None
+
+    def header(self) -> fits.Header:
+        if self.end is None:
+            raise ValueError("FITS header is incomplete (no END card)")
+        return fits.Header.fromstring(bytes(self.buffer[:self.end]))
+
+
+def offset_unsigned_dtype(raw_dtype: np.dtype, bscale: float, bzero: float) -> Optional[np.dtype]:
+    """uintN for the FITS unsigned-integer convention (intN data, BSCALE 1, BZERO 2**(N-1)), else None."""
+    if raw_dtype.kind != 'i' or raw_dtype.itemsize == 1 or bscale != 1.0:
+        return None
+    bits = raw_dtype.itemsize * 8
+    return np.dtype(f'uint{bits}') if bzero == 2 ** (bits - 1) else None
+
+
+class MemmapImage:
+    """
+    Memory-mapped view of the primary image of a FITS file.
+
+    The raw (unscaled) pixel array stays on disk; read_rows() decodes just the
+    requested band, applying BZERO/BSCALE, into the requested dtype. Any
+    number of axes is accepted (e.g. 3-plane RGB/OSC cubes); the band readers
+    (FrameStack) require 2D frames.
+    """
+
+    def __init__(self, path: str, hdu_index: int = 0):
+        self.path = path
+        self._hdul = fits.open(path, memmap=True, do_not_scale_image_data=True)
+        hdu = self._hdul[hdu_index]
+        self.header = hdu.header
+        self._raw = hdu.data
+        if self._raw is None:
+            self._hdul.close()
+            raise ValueError(f"No image data in {path}")
+        self.bscale = float(self.header.get('BSCALE', 1.0))
+        self.bzero = float(self.header.get('BZERO', 0.0))
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._raw.shape
+
+    @property
+    def raw_dtype(self) -> np.dtype:
+        return self._raw.dtype
+
+    @property
+    def is_scaled(self) -> bool:
+        return self.bscale != 1.0 or self.bzero != 0.0
+
+    def raw_rows(self, y0: int, y1: int) -> np.ndarray:
+        """Stored (unscaled) values of rows [y0, y1) (first axis), as a view of the memory map."""
+        return self._raw[y0:y1]
+
+    def pixels(self) -> np.ndarray:
+        """
+        The whole image as a read-only array of physical values:
+        - unscaled data is the memory map itself (no copy)
+        - unsigned integers stored with BZERO = 2**(bits-1) come back as uintN,
+          decoded by flipping the sign bit (one copy at the stored width)
+        - any other BZERO/BSCALE is decoded to float32, as astropy would
+        """
+        if not self.is_scaled:
+            image = self._raw.view()
+        else:
+            unsigned = offset_unsigned_dtype(self._raw.dtype, self.bscale, self.bzero)
+            if unsigned is not None:
+                sign_bit = unsigned.type(1 << (unsigned.itemsize * 8 - 1))
+                image = np.bitwise_xor(self._raw.view(unsigned.newbyteorder('>')), sign_bit, dtype=unsigned)
+            else:
+                image = self.read_rows(0, self.shape[0], dtype=np.float32)
+        image.flags.writeable = False
+        return image
+
+    def read_rows(self, y0: int, y1: int, dtype=np.float64, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Decode rows [y0, y1) (first axis) as physical values in `dtype`, optionally into `out`."""
+        band = self._raw[y0:y1]
+        if out is None:
+            out = np.empty(band.shape, dtype=dtype)
+        out[...] = band
+        if self.bscale != 1.0:
+            out *= self.bscale
+        if self.bzero != 0.0:
+            out += self.bzero
+        return out
+
+    def close(self):
+        self._raw = None
+        self._hdul.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_image(path: str, hdu_index: int = 0) -> np.ndarray:
+    """Read-only physical pixel values of a FITS image of any shape (see MemmapImage.pixels); stays valid after closing."""
+    with MemmapImage(path, hdu_index) as image:
+        return image.pixels()
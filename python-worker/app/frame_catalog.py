@@ -0,0 +1,121 @@
+"""
+frame_catalog.py
+
+Frame selection over the fits_metadata table (written by /validate-fits and
+the backfill) instead of downloading files or guessing from path names.
+- frame_type, camera, binning, gain, temperature and exposure_time are
+  generated columns over the metadata JSONB, indexed per user and per
+  project (supabase/migrations/*_fits_metadata_catalog_*.sql)
+- find_frames() selects frames by those columns, with tolerances for
+  temperature, exposure and gain, in one query
+- lookup_frames() returns the catalog entries of given storage paths; paths
+  missing from the result have never been validated and callers fall back
+  to reading their headers
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .db import acquire
+except ImportError:  # imported as a top-level module by app/services
+    from db import acquire
+
+CALIBRATION_FRAME_TYPES = ('bias', 'dark', 'flat', 'light')
+
+CATALOG_COLUMNS = 'file_path, project_id, frame_type, camera, binning, gain, temperature, exposure_time, metadata'
+
+
+@dataclass
+class FrameQuery:
+    user_id: str
+    project_ids: Optional[List[str]] = None
+    frame_type: Optional[str] = None
+    camera: Optional[str] = None
+    binning: Optional[str] = None
+    gain: Optional[float] = None
+    gain_tolerance: float = 0.0
+    temperature: Optional[float] = None
+    temperature_tolerance: float = 1.0
+    exposure_time: Optional[float] = None
+    exposure_tolerance: float = 0.1
+    # Restrict the search to these storage paths
+    file_paths: Optional[List[str]] = None
+
+
+@dataclass
+class CatalogFrame:
+    file_path: str
+    project_id: str
+    frame_type: Optional[str]
+    camera: Optional[str]
+    binning: Optional[str]
+    gain: Optional[float]
+    temperature: Optional[float]
+    exposure_time: Optional[float]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_row(cls, row) -> 'CatalogFrame':
+        values = dict(row)
+        metadata = values.pop('metadata') or {}
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        return cls(metadata=metadata, **values)
+
+    def as_header(self) -> Dict[str, Any]:
+        """The indexed values under their FITS keywords, for code that reads headers."""
+        return {'IMAGETYP': self.frame_type, 'INSTRUME': self.camera, 'GAIN': self.gain,
+                'CCD-TEMP': self.temperature, 'EXPTIME': self.exposure_time}
+
+
+def build_query(query: FrameQuery) -> Tuple[str, list]:
+    """SQL and arguments for find_frames()."""
+    conditions = ['user_id = $1']
+    args: list = [query.user_id]
+
+    def arg(value) -> str:
+        args.append(value)
+        return f'${len(args)}'
+
+    if query.project_ids:
+        conditions.append(f'project_id = any({arg(list(query.project_ids))}::text[])')
+    if query.file_paths is not None:
+        conditions.append(f'file_path = any({arg(list(query.file_paths))}::text[])')
+    for column in ('frame_type', 'camera', 'binning'):
+        value = getattr(query, column)
+        if value is not None:
+            conditions.append(f'{column} = {arg(value)}')
+    for column, value, tolerance in (('gain', query.gain, query.gain_tolerance),
+                                     ('temperature', query.temperature, query.temperature_tolerance),
+                                     ('exposure_time', query.exposure_time, query.exposure_tolerance)):
+        if value is None:
+            continue
+        if tolerance:
+            conditions.append(f'{column} between {arg(float(value) - tolerance)} and {arg(float(value) + tolerance)}')
+        else:
+            conditions.append(f'{column} = {arg(float(value))}')
+    sql = f"select {CATALOG_COLUMNS} from fits_metadata where {' and '.join(conditions)} order by file_path"
+    return sql, args
+
+
+async def find_frames(query: FrameQuery) -> List[CatalogFrame]:
+    sql, args = build_query(query)
+    async with acquire() as conn:
+        rows = await conn.fetch(sql, *args)
+    return [CatalogFrame.from_row(row) for row in rows]
+
+
+async def lookup_frames(file_paths: Sequence[str]) -> Dict[str, CatalogFrame]:
+    """Catalog entries of the given storage paths ({} if the catalog can't be reached)."""
+    if not file_paths:
+        return {}
+    try:
+        async with acquire() as conn:
+            rows = await conn.fetch(f"select {CATALOG_COLUMNS} from fits_metadata where file_path = any($1::text[])",
+                                    list(file_paths))
+    except Exception as e:
+        print(f"[CATALOG] Frame lookup failed, falling back to headers: {e}", flush=True)
+        return {}
+    return {row['file_path']: CatalogFrame.from_row(row) for row in rows}
@@ -1,10 +1,15 @@
 import numpy as np
-from astropy.io import fits
 import os
 from typing import List, Dict, Tuple, Optional
 import scipy.stats as scipy_stats
 from dataclasses import dataclass
 import logging
+try:
+    from .fits_io import load_image
+    from .frame_statistics import PixelCounts, pixel_counts
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import load_image
+    from frame_statistics import PixelCounts, pixel_counts
 
 logger = logging.getLogger(__name__)
 
@@ -37,42 +42,21 @@ class GroupConsistencyAnalysis:
 def compute_frame_statistics(fits_path: str) -> Dict:
     """Compute detailed statistics for a single frame"""
     try:
-        with fits.open(fits_path) as hdul:
-            data = hdul[0].data.astype(np.float64)
-            
-        # Basic statistics
-        frame_stats = {
-            'path': fits_path,
-            'mean': float(np.mean(data)),
-            'median': float(np.median(data)),
-            'std': float(np.std(data)),
-            'min': float(np.min(data)),
-            'max': float(np.max(data)),
-            'shape': data.shape,
-            'total_pixels': data.size
-        }
-        
-        # Advanced statistics
-        frame_stats['mad'] = float(np.median(np.abs(data - frame_stats['median'])))  # Mean Absolute Deviation
-        frame_stats['skewness'] = float(scipy_stats.skew(data.flatten()))
-        frame_stats['kurtosis'] = float(scipy_stats.kurtosis(data.flatten()))
-        
-        # Percentile statistics
-        percentiles = [1, 5, 10, 25, 75, 90, 95, 99]
-        frame_stats['percentiles'] = {p: float(np.percentile(data, p)) for p in percentiles}
-        
-        # Histogram for comparison
-        hist, bin_edges = np.histogram(data, bins=100, density=True)
-        frame_stats['histogram'] = hist
-        frame_stats['histogram_bins'] = bin_edges
+        # Read-only at the stored width; the reductions promote as needed
+        data = load_image(fits_path)
+        counts = pixel_counts(data)
+        if counts is not None:
+            frame_stats = _counted_frame_statistics(fits_path, data, counts)
+        else:
+            frame_stats = _float_frame_statistics(fits_path, data)
         
-        # Spatial statistics (divide into quadrants)
-        h, w = data.shape
+        # Spatial statistics (divide into quadrants; colour planes are pooled)
+        h, w = data.shape[-2:]
         quadrants = {
-            'top_left': data[:h//2, :w//2],
-            'top_right': data[:h//2, w//2:],
-            'bottom_left': data[h//2:, :w//2], 
-            'bottom_right': data[h//2:, w//2:]
+            'top_left': data[..., :h//2, :w//2],
+            'top_right': data[..., :h//2, w//2:],
+            'bottom_left': data[..., h//2:, :w//2], 
+            'bottom_right': data[..., h//2:, w//2:]
         }
         
         frame_stats['quadrant_means'] = {k: float(np.mean(v)) for k, v in quadrants.items()}
@@ -84,6 +68,57 @@ def compute_frame_statistics(fits_path: str) -> Dict:
         logger.error(f"Error computing statistics for {fits_path}: {e}")
         return None
 
+_PERCENTILES = [1, 5, 10, 25, 75, 90, 95, 99]
+
+def _counted_frame_statistics(fits_path: str, data: np.ndarray, counts: PixelCounts) -> Dict:
+    """Statistics of an 8/16-bit frame, read off its per-value counts (same values as _float_frame_statistics)"""
+    hist, bin_edges = counts.histogram(100, density=True)
+    return {
+        'path': fits_path,
+        'mean': counts.mean,
+        'median': counts.median,
+        'std': counts.std,
+        'min': counts.min,
+        'max': counts.max,
+        'shape': data.shape,
+        'total_pixels': data.size,
+        'mad': counts.mad(),
+        'skewness': counts.skewness,
+        'kurtosis': counts.kurtosis,
+        'percentiles': dict(zip(_PERCENTILES, map(float, counts.percentile(_PERCENTILES)))),
+        'histogram': hist,
+        'histogram_bins': bin_edges,
+    }
+
+def _float_frame_statistics(fits_path: str, data: np.ndarray) -> Dict:
+    """Statistics of any other frame, computed on the pixels"""
+    # Basic statistics
+    frame_stats = {
+        'path': fits_path,
+        'mean': float(np.mean(data)),
+        'median': float(np.median(data)),
+        'std': float(np.std(data)),
+        'min': float(np.min(data)),
+        'max': float(np.max(data)),
+        'shape': data.shape,
+        'total_pixels': data.size
+    }
+    
+    # Advanced statistics
+    frame_stats['mad'] = float(np.median(np.abs(data - frame_stats['median'])))  # Mean Absolute Deviation
+    frame_stats['skewness'] = float(scipy_stats.skew(data.ravel()))
+    frame_stats['kurtosis'] = float(scipy_stats.kurtosis(data.ravel()))
+    
+    # Percentile statistics
+    frame_stats['percentiles'] = dict(zip(_PERCENTILES, map(float, np.percentile(data, _PERCENTILES))))
+    
+    # Histogram for comparison
+    hist, bin_edges = np.histogram(data, bins=100, density=True)
+    frame_stats['histogram'] = hist
+    frame_stats['histogram_bins'] = bin_edges
+    
+    return frame_stats
+
 def compute_histogram_similarity(hist1: np.ndarray, hist2: np.ndarray) -> float:
     """Compute histogram similarity using correlation coefficient"""
     try:
@@ -95,16 +130,16 @@ def compute_histogram_similarity(hist1: np.ndarray, hist2: np.ndarray) -> float:
 def compute_pixel_correlation(data1: np.ndarray, data2: np.ndarray, sample_size: int = 10000) -> float:
     """Compute pixel-wise correlation between two frames using sampling for efficiency"""
     try:
-        # Flatten and sample for efficiency on large images
-        flat1 = data1.flatten()
-        flat2 = data2.flatten()
+        # Sample before promoting so only sample_size pixels are converted
+        flat1 = data1.ravel()
+        flat2 = data2.ravel()
         
         if len(flat1) > sample_size:
-            indices = np.random.choice(len(flat1), sample_size, replace=False)
+            indices = np.random.default_rng().choice(len(flat1), sample_size, replace=False)
             flat1 = flat1[indices]
             flat2 = flat2[indices]
             
-        correlation = np.corrcoef(flat1, flat2)[0, 1]
+        correlation = np.corrcoef(flat1.astype(np.float64), flat2.astype(np.float64))[0, 1]
         return max(0.0, correlation)  # Clamp to 0-1 range
     except:
         return 0.0
@@ -161,8 +196,7 @@ def analyze_frame_consistency(fits_paths: List[str],
     reference_path = all_stats[reference_frame_idx]['path']
     
     try:
-        with fits.open(reference_path) as hdul:
-            reference_data = hdul[0].data.astype(np.float64)
+        reference_data = load_image(reference_path)
     except:
         reference_data = None
     
@@ -190,9 +224,8 @@ def analyze_frame_consistency(fits_paths: List[str],
         pixel_correlation = 0.0
         if reference_data is not None and i != reference_frame_idx:
             try:
-                with fits.open(path) as hdul:
-                    frame_data = hdul[0].data.astype(np.float64)
-                    pixel_correlation = compute_pixel_correlation(frame_data, reference_data)
+                frame_data = load_image(path)
+                pixel_correlation = compute_pixel_correlation(frame_data, reference_data)
             except:
                 pixel_correlation = 0.0
         elif i == reference_frame_idx:
@@ -0,0 +1,214 @@
+"""
+frame_stack.py
+
+FrameStack: the frames of one calibration job, opened once and shared by
+analysis, stacking and dark scaling.
+- Every file is opened (memory-mapped) exactly once per job
+- Small stacks are decoded once into an in-memory cube; large ones stay
+  memory-mapped and are decoded band by band on demand
+- Consumers read row bands (read_band / iter_bands) so they never need an
+  N x H x W float64 copy of their own
+"""
+
+import numpy as np
+import os
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+from .fits_io import MemmapImage
+
+# Largest decoded cube (all frames) kept in memory; bigger stacks stay memory-mapped
+DEFAULT_INMEMORY_MB = float(os.environ.get('FRAMESTACK_MEMORY_MB', 1024))
+
+# Raw integer types whose physical values are exact in float32 (BSCALE == 1, integer BZERO)
+_EXACT_FLOAT32_TYPES = (np.uint8, np.int8, np.uint16, np.int16)
+
+
+# Bits of the sort key resolved per pass of FrameStack._float_median
+_RADIX_BITS = 16
+_SIGN_BIT = np.uint64(1 << 63)
+
+
+def _float_keys(values: np.ndarray) -> np.ndarray:
+    """Unsigned integer keys whose order matches the float64 order of `values`."""
+    bits = values.astype(np.float64, copy=False).view(np.uint64)
+    return np.where(bits & _SIGN_BIT, ~bits, bits | _SIGN_BIT)
+
+
+def _key_to_float(key: int) -> float:
+    key = np.uint64(key)
+    bits = key ^ _SIGN_BIT if key & _SIGN_BIT else ~key
+    return float(np.array(bits, dtype=np.uint64).view(np.float64))
+
+
+class FrameStack:
+    """
+    Frames of one job, opened once and shared by every consumer.
+
+    in_memory: True decodes every frame once into a cube, False keeps them
+    memory-mapped, None (default) decodes only if the cube fits in
+    FRAMESTACK_MEMORY_MB.
+    """
+
+    def __init__(self, file_list: Sequence[str], in_memory: Optional[bool] = None,
+                 memory_mb: Optional[float] = None):
+        if not file_list:
+            raise ValueError("No frames to stack")
+        self.paths = list(file_list)
+        self.frames: List[MemmapImage] = []
+        self._cube = None
+        try:
+            for f in self.paths:
+                self.frames.append(MemmapImage(f))
+                if len(self.frames[-1].shape) != 2:
+                    raise ValueError(f"Expected a 2D image in {f}, got shape {self.frames[-1].shape}")
+            shapes = {fr.shape for fr in self.frames}
+            if len(shapes) > 1:
+                raise ValueError(f"All frames must have the same shape, got {sorted(shapes)}")
+            if in_memory is None:
+                budget = (memory_mb if memory_mb is not None else DEFAULT_INMEMORY_MB) * 1024 * 1024
+                in_memory = self.nbytes(self.cube_dtype) <= budget
+            if in_memory:
+                self._decode_all()
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def wrap(cls, frames: Union['FrameStack', Sequence[str]], **kwargs) -> Tuple['FrameStack', bool]:
+        """Return (stack, owned): an existing FrameStack as-is, or a new one built from file paths."""
+        if isinstance(frames, FrameStack):
+            return frames, False
+        return cls(frames, **kwargs), True
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.frames[0].shape
+
+    @property
+    def in_memory(self) -> bool:
+        return self._cube is not None
+
+    @property
+    def is_integer(self) -> bool:
+        """True when every frame's physical values are exact integers of at most 16 bits (raw ADU)."""
+        return all(fr.raw_dtype.type in _EXACT_FLOAT32_TYPES and fr.bscale == 1.0 and float(fr.bzero).is_integer()
+                   for fr in self.frames)
+
+    @property
+    def cube_dtype(self):
+        # float32 holds 16-bit ADU exactly; anything else keeps float64 precision
+        return np.float32 if self.is_integer else np.float64
+
+    def nbytes(self, dtype=np.float64) -> int:
+        height, width = self.shape
+        return len(self.frames) * height * width * np.dtype(dtype).itemsize
+
+    def _decode_all(self):
+        height, width = self.shape
+        self._cube = np.empty((len(self.frames), height, width), dtype=self.cube_dtype)
+        for i, frame in enumerate(self.frames):
+            frame.read_rows(0, height, out=self._cube[i])
+
+    def read_band(self, y0: int, y1: int, out: Optional[np.ndarray] = None, dtype=np.float64) -> np.ndarray:
+        """Physical values of rows [y0, y1) of every frame, shape (n_frames, y1 - y0, width)."""
+        if out is None:
+            out = np.empty((len(self.frames), y1 - y0, self.shape[1]), dtype=dtype)
+        if self._cube is not None:
+            out[...] = self._cube[:, y0:y1]
+        else:
+            for i, frame in enumerate(self.frames):
+                frame.read_rows(y0, y1, out=out[i])
+        return out
+
+    def iter_bands(self, band_height: int, dtype=np.float64) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """Yield (y0, y1, band) over the whole frame; the band buffer is reused between steps."""
+        height, width = self.shape
+        band_height = int(max(1, min(band_height, height)))
+        buf = np.empty((len(self.frames), band_height, width), dtype=dtype)
+        for y0 in range(0, height, band_height):
+            y1 = min(y0 + band_height, height)
+            yield y0, y1, self.read_band(y0, y1, out=buf[:, :y1 - y0])
+
+    def frame(self, index: int, dtype=np.float32) -> np.ndarray:
+        """One whole decoded frame."""
+        if self._cube is not None:
+            return self._cube[index].astype(dtype, copy=False)
+        height, _ = self.shape
+        return self.frames[index].read_rows(0, height, dtype=dtype)
+
+    def median(self) -> float:
+        """Median of every pixel of every frame (same value as np.median(np.stack(frames)))."""
+        if self._cube is not None:
+            return float(np.median(self._cube))
+        if self.is_integer:
+            return self._integer_median()
+        return self._float_median()
+
+    def _integer_median(self) -> float:
+        # Exact median of raw ADU data from a value histogram, one band at a time
+        lo = min(int(np.iinfo(fr.raw_dtype).min + fr.bzero) for fr in self.frames)
+        hi = max(int(np.iinfo(fr.raw_dtype).max + fr.bzero) for fr in self.frames)
+        counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        height, _ = self.shape
+        band_height = max(1, (64 * 1024 * 1024) // max(1, self.shape[1] * 8))
+        for frame in self.frames:
+            for y0 in range(0, height, band_height):
+                raw = frame.raw_rows(y0, y0 + band_height)
+                counts += np.bincount((raw.astype(np.int64) + int(frame.bzero - lo)).ravel(), minlength=counts.size)
+        total = int(counts.sum())
+        cumulative = np.cumsum(counts)
+        upper = int(np.searchsorted(cumulative, total // 2, side='right')) + lo
+        if total % 2:
+            return float(upper)
+        lower = int(np.searchsorted(cumulative, total // 2 - 1, side='right')) + lo
+        return (lower + upper) / 2.0
+
+    def _median_bands(self) -> Iterator[np.ndarray]:
+        height, width = self.shape
+        band_height = max(1, (64 * 1024 * 1024) // max(1, width * 8))
+        for frame in self.frames:
+            for y0 in range(0, height, band_height):
+                yield frame.read_rows(y0, min(y0 + band_height, height))
+
+    def _float_median(self) -> float:
+        # Exact median of memory-mapped float data without decoding the whole cube:
+        # radix selection on order-preserving integer keys, 16 bits per pass over the bands
+        total = 0
+        for band in self._median_bands():
+            if np.isnan(band).any():
+                return float('nan')
+            total += band.size
+        ranks = sorted({(total - 1) // 2, total // 2})
+        prefixes = {rank: 0 for rank in ranks}
+        remaining = {rank: rank for rank in ranks}
+        for shift in (48, 32, 16, 0):
+            counts = {prefix: np.zeros(1 << _RADIX_BITS, dtype=np.int64) for prefix in set(prefixes.values())}
+            for band in self._median_bands():
+                keys = _float_keys(band.ravel())
+                for prefix, hist in counts.items():
+                    selected = keys if shift == 48 else keys[(keys >> np.uint64(shift + _RADIX_BITS)) == np.uint64(prefix >> (shift + _RADIX_BITS))]
+                    digits = ((selected >> np.uint64(shift)) & np.uint64((1 << _RADIX_BITS) - 1)).astype(np.int64)
+                    hist += np.bincount(digits, minlength=hist.size)
+            for rank in ranks:
+                cumulative = np.cumsum(counts[prefixes[rank]])
+                digit = int(np.searchsorted(cumulative, remaining[rank], side='right'))
+                if digit:
+                    remaining[rank] -= int(cumulative[digit - 1])
+                prefixes[rank] |= digit << shift
+        values = [_key_to_float(prefixes[rank]) for rank in ranks]
+        return float(sum(values) / len(values))
+
+    def close(self):
+        self._cube = None
+        for frame in self.frames:
+            frame.close()
+        self.frames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
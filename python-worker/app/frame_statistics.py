@@ -0,0 +1,234 @@
+"""
+frame_statistics.py
+
+Fused summary statistics for a single image (master frames, superdarks).
+- Pass 1: count, extrema, mean and variance, merged chunk by chunk (Chan et al.)
+- Pass 2: display histogram, outlier / hot / saturated counts and a fine
+  histogram around the mean from which the median is read
+- Each chunk is small enough to stay in cache, so the image is streamed from
+  memory twice instead of once per statistic
+- Unsigned 8/16-bit images (almost all camera data) skip both passes: one
+  np.bincount over the raw values gives exact counts per value, and the
+  histogram, median, percentiles, MAD, moments and threshold counts are read
+  off those in O(N + 65536) (see PixelCounts)
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional
+
+# Elements per chunk
+_CHUNK = 1 << 20
+
+# Bins of the fine histogram the median is read from. It spans mean ± std, which
+# always contains the median (|median - mean| <= std), so the median is located
+# to within 2 * std / _MEDIAN_BINS.
+_MEDIAN_BINS = 1 << 16
+
+
+@dataclass
+class FrameStatistics:
+    """Summary statistics of one image; `median` is approximate (see _MEDIAN_BINS) unless the image is integer."""
+    count: int
+    mean: float
+    std: float
+    min: float
+    max: float
+    median: float
+    histogram: np.ndarray
+    bin_edges: np.ndarray
+    outlier_count: int
+    hot_count: int
+    saturated_count: int
+
+    @property
+    def outlier_ratio(self) -> float:
+        return self.outlier_count / self.count if self.count else 0.0
+
+
+@dataclass
+class PixelCounts:
+    """Exact pixel counts per value of an unsigned integer image; counts[i] pixels equal values[i]."""
+    values: np.ndarray  # float64, every integer from min to max
+    counts: np.ndarray  # int64
+    n: int
+
+    @property
+    def min(self) -> float:
+        return float(self.values[0])
+
+    @property
+    def max(self) -> float:
+        return float(self.values[-1])
+
+    @property
+    def mean(self) -> float:
+        return float(np.dot(self.counts, self.values)) / self.n
+
+    def moment(self, order: int) -> float:
+        """Central moment, as scipy.stats.moment."""
+        return float(np.dot(self.counts, (self.values - self.mean) ** order)) / self.n
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.moment(2)))
+
+    @property
+    def skewness(self) -> float:
+        """As scipy.stats.skew (biased); 0 for a constant image."""
+        m2 = self.moment(2)
+        return self.moment(3) / m2 ** 1.5 if m2 > 0 else 0.0
+
+    @property
+    def kurtosis(self) -> float:
+        """As scipy.stats.kurtosis (Fisher, biased); 0 for a constant image."""
+        m2 = self.moment(2)
+        return self.moment(4) / m2 ** 2 - 3.0 if m2 > 0 else 0.0
+
+    def percentile(self, q):
+        """As np.percentile(data, q) with the default linear interpolation."""
+        rank = (self.n - 1) * np.asarray(q, dtype=np.float64) / 100.0
+        below = np.floor(rank)
+        lo = _value_at_rank(self.values, self.counts, below)
+        hi = _value_at_rank(self.values, self.counts, np.minimum(below + 1, self.n - 1))
+        result = lo + (rank - below) * (hi - lo)
+        return float(result) if result.ndim == 0 else result
+
+    @property
+    def median(self) -> float:
+        return self.percentile(50)
+
+    def mad(self, center: Optional[float] = None) -> float:
+        """Median absolute deviation from `center` (the median by default)."""
+        deviations = np.abs(self.values - (self.median if center is None else center))
+        order = np.argsort(deviations, kind='stable')
+        deviations, counts = deviations[order], self.counts[order]
+        ranks = np.array([(self.n - 1) // 2, self.n // 2], dtype=np.float64)
+        return float(_value_at_rank(deviations, counts, ranks).mean())
+
+    def count(self, mask: np.ndarray) -> int:
+        """Pixels whose value satisfies `mask`, a condition on `values` (e.g. values > 60000)."""
+        return int(self.counts[mask].sum())
+
+    def histogram(self, bins: int, density: bool = False):
+        """As np.histogram(data, bins, density=density)."""
+        hist, edges = np.histogram(self.values, bins=bins, range=(self.min, self.max),
+                                   weights=self.counts, density=density)
+        return (hist if density else hist.astype(np.int64)), edges
+
+
+def _value_at_rank(values: np.ndarray, counts: np.ndarray, rank: np.ndarray) -> np.ndarray:
+    # values[i] holds ranks cumulative[i-1] .. cumulative[i]-1 of the sorted pixels
+    cumulative = np.cumsum(counts)
+    return values[np.searchsorted(cumulative, rank, side='right')]
+
+
+def pixel_counts(data: np.ndarray) -> Optional[PixelCounts]:
+    """Per-value counts of an unsigned 8/16-bit image, or None for any other dtype (use the float paths)."""
+    flat = np.asarray(data).ravel()
+    if flat.dtype.kind != 'u' or flat.dtype.itemsize > 2 or flat.size == 0:
+        return None
+    counts = np.zeros(1 << (8 * flat.dtype.itemsize), dtype=np.int64)
+    # Chunked: bincount converts its input to intp
+    for i in range(0, flat.size, _CHUNK):
+        counts += np.bincount(flat[i:i + _CHUNK], minlength=counts.size)
+    occupied = np.flatnonzero(counts)
+    lo, hi = int(occupied[0]), int(occupied[-1])
+    return PixelCounts(np.arange(lo, hi + 1, dtype=np.float64), counts[lo:hi + 1], int(flat.size))
+
+
+def _chunks(flat: np.ndarray):
+    # (raw, float64) views of consecutive chunks
+    for i in range(0, flat.size, _CHUNK):
+        raw = flat[i:i + _CHUNK]
+        yield raw, raw.astype(np.float64, copy=False)
+
+
+def compute_frame_statistics(data: np.ndarray, bins: int = 64, outlier_sigma: float = 5.0,
+                             saturation: Optional[float] = None) -> FrameStatistics:
+    """
+    Moments, extrema, histogram and median of `data` in two passes.
+    bins: display histogram bins over [min, max] (same counts as np.histogram(data, bins))
+    outlier_sigma: outlier_count is |x - mean| > outlier_sigma * std, hot_count is x > mean + outlier_sigma * std
+    saturation: saturated_count is x >= saturation (0 when None)
+    """
+    flat = np.asarray(data).ravel()
+    if flat.size == 0:
+        raise ValueError("Cannot compute statistics of an empty image")
+    counts = pixel_counts(flat)
+    if counts is not None:
+        return _counted_frame_statistics(counts, bins, outlier_sigma, saturation)
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    # Extrema stay in the input dtype so the histogram bins match np.histogram(data, bins)
+    raw_lo = raw_hi = None
+    for raw, chunk in _chunks(flat):
+        chunk_n = chunk.size
+        chunk_mean = float(chunk.mean())
+        chunk_m2 = float(np.dot(chunk - chunk_mean, chunk - chunk_mean))
+        chunk_lo, chunk_hi = raw.min(), raw.max()
+        raw_lo = chunk_lo if raw_lo is None else min(raw_lo, chunk_lo)
+        raw_hi = chunk_hi if raw_hi is None else max(raw_hi, chunk_hi)
+        delta = chunk_mean - mean
+        total = n + chunk_n
+        mean += delta * chunk_n / total
+        m2 += chunk_m2 + delta * delta * n * chunk_n / total
+        n = total
+    std = float(np.sqrt(m2 / n))
+    lo, hi = float(raw_lo), float(raw_hi)
+
+    histogram = np.zeros(bins, dtype=np.int64)
+    fine_lo = max(lo, mean - std)
+    fine_hi = min(hi, mean + std)
+    fine_scale = _MEDIAN_BINS / (fine_hi - fine_lo) if fine_hi > fine_lo else 0.0
+    # Index 0 counts values below fine_lo; values above fine_hi go to the last bin, which
+    # never holds the median unless it sits on the top edge
+    fine = np.zeros(_MEDIAN_BINS + 1, dtype=np.int64)
+    index = np.empty(min(flat.size, _CHUNK), dtype=np.float64)
+    low_cut = mean - outlier_sigma * std
+    high_cut = mean + outlier_sigma * std
+    outliers = hot = saturated = 0
+    for raw, chunk in _chunks(flat):
+        histogram += np.histogram(raw, bins=bins, range=(raw_lo, raw_hi))[0]
+        hot_chunk = int(np.count_nonzero(chunk > high_cut))
+        hot += hot_chunk
+        outliers += hot_chunk + int(np.count_nonzero(chunk < low_cut))
+        if saturation is not None:
+            saturated += int(np.count_nonzero(chunk >= saturation))
+        shifted = index[:chunk.size]
+        np.subtract(chunk, fine_lo, out=shifted)
+        np.multiply(shifted, fine_scale, out=shifted)
+        np.add(shifted, 1.0, out=shifted)
+        np.clip(shifted, 0.0, _MEDIAN_BINS, out=shifted)
+        # Non-negative, so truncation is floor
+        fine += np.bincount(shifted.astype(np.intp), minlength=fine.size)
+    bin_edges = np.histogram_bin_edges(flat[:1], bins=bins, range=(raw_lo, raw_hi))
+    median = _histogram_median(fine[1:], int(fine[0]), n, fine_lo, fine_hi)
+    return FrameStatistics(n, mean, std, lo, hi, median, histogram, bin_edges, outliers, hot, saturated)
+
+
+def _counted_frame_statistics(counts: PixelCounts, bins: int, outlier_sigma: float,
+                              saturation: Optional[float]) -> FrameStatistics:
+    mean, std = counts.mean, counts.std
+    histogram, bin_edges = counts.histogram(bins)
+    hot = counts.count(counts.values > mean + outlier_sigma * std)
+    outliers = hot + counts.count(counts.values < mean - outlier_sigma * std)
+    saturated = counts.count(counts.values >= saturation) if saturation is not None else 0
+    return FrameStatistics(counts.n, mean, std, counts.min, counts.max, counts.median,
+                           histogram, bin_edges, outliers, hot, saturated)
+
+
+def _histogram_median(fine: np.ndarray, below: int, n: int, lo: float, hi: float) -> float:
+    if hi <= lo:
+        return lo
+    width = (hi - lo) / fine.size
+    cumulative = np.cumsum(fine) + below
+
+    def value_at(rank):
+        # Linear interpolation inside the bin holding the rank-th smallest value
+        b = int(np.searchsorted(cumulative, rank, side='right'))
+        before = int(cumulative[b - 1]) if b else below
+        return lo + width * (b + (rank - before + 0.5) / max(1, int(fine[b])))
+
+    return float((value_at((n - 1) // 2) + value_at(n // 2)) / 2)
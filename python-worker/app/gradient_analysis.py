@@ -8,8 +8,11 @@ Following industry standards:
 
 import numpy as np
 from scipy import ndimage
-from astropy.io import fits
 from typing import Dict, List, Tuple, Optional
+try:
+    from .fits_io import MemmapImage
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import MemmapImage
 
 class GradientAnalysisResult:
     """Results from gradient analysis of a calibration frame."""
@@ -187,9 +190,10 @@ def detect_vignetting_pattern(data: np.ndarray) -> Dict:
 def analyze_calibration_frame_gradients(fits_path: str, frame_type: str = None) -> GradientAnalysisResult:
     """Main function to analyze gradients in a calibration frame."""
     try:
-        with fits.open(fits_path) as hdul:
-            data = hdul[0].data.astype(np.float32)
-            header = hdul[0].header
+        with MemmapImage(fits_path) as image:
+            # Only medians, means and thresholds below: no float copy needed
+            data = image.pixels()
+            header = image.header
             
             if frame_type is None:
                 imagetyp = header.get('IMAGETYP', '').lower()
@@ -20,6 +20,12 @@ from typing import Dict, List, Tuple, Optional, Union
 from dataclasses import dataclass
 import logging
 import json
+try:
+    from .fits_io import MemmapImage
+    from .frame_statistics import PixelCounts, pixel_counts
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import MemmapImage
+    from frame_statistics import PixelCounts, pixel_counts
 
 logger = logging.getLogger(__name__)
 
@@ -145,9 +151,10 @@ class HistogramAnalyzer:
             HistogramAnalysisResult with comprehensive analysis
         """
         try:
-            with fits.open(fits_path) as hdul:
-                data = hdul[0].data.astype(np.float64)
-                header = hdul[0].header
+            with MemmapImage(fits_path) as image:
+                # Read-only, at the stored width; reductions below promote as needed
+                data = image.pixels()
+                header = image.header
                 
                 if frame_type is None:
                     frame_type = self._detect_frame_type(header, data)
@@ -156,23 +163,27 @@ class HistogramAnalyzer:
                 result.frame_path = fits_path
                 result.frame_type = frame_type
                 
+                # Exact per-value counts for 8/16-bit frames (None otherwise); the
+                # steps below read their statistics off these instead of the pixels
+                counts = pixel_counts(data)
+                
                 # Basic histogram computation
-                self._compute_histogram(data, result)
+                self._compute_histogram(data, result, counts)
                 
                 # Statistical analysis
-                self._compute_statistics(data, result)
+                self._compute_statistics(data, result, counts)
                 
                 # Distribution shape analysis
                 self._analyze_distribution_shape(data, result)
                 
                 # Outlier and anomaly detection
-                self._detect_outliers(data, result)
+                self._detect_outliers(data, result, counts)
                 
                 # Clipping and saturation analysis
-                self._analyze_clipping(data, result)
+                self._analyze_clipping(data, result, counts)
                 
                 # Pedestal analysis
-                self._analyze_pedestal_requirements(data, result)
+                self._analyze_pedestal_requirements(data, result, counts)
                 
                 # Frame-type specific analysis
                 self._perform_frame_specific_analysis(data, result)
@@ -217,39 +228,56 @@ class HistogramAnalyzer:
             else:
                 return 'unknown'
     
-    def _compute_histogram(self, data: np.ndarray, result: HistogramAnalysisResult):
+    def _compute_histogram(self, data: np.ndarray, result: HistogramAnalysisResult,
+                           counts: Optional[PixelCounts] = None):
         """Compute histogram with optimal binning."""
         # Use adaptive binning based on data range
-        data_range = np.max(data) - np.min(data)
+        if counts is not None:
+            data_range = counts.max - counts.min
+        else:
+            data_range = float(np.max(data)) - float(np.min(data))
         if data_range > 0:
             bins = min(self.bins, int(data_range))
         else:
             bins = 64
         
-        hist, bin_edges = np.histogram(data.flatten(), bins=bins)
+        if counts is not None:
+            hist, bin_edges = counts.histogram(bins)
+        else:
+            hist, bin_edges = np.histogram(data.ravel(), bins=bins)
         bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
         
         result.histogram = hist
         result.bin_edges = bin_edges
         result.bin_centers = bin_centers
     
-    def _compute_statistics(self, data: np.ndarray, result: HistogramAnalysisResult):
+    def _compute_statistics(self, data: np.ndarray, result: HistogramAnalysisResult,
+                            counts: Optional[PixelCounts] = None):
         """Compute comprehensive statistical measures."""
-        flat_data = data.flatten()
-        
-        result.mean = float(np.mean(flat_data))
-        result.median = float(np.median(flat_data))
-        result.std = float(np.std(flat_data))
-        result.variance = float(np.var(flat_data))
-        result.mad = float(np.median(np.abs(flat_data - result.median)))
-        
-        # Robust statistics
-        try:
-            result.skewness = float(stats.skew(flat_data))
-            result.kurtosis = float(stats.kurtosis(flat_data))
-        except:
-            result.skewness = 0.0
-            result.kurtosis = 0.0
+        if counts is not None:
+            result.mean = counts.mean
+            result.median = counts.median
+            result.std = counts.std
+            result.variance = result.std ** 2
+            result.mad = counts.mad()
+            result.skewness = counts.skewness
+            result.kurtosis = counts.kurtosis
+        else:
+            flat_data = data.ravel()
+            
+            result.mean = float(np.mean(flat_data))
+            result.median = float(np.median(flat_data))
+            result.std = float(np.std(flat_data))
+            result.variance = float(np.var(flat_data))
+            result.mad = float(np.median(np.abs(flat_data - result.median)))
+            
+            # Robust statistics
+            try:
+                result.skewness = float(stats.skew(flat_data))
+                result.kurtosis = float(stats.kurtosis(flat_data))
+            except:
+                result.skewness = 0.0
+                result.kurtosis = 0.0
         
         # Mode estimation from histogram
         if result.histogram is not None and len(result.histogram) > 0:
@@ -292,49 +320,58 @@ class HistogramAnalyzer:
         else:
             result.distribution_type = "multimodal"
     
-    def _detect_outliers(self, data: np.ndarray, result: HistogramAnalysisResult):
+    @staticmethod
+    def _pixel_counter(data: np.ndarray, counts: Optional[PixelCounts]):
+        """(values, total, count): count(condition on values) is the number of pixels meeting it."""
+        if counts is not None:
+            return counts.values, counts.n, counts.count
+        return data.ravel(), data.size, lambda mask: int(np.count_nonzero(mask))
+    
+    def _detect_outliers(self, data: np.ndarray, result: HistogramAnalysisResult,
+                         counts: Optional[PixelCounts] = None):
         """Detect various types of outliers and anomalous pixels."""
-        flat_data = data.flatten()
+        values, total_pixels, count = self._pixel_counter(data, counts)
         
         # Standard outlier detection (3-sigma rule)
         sigma_threshold = 3.0
-        outlier_mask = np.abs(flat_data - result.mean) > (sigma_threshold * result.std)
-        result.outlier_count = int(np.sum(outlier_mask))
-        result.outlier_percent = (result.outlier_count / len(flat_data)) * 100
+        outlier_mask = np.abs(values - result.mean) > (sigma_threshold * result.std)
+        result.outlier_count = count(outlier_mask)
+        result.outlier_percent = (result.outlier_count / total_pixels) * 100
         
         # Hot pixel detection (frame-type specific)
         if result.frame_type in ['bias', 'dark']:
             hot_threshold = result.mean + 5 * result.std
-            result.hot_pixel_count = int(np.sum(flat_data > hot_threshold))
+            result.hot_pixel_count = count(values > hot_threshold)
         
         # Cold pixel detection
         cold_threshold = result.mean - 5 * result.std
-        result.cold_pixel_count = int(np.sum(flat_data < cold_threshold))
+        result.cold_pixel_count = count(values < cold_threshold)
     
-    def _analyze_clipping(self, data: np.ndarray, result: HistogramAnalysisResult):
+    def _analyze_clipping(self, data: np.ndarray, result: HistogramAnalysisResult,
+                          counts: Optional[PixelCounts] = None):
         """Analyze clipping and saturation issues."""
-        flat_data = data.flatten()
-        total_pixels = len(flat_data)
+        values, total_pixels, count = self._pixel_counter(data, counts)
         
         # Zero pixel detection
-        zero_pixels = np.sum(flat_data <= 0)
+        zero_pixels = count(values <= 0)
         result.zero_pixel_percent = (zero_pixels / total_pixels) * 100
-        result.negative_pixel_count = int(np.sum(flat_data < 0))
+        result.negative_pixel_count = count(values < 0)
         
         # Saturation detection (assuming 16-bit data)
-        max_value = np.max(flat_data)
+        max_value = np.max(values)
         if max_value > 60000:  # Close to 16-bit saturation
-            saturated_pixels = np.sum(flat_data >= 60000)
+            saturated_pixels = count(values >= 60000)
             result.saturation_percent = (saturated_pixels / total_pixels) * 100
         
         # Clipping detection
         result.clipping_detected = (result.zero_pixel_percent > 0.1 or 
                                   result.saturation_percent > 0.1)
     
-    def _analyze_pedestal_requirements(self, data: np.ndarray, result: HistogramAnalysisResult):
+    def _analyze_pedestal_requirements(self, data: np.ndarray, result: HistogramAnalysisResult,
+                                       counts: Optional[PixelCounts] = None):
         """Analyze if pedestal correction is needed."""
         # Check for negative values or values close to zero
-        min_value = np.min(data)
+        min_value = counts.min if counts is not None else float(np.min(data))
         
         if min_value < 0:
             result.requires_pedestal = True
@@ -372,7 +409,7 @@ class HistogramAnalyzer:
         analysis['bias_level_normal'] = expected_min <= result.mean <= expected_max
         
         # Check histogram shape (should be narrow and centered)
-        data_range = np.max(data) - np.min(data)
+        data_range = float(np.max(data)) - float(np.min(data))
         analysis['histogram_narrow'] = data_range <= thresholds['max_range']
         
         return analysis
@@ -526,15 +563,21 @@ def analyze_calibration_frame_histograms(fits_paths: List[str],
     Returns:
         Dictionary with analysis results and summary
     """
-    analyzer = HistogramAnalyzer()
-    results = []
-    
-    for fits_path in fits_paths:
-        result = analyzer.analyze_frame_histogram(fits_path, frame_type)
-        # Convert to JSON-serializable format
-        result_dict = _convert_result_to_dict(result)
-        results.append(result_dict)
+    results = [analyze_frame_histogram_dict(fits_path, frame_type) for fits_path in fits_paths]
+    return summarize_frame_histograms(results)
+
+def analyze_frame_histogram_dict(fits_path: str, frame_type: str = None) -> Dict:
+    """
+    Analyze one frame and return its JSON-serializable result.
     
+    Module-level and picklable, so frames can be fanned out to a process pool
+    and combined with summarize_frame_histograms().
+    """
+    result = HistogramAnalyzer().analyze_frame_histogram(fits_path, frame_type)
+    return _convert_result_to_dict(result)
+
+def summarize_frame_histograms(results: List[Dict]) -> Dict:
+    """Combine per-frame results (in input order) into the analyze_calibration_frame_histograms() response."""
     # Generate summary statistics
     if results:
         scores = [r['histogram_score'] for r in results if r['histogram_score'] > 0]
@@ -0,0 +1,134 @@
+"""
+job_events.py
+
+Live job events for GET /jobs/{job_id}/events (Server-Sent Events).
+- publish() hands progress, stage and status events to the subscribers in
+  this process immediately (in-process pub/sub, no database access)
+- Events are also sent on NOTIFY job_events, coalesced per job and batched
+  at most once per JOB_PROGRESS_FLUSH_MS, so an API node can stream jobs
+  that run on remote workers (listen() on the API side)
+- NOTIFY payloads carry no result or diagnostics (8000-byte limit); the
+  stream reads the job row once when it sees a terminal status
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .db import acquire
+from .progress import JOB_PROGRESS_FLUSH_MS
+
+EVENTS_CHANNEL = 'job_events'
+
+# Fan events out over NOTIFY (needed when jobs run on separate worker nodes)
+JOB_EVENTS_NOTIFY = os.environ.get('JOB_EVENTS_NOTIFY', '1') == '1'
+
+# Fields too large for a NOTIFY payload
+_LOCAL_ONLY_FIELDS = ('result', 'diagnostics')
+
+
+class JobEventBus:
+    """Per-job subscriber queues, fed locally and from other processes' NOTIFYs."""
+
+    def __init__(self, flush_ms: float = JOB_PROGRESS_FLUSH_MS, notify: bool = JOB_EVENTS_NOTIFY):
+        self.flush_interval = flush_ms / 1000.0
+        self.notify = notify
+        # Tags this process's NOTIFYs so its own events are not delivered twice
+        self.origin = uuid.uuid4().hex
+        self._subscribers: Dict[str, List[Tuple[asyncio.Queue, asyncio.AbstractEventLoop]]] = defaultdict(list)
+        self._outgoing: Dict[str, dict] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Bind outgoing NOTIFYs to the running (application) loop."""
+        self._loop = asyncio.get_running_loop()
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers[job_id].append((queue, asyncio.get_running_loop()))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = [entry for entry in self._subscribers.get(job_id, []) if entry[0] is not queue]
+        if subscribers:
+            self._subscribers[job_id] = subscribers
+        else:
+            self._subscribers.pop(job_id, None)
+
+    def watching(self, job_id: str) -> bool:
+        return bool(self._subscribers.get(job_id))
+
+    def publish(self, job_id: str, **fields):
+        """Send an event (progress=, stage=, status=, error=, result=...) for the job."""
+        event = {'job_id': job_id, **{k: v for k, v in fields.items() if v is not None}}
+        self._deliver(event)
+        if self.notify and self._loop is not None and not self._loop.is_closed():
+            remote = {k: v for k, v in event.items() if k not in _LOCAL_ONLY_FIELDS}
+            if _running_loop() is self._loop:
+                self._queue_remote(remote)
+            else:
+                # e.g. insert_job from a background upload thread running its own loop
+                self._loop.call_soon_threadsafe(self._queue_remote, remote)
+
+    def _deliver(self, event: dict):
+        running = _running_loop()
+        for queue, loop in list(self._subscribers.get(event['job_id'], ())):
+            if loop is running:
+                queue.put_nowait(event)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _queue_remote(self, event: dict):
+        # Coalesce per job: the batch carries each job's latest progress / stage / status
+        self._outgoing.setdefault(event['job_id'], {}).update(event)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self._loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if not self._outgoing:
+            return
+        batch, self._outgoing = self._outgoing, {}
+        payloads = [json.dumps({**event, 'origin': self.origin}, default=str) for event in batch.values()]
+        try:
+            async with acquire() as conn:
+                await conn.execute("select pg_notify($1, payload) from unnest($2::text[]) as payload",
+                                   EVENTS_CHANNEL, payloads)
+        except Exception as e:
+            print(f"[EVENTS] Failed to NOTIFY {len(payloads)} job events: {e}", flush=True)
+
+    async def listen(self, conn):
+        """Deliver events NOTIFYed by other processes (conn must be a dedicated connection)."""
+        await conn.add_listener(EVENTS_CHANNEL, self._on_notify)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str):
+        event = json.loads(payload)
+        if event.pop('origin', None) != self.origin:
+            self._deliver(event)
+
+    async def close(self):
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# Bus shared by the API process and its embedded worker
+job_event_bus = JobEventBus()
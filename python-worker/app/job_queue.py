@@ -0,0 +1,258 @@
+"""
+job_queue.py
+
+Persistent job queue on the `jobs` table.
+- Submitting a job inserts a 'queued' row carrying its type, request payload
+  and priority, then NOTIFYs job_queue
+- Workers (worker.py, on any number of nodes) claim the highest-priority,
+  oldest queued job with FOR UPDATE SKIP LOCKED, so a job is claimed by
+  exactly one worker; they wake on LISTEN job_queue and poll as a fallback
+- Each worker caps how many jobs of each type it runs at once
+  (JOB_CONCURRENCY, e.g. "calibration=1,cosmic_ray=2,*=2")
+- Every claimed job gets a cancellation token (cancellation.py)
+- Running jobs heartbeat; a job whose worker stopped heartbeating (restart,
+  crash, OOM kill) is requeued until it has used JOB_MAX_ATTEMPTS, then failed
+
+Job types are registered by main.py next to their runners:
+register_job_type(name, request_model, runner); the runner is awaited as
+runner(request, job_id, *args) exactly as BackgroundTasks used to call it.
+"""
+
+import asyncio
+import json
+import os
+import socket
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .cancellation import cancellation_registry
+from .db import acquire, get_db
+
+QUEUE_CHANNEL = 'job_queue'
+
+# Jobs of each type one worker runs at once; '*' covers unlisted types
+DEFAULT_JOB_CONCURRENCY = os.environ.get('JOB_CONCURRENCY', 'calibration=1,*=2')
+
+# Priority overrides per job type (higher is claimed first), same format
+DEFAULT_JOB_PRIORITIES = os.environ.get('JOB_PRIORITIES', '')
+
+# Seconds between polls when no NOTIFY arrives
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 5))
+
+# Running jobs heartbeat this often; a job silent for JOB_LEASE_SECONDS is requeued
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 15))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 120))
+
+# Claims per job before a job that keeps losing its worker is failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+
+# Seconds a stopping worker waits for its running jobs before abandoning them to the lease
+JOB_DRAIN_SECONDS = float(os.environ.get('JOB_DRAIN_SECONDS', 60))
+
+
+@dataclass
+class JobType:
+    name: str
+    model: type  # pydantic request model
+    runner: Callable[..., Awaitable[Any]]
+    priority: int = 0
+
+
+JOB_TYPES: Dict[str, JobType] = {}
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """'calibration=1,*=2' -> {'calibration': 1, '*': 2}."""
+    limits = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        if not value:
+            raise ValueError(f"Expected name=value in '{spec}', got '{item}'")
+        limits[name.strip()] = int(value)
+    return limits
+
+
+def register_job_type(name: str, model: type, runner: Callable[..., Awaitable[Any]], priority: int = 0):
+    """Make `runner` claimable by workers as job type `name` (JOB_PRIORITIES overrides `priority`)."""
+    priority = parse_limits(DEFAULT_JOB_PRIORITIES).get(name, priority)
+    JOB_TYPES[name] = JobType(name, model, runner, priority)
+
+
+def encode_payload(request, args=()) -> str:
+    return json.dumps({'request': request.model_dump(mode='json'), 'args': list(args)})
+
+
+def decode_payload(job_type: JobType, payload) -> tuple:
+    """(request, args) for job_type.runner from a stored payload."""
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return job_type.model.model_validate(payload['request']), payload.get('args', [])
+
+
+async def enqueue_job(job_id: str, job_type: str, request, *args, priority: Optional[int] = None):
+    """Queue `job_type` for `request`; a worker calls its runner as runner(request, job_id, *args)."""
+    spec = JOB_TYPES[job_type]
+    async with acquire() as conn:
+        await conn.execute("""
+            insert into jobs (job_id, status, progress, job_type, payload, priority, attempts)
+            values ($1, 'queued', 0, $2, $3, $4, 0)
+            on conflict (job_id) do update set
+                status = 'queued', progress = 0, error = null, job_type = excluded.job_type,
+                payload = excluded.payload, priority = excluded.priority, attempts = 0
+        """, job_id, job_type, encode_payload(request, args), spec.priority if priority is None else priority)
+        await conn.execute("select pg_notify($1, $2)", QUEUE_CHANNEL, job_type)
+
+
+async def claim_job(conn, job_types: List[str], worker_id: str):
+    """Claim the next queued job of one of `job_types`, or None."""
+    return await conn.fetchrow("""
+        update jobs set status = 'running', locked_by = $2, heartbeat_at = now(), attempts = attempts + 1
+        where job_id = (
+            select job_id from jobs
+            where status = 'queued' and job_type = any($1::text[])
+            order by priority desc, created_at
+            limit 1
+            for update skip locked
+        )
+        returning job_id, job_type, payload, attempts
+    """, job_types, worker_id)
+
+
+async def requeue_stale_jobs(conn, lease_seconds: float = JOB_LEASE_SECONDS,
+                             max_attempts: int = JOB_MAX_ATTEMPTS):
+    """Requeue (or fail, once out of attempts) running jobs whose worker stopped heartbeating."""
+    return await conn.fetch("""
+        update jobs set
+            status = case when attempts >= $2 then 'failed' else 'queued' end,
+            error = case when attempts >= $2 then 'Job worker stopped while running the job.' else error end,
+            locked_by = null,
+            heartbeat_at = null
+        where status = 'running' and locked_by is not null
+            and heartbeat_at < now() - make_interval(secs => $1)
+        returning job_id, status
+    """, float(lease_seconds), max_attempts)
+
+
+class JobWorker:
+    """Claims and runs queued jobs within per-type concurrency limits until stopped."""
+
+    def __init__(self, worker_id: Optional[str] = None, limits: Optional[Dict[str, int]] = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.limits = parse_limits(DEFAULT_JOB_CONCURRENCY) if limits is None else limits
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._active = Counter()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def limit(self, job_type: str) -> int:
+        return self.limits.get(job_type, self.limits.get('*', 1))
+
+    def claimable_types(self) -> List[str]:
+        """Registered job types with a free slot on this worker."""
+        return [name for name in JOB_TYPES if self._active[name] < self.limit(name)]
+
+    def stop(self):
+        """Stop claiming; run() returns once the running jobs finish (or JOB_DRAIN_SECONDS pass)."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _notify(self, *_):
+        self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        listener = None
+        try:
+            # LISTEN needs a dedicated connection, outside the pool
+            listener = await get_db()
+            await listener.add_listener(QUEUE_CHANNEL, self._notify)
+            await cancellation_registry.listen(listener)
+        except Exception as e:
+            print(f"[QUEUE] LISTEN {QUEUE_CHANNEL} unavailable ({e}); polling every {JOB_POLL_INTERVAL}s", flush=True)
+        print(f"[QUEUE] Worker {self.worker_id} started; limits {self.limits}", flush=True)
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                try:
+                    await self._claim_available()
+                except Exception as e:
+                    print(f"[QUEUE] Claim failed: {e}", flush=True)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            if self._tasks:
+                print(f"[QUEUE] Waiting for {len(self._tasks)} running jobs", flush=True)
+                _, pending = await asyncio.wait(list(self._tasks.values()), timeout=JOB_DRAIN_SECONDS)
+                for task in pending:
+                    # Left 'running'; another worker requeues it once the lease expires
+                    task.cancel()
+        finally:
+            heartbeat.cancel()
+            if listener is not None:
+                await listener.close()
+        print(f"[QUEUE] Worker {self.worker_id} stopped", flush=True)
+
+    async def _claim_available(self):
+        async with acquire() as conn:
+            while not self._stopping:
+                job_types = self.claimable_types()
+                if not job_types:
+                    return
+                row = await claim_job(conn, job_types, self.worker_id)
+                if row is None:
+                    return
+                job_id, job_type = row['job_id'], row['job_type']
+                print(f"[QUEUE] Claimed {job_type} job {job_id} (attempt {row['attempts']})", flush=True)
+                self._active[job_type] += 1
+                # Registered before any await so a cancel NOTIFY arriving from now on reaches the job
+                cancellation_registry.token(job_id)
+                self._tasks[job_id] = asyncio.create_task(self._execute(job_id, job_type, row['payload']))
+
+    async def _execute(self, job_id: str, job_type: str, payload):
+        try:
+            spec = JOB_TYPES[job_type]
+            request, args = decode_payload(spec, payload)
+            await spec.runner(request, job_id, *args)
+            error = 'Job ended without a result.'
+        except Exception as e:
+            print(f"[QUEUE] {job_type} job {job_id} raised: {e}", flush=True)
+            error = f"Job failed: {e}"
+        try:
+            async with acquire() as conn:
+                # Runners record their own outcome; a job still 'running' here never reported one
+                await conn.execute("""
+                    update jobs set
+                        status = case when status = 'running' then 'failed' else status end,
+                        error = case when status = 'running' then $2 else error end,
+                        locked_by = null,
+                        heartbeat_at = null
+                    where job_id = $1 and locked_by = $3
+                """, job_id, error, self.worker_id)
+        except Exception as e:
+            print(f"[QUEUE] Could not release job {job_id}: {e}", flush=True)
+        finally:
+            cancellation_registry.release(job_id)
+            self._active[job_type] -= 1
+            self._tasks.pop(job_id, None)
+            self._wakeup.set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                async with acquire() as conn:
+                    if self._tasks:
+                        await conn.execute("update jobs set heartbeat_at = now() where job_id = any($1::text[]) and locked_by = $2",
+                                           list(self._tasks), self.worker_id)
+                    for row in await requeue_stale_jobs(conn):
+                        print(f"[QUEUE] Job {row['job_id']} lost its worker; now {row['status']}", flush=True)
+                        self._wakeup.set()
+            except Exception as e:
+                print(f"[QUEUE] Heartbeat failed: {e}", flush=True)
@@ -11,6 +11,7 @@ from typing import Optional
 import tempfile
 import os
 import asyncio
+import functools
 import signal
 import time
 import requests
@@ -19,16 +20,26 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import numpy as np
 import json
-from .db import init_db, get_db
+from .db import init_db, init_pool, close_pool, acquire, get_db
 from contextlib import asynccontextmanager
 import random
 import string
 from .fits_analysis import analyze_fits_headers, detect_camera, KNOWN_CAMERAS
-from .calibration_worker import create_master_frame, save_master_frame, save_master_preview, analyze_frames, recommend_stacking, infer_frame_type
-from .supabase_io import download_file, upload_file
-from .cosmetic_masking import compute_bad_pixel_mask, compute_bad_column_mask, compute_bad_row_mask, apply_masks
-from .patterned_noise_removal import remove_gradients_median, remove_striping_fourier, remove_background_polynomial, detect_pattern_type, apply_combined_correction
-from .histogram_analysis import analyze_calibration_frame_histograms
+from .admission import plan_execution
+from .compute_executor import DEFAULT_JOB_PROCESSES, compute_executor, run_cpu
+from .job_queue import JobWorker, enqueue_job, register_job_type
+from .cancellation import cancellation_registry, notify_cancel
+from .progress import PARTIAL_RESULT_STAGES, TERMINAL_STATUSES, progress_reporter
+from .job_events import job_event_bus, format_sse
+from . import job_stages
+from .fits_io import load_image
+from .master_state import MasterState, INCREMENTAL_METHODS, STATE_SUFFIX
+from .streaming_pipeline import StreamingPipeline, DEFAULT_WARMUP_FRAMES, matches_reference, validate_header
+from .frame_catalog import CALIBRATION_FRAME_TYPES, lookup_frames
+from .calibration_worker import infer_frame_type
+from .supabase_io import upload_file
+from .storage_client import storage_client
+from .histogram_analysis import analyze_frame_histogram_dict, summarize_frame_histograms
 
 async def download_file_with_fallback(bucket: str, remote_path: str, local_path: str, request_info: dict) -> bool:
     """
@@ -39,7 +50,7 @@ async def download_file_with_fallback(bucket: str, remote_path: str, local_path:
     
     # Try primary path first
     try:
-        download_file(bucket, remote_path, local_path)
+        await storage_client.download(bucket, remote_path, local_path)
         if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
             logger.info(f"Successfully downloaded {remote_path}")
             return True
@@ -56,7 +67,7 @@ async def download_file_with_fallback(bucket: str, remote_path: str, local_path:
             fallback_path = f"{request_info['user_id']}/{request_info['project_id']}/{fallback_type}/{filename}"
             try:
                 logger.info(f"Trying fallback path: {fallback_path}")
-                download_file(bucket, fallback_path, local_path)
+                await storage_client.download(bucket, fallback_path, local_path)
                 if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
                     logger.info(f"Successfully downloaded from fallback path: {fallback_path}")
                     return True
@@ -71,12 +82,11 @@ import traceback
 import uuid
 from datetime import datetime
 import glob
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter
 from .trail_detection import detect_trails
 from .outlier_rejection import detect_outlier_frames
 from .frame_consistency import analyze_frame_consistency, suggest_frame_selection
-from .cosmic_ray_detection import CosmicRayDetector, validate_cosmic_ray_parameters
+from .cosmic_ray_detection import validate_cosmic_ray_parameters
 from .gradient_analysis import analyze_calibration_frame_gradients, GradientAnalysisResult
 
 logger = logging.getLogger(__name__)
@@ -84,16 +94,46 @@ logger = logging.getLogger(__name__)
 # In-memory job storage (for development without database)
 job_results = {}
 
+# Run a job worker inside the API process (single-node / development). Under load set
+# EMBEDDED_JOB_WORKER=0 and run `python -m app.worker` on as many nodes as needed.
+EMBEDDED_JOB_WORKER = os.environ.get('EMBEDDED_JOB_WORKER', '1') == '1'
+
+# Frames of one histogram analysis job analyzed at once (requests may ask for fewer)
+HISTOGRAM_WORKERS = int(os.environ.get('HISTOGRAM_WORKERS', DEFAULT_JOB_PROCESSES))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     try:
+        await init_pool()
         await init_db()
     except Exception as e:
         print(f"Database initialization failed: {e}. Using in-memory storage.")
+    job_event_bus.start()
+    events_listener = None
+    try:
+        # Events of jobs running on other nodes, for /jobs/{job_id}/events
+        events_listener = await get_db()
+        await job_event_bus.listen(events_listener)
+    except Exception as e:
+        print(f"[EVENTS] LISTEN job_events unavailable: {e}")
+    job_worker = worker_task = None
+    if EMBEDDED_JOB_WORKER:
+        job_worker = JobWorker()
+        worker_task = asyncio.create_task(job_worker.run())
     yield
     # Shutdown
     print("Shutting down gracefully...")
+    if job_worker is not None:
+        job_worker.stop()
+        await worker_task
+    await progress_reporter.close()
+    await job_event_bus.close()
+    if events_listener is not None:
+        await events_listener.close()
+    await storage_client.aclose()
+    await close_pool()
+    compute_executor.shutdown(wait=False)
 
 app = FastAPI(lifespan=lifespan)
 
@@ -287,6 +327,8 @@ async def validate_fits_file(
                 # Determine the actual frame type
                 actual_type = get_frame_type_from_header(header)
                 print('[validate-fits-debug] actual_type:', actual_type)
+                # Indexed by the frame catalog (frame_catalog.py)
+                metadata['frame_type'] = actual_type
                 print('[validate-fits-debug] header:', dict(header))
                 
                 # Generate a consistent file path using the original filename
@@ -336,17 +378,16 @@ async def validate_fits_file(
 async def list_files(project_id: str, user_id: str):
     """List all files for a given project and user with their metadata."""
     try:
-        conn = await get_db()
-        rows = await conn.fetch(
-            """
-            SELECT file_path, metadata 
-            FROM fits_metadata 
-            WHERE project_id = $1 AND user_id = $2
-            ORDER BY file_path
-            """,
-            project_id, user_id
-        )
-        await conn.close()
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT file_path, metadata 
+                FROM fits_metadata 
+                WHERE project_id = $1 AND user_id = $2
+                ORDER BY file_path
+                """,
+                project_id, user_id
+            )
         
         # Format the response
         files = []
@@ -421,8 +462,7 @@ async def preview_fits(request: Request):
         return StreamingResponse(buf, media_type="image/png")
 
 async def save_fits_metadata(file_path, project_id, user_id, metadata):
-    conn = await get_db()
-    try:
+    async with acquire() as conn:
         await conn.execute(
             """
             insert into fits_metadata (file_path, project_id, user_id, metadata)
@@ -431,16 +471,11 @@ async def save_fits_metadata(file_path, project_id, user_id, metadata):
             """,
             file_path, project_id, user_id, json.dumps(metadata)
         )
-    finally:
-        await conn.close()
 
 async def get_fits_metadata(file_path):
-    conn = await get_db()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow("select metadata from fits_metadata where file_path = $1", file_path)
         return row['metadata'] if row else None
-    finally:
-        await conn.close()
 
 # Example usage after validation:
 # await save_fits_metadata(file_path, project_id, user_id, metadata)
@@ -479,59 +514,64 @@ class PatternedNoiseRequest(BaseModel):
     settings: dict = {}  # method, filter_size, strength, etc.
 
 # --- JOB STATUS/RESULTS DB HELPERS ---
-async def insert_job(job_id, status, error=None, result=None, diagnostics=None, warnings=None, progress=None):
-    conn = await get_db()
-    try:
-        # Build dynamic SQL based on which fields are not None
-        fields = ["status", "error", "result", "warnings", "progress"]
-        values = [status, error, json.dumps(result) if result is not None else None,
-                  json.dumps(warnings) if warnings is not None else None, progress]
-        set_clauses = ["status = excluded.status", "error = excluded.error", "result = excluded.result",
-                       "warnings = excluded.warnings", "progress = excluded.progress"]
-        if diagnostics is not None:
-            fields.insert(3, "diagnostics")
-            values.insert(3, json.dumps(diagnostics))
-            set_clauses.insert(3, "diagnostics = excluded.diagnostics")
-        sql = f"""
-            insert into jobs (job_id, {', '.join(fields)})
-            values ($1, {', '.join(f'${i+2}' for i in range(len(fields)))})
-            on conflict (job_id) do update set
-                {', '.join(set_clauses)}
-        """
+async def insert_job(job_id, status, error=None, result=None, diagnostics=None, warnings=None, progress=None,
+                     stage=None):
+    if status in TERMINAL_STATUSES:
+        # Written now and durably; buffered progress must not land after it
+        progress_reporter.discard(job_id)
+        # Tag the final write explicitly: NOTIFYs are coalesced per job, so an earlier
+        # partial-result stage must not stick to it
+        stage = stage or status
+    if status is not None:
+        job_event_bus.publish(job_id, status=status, progress=progress, error=error, result=result, stage=stage)
+    # Build dynamic SQL based on which fields are not None
+    fields = ["status", "error", "result", "warnings", "progress"]
+    values = [status, error, json.dumps(result) if result is not None else None,
+              json.dumps(warnings) if warnings is not None else None, progress]
+    set_clauses = ["status = excluded.status", "error = excluded.error", "result = excluded.result",
+                   "warnings = excluded.warnings", "progress = excluded.progress"]
+    if diagnostics is not None:
+        fields.insert(3, "diagnostics")
+        values.insert(3, json.dumps(diagnostics))
+        set_clauses.insert(3, "diagnostics = excluded.diagnostics")
+    sql = f"""
+        insert into jobs (job_id, {', '.join(fields)})
+        values ($1, {', '.join(f'${i+2}' for i in range(len(fields)))})
+        on conflict (job_id) do update set
+            {', '.join(set_clauses)}
+    """
+    async with acquire() as conn:
         await conn.execute(sql, job_id, *values)
-    finally:
-        await conn.close()
 
 async def get_job(job_id):
-    conn = await get_db()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow("select * from jobs where job_id = $1", job_id)
         return dict(row) if row else None
-    finally:
-        await conn.close()
 
-async def update_job_progress(job_id, progress):
-    # 3. Preserve current job status
-    job = await get_job(job_id)
-    status = job['status'] if job and 'status' in job else None
-    await insert_job(job_id, status=status, progress=progress)
+async def update_job_progress(job_id, progress, stage=None):
+    # Buffered and coalesced; the job's status is left as is (see progress.py)
+    progress_reporter.report(job_id, progress)
+    job_event_bus.publish(job_id, progress=progress, stage=stage)
 
 @app.post("/jobs/cancel")
 async def cancel_job(payload: CancelJobRequest):
     job_id = payload.jobId
     await insert_job(job_id, status="cancelled", progress=100, error="Job cancelled by user.")
+    # Stop the running job: directly if it runs in this process, otherwise via its worker's LISTEN
+    if not cancellation_registry.cancel(job_id):
+        async with acquire() as conn:
+            await notify_cancel(conn, job_id)
     return {"job_id": job_id, "status": "cancelled"}
 
 @app.post("/cosmetic-masks/generate")
-async def generate_cosmetic_masks(request: CosmeticMaskRequest, background_tasks: BackgroundTasks):
+async def generate_cosmetic_masks(request: CosmeticMaskRequest):
     """
     Generate bad pixel, column, and row masks from a stack of dark frames.
     Returns job_id for async processing.
     """
     try:
         job_id = f"mask-{uuid.uuid4().hex[:8]}"
-        await insert_job(job_id, status="queued", progress=0)
-        background_tasks.add_task(run_cosmetic_mask_job, request, job_id)
+        await enqueue_job(job_id, 'cosmetic_masks', request)
         return {"jobId": job_id, "status": "queued"}
     except Exception as e:
         tb = traceback.format_exc()
@@ -551,78 +591,33 @@ async def run_cosmetic_mask_job(request: CosmeticMaskRequest, job_id: str):
         temp_dir = tempfile.mkdtemp()
         local_files = []
         
-        def download_one(path):
+        async def download_one(path):
             local_path = os.path.join(temp_dir, os.path.basename(path))
-            download_file(request.input_bucket, path, local_path)
+            await storage_client.download(request.input_bucket, path, local_path)
             return local_path
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(download_one, path) for path in request.input_paths]
-            local_files = [f.result() for f in futures]
+        local_files = list(await asyncio.gather(*[download_one(path) for path in request.input_paths]))
 
         print(f"[MASK] Downloaded {len(local_files)} dark frames")
         await update_job_progress(job_id, 40)
 
-        # Load FITS stack
-        dark_stack = []
-        for file_path in local_files:
-            with fits.open(file_path) as hdul:
-                dark_stack.append(hdul[0].data.astype(np.float32))
-        
-        dark_stack = np.stack(dark_stack)
-        print(f"[MASK] Loaded dark stack shape: {dark_stack.shape}")
-        await update_job_progress(job_id, 60)
-
-        # Generate masks with user settings
+        # Generate masks with user settings (compute process pool)
         settings = request.settings
         sigma = settings.get('sigma', 5)
         min_bad_fraction = settings.get('min_bad_fraction', 0.5)
-        
-        bad_pixel_mask = compute_bad_pixel_mask(dark_stack, sigma=sigma, min_bad_fraction=min_bad_fraction)
-        bad_col_mask = compute_bad_column_mask(dark_stack, sigma=sigma)
-        bad_row_mask = compute_bad_row_mask(dark_stack, sigma=sigma)
-        
-        print(f"[MASK] Generated masks - Bad pixels: {np.sum(bad_pixel_mask)}, Bad columns: {np.sum(bad_col_mask)}, Bad rows: {np.sum(bad_row_mask)}")
+        await update_job_progress(job_id, 60)
+        mask_files, stats = await run_cpu(job_stages.generate_cosmetic_masks, local_files, sigma, min_bad_fraction, temp_dir)
         await update_job_progress(job_id, 80)
 
-        # Save masks as FITS files
+        # Upload the mask FITS files: bad pixel mask (2D), bad column and bad row masks (1D)
         mask_paths = {}
-        
-        # Bad pixel mask (2D)
-        pixel_mask_path = os.path.join(temp_dir, "bad_pixel_mask.fits")
-        fits.writeto(pixel_mask_path, bad_pixel_mask.astype(np.uint8), overwrite=True)
-        pixel_storage_path = f"{request.output_base}/bad_pixel_mask.fits"
-        upload_file(request.output_bucket, pixel_storage_path, pixel_mask_path)
-        mask_paths['bad_pixel_mask'] = pixel_storage_path
-        
-        # Bad column mask (1D)
-        col_mask_path = os.path.join(temp_dir, "bad_column_mask.fits")
-        fits.writeto(col_mask_path, bad_col_mask.astype(np.uint8), overwrite=True)
-        col_storage_path = f"{request.output_base}/bad_column_mask.fits"
-        upload_file(request.output_bucket, col_storage_path, col_mask_path)
-        mask_paths['bad_column_mask'] = col_storage_path
-        
-        # Bad row mask (1D)
-        row_mask_path = os.path.join(temp_dir, "bad_row_mask.fits")
-        fits.writeto(row_mask_path, bad_row_mask.astype(np.uint8), overwrite=True)
-        row_storage_path = f"{request.output_base}/bad_row_mask.fits"
-        upload_file(request.output_bucket, row_storage_path, row_mask_path)
-        mask_paths['bad_row_mask'] = row_storage_path
-
-        # Generate statistics
-        stats = {
-            'total_pixels': int(dark_stack.shape[1] * dark_stack.shape[2]),
-            'bad_pixels': int(np.sum(bad_pixel_mask)),
-            'bad_pixel_percentage': float(np.sum(bad_pixel_mask) / (dark_stack.shape[1] * dark_stack.shape[2]) * 100),
-            'total_columns': int(dark_stack.shape[2]),
-            'bad_columns': int(np.sum(bad_col_mask)),
-            'bad_column_percentage': float(np.sum(bad_col_mask) / dark_stack.shape[2] * 100),
-            'total_rows': int(dark_stack.shape[1]),
-            'bad_rows': int(np.sum(bad_row_mask)),
-            'bad_row_percentage': float(np.sum(bad_row_mask) / dark_stack.shape[1] * 100),
-            'settings_used': settings,
-            'input_frames': len(local_files)
-        }
+        for name, mask_path in mask_files.items():
+            storage_path = f"{request.output_base}/{name}.fits"
+            upload_file(request.output_bucket, storage_path, mask_path)
+            mask_paths[name] = storage_path
+
+        stats['settings_used'] = settings
+        stats['input_frames'] = len(local_files)
 
         # Cleanup temp files
         import shutil
@@ -644,15 +639,14 @@ async def run_cosmetic_mask_job(request: CosmeticMaskRequest, job_id: str):
         await insert_job(job_id, status="failed", error=f"Mask generation failed: {e}", progress=100)
 
 @app.post("/patterned-noise/correct")
-async def correct_patterned_noise(request: PatternedNoiseRequest, background_tasks: BackgroundTasks):
+async def correct_patterned_noise(request: PatternedNoiseRequest):
     """
     Correct patterned noise in astronomical images.
     Returns job_id for async processing.
     """
     try:
         job_id = f"pattern-{uuid.uuid4().hex[:8]}"
-        await insert_job(job_id, status="queued", progress=0)
-        background_tasks.add_task(run_patterned_noise_job, request, job_id)
+        await enqueue_job(job_id, 'patterned_noise', request)
         return {"jobId": job_id, "status": "queued"}
     except Exception as e:
         tb = traceback.format_exc()
@@ -672,143 +666,23 @@ async def run_patterned_noise_job(request: PatternedNoiseRequest, job_id: str):
         temp_dir = tempfile.mkdtemp()
         local_files = []
         
-        def download_one(path):
+        async def download_one(path):
             local_path = os.path.join(temp_dir, os.path.basename(path))
-            download_file(request.input_bucket, path, local_path)
+            await storage_client.download(request.input_bucket, path, local_path)
             return local_path
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(download_one, path) for path in request.input_paths]
-            local_files = [f.result() for f in futures]
+        local_files = list(await asyncio.gather(*[download_one(path) for path in request.input_paths]))
 
         print(f"[PATTERN] Downloaded {len(local_files)} images")
         await update_job_progress(job_id, 40)
 
-        # Process each image
-        corrected_files = []
-        pattern_info = []
+        # Process each image; the images are independent, so they run side by side in the compute pool
         settings = request.settings
-        
-        for i, file_path in enumerate(local_files):
-            with fits.open(file_path) as hdul:
-                image = hdul[0].data.astype(np.float32)
-                header = hdul[0].header
-            
-            # Auto-detect pattern type if method not specified
-            if 'method' not in settings or settings['method'] == 'auto':
-                pattern_type, confidence, recommendations = detect_pattern_type(image)
-                method = recommendations.get('method', 'none')
-                if method == 'none':
-                    print(f"[PATTERN] No correction needed for {os.path.basename(file_path)}")
-                    corrected_image = image
-                    pattern_removed = np.zeros_like(image)
-                    correction_info = {'method': 'none', 'pattern_type': pattern_type, 'confidence': confidence}
-                else:
-                    print(f"[PATTERN] Auto-detected {pattern_type} (confidence: {confidence:.2f}) for {os.path.basename(file_path)}")
-                    # Apply recommended method with recommended settings
-                    if method == 'median_filter':
-                        corrected_image, pattern_removed, star_mask = remove_gradients_median(
-                            image,
-                            filter_size=recommendations.get('filter_size', 64),
-                            preserve_stars=recommendations.get('preserve_stars', True)
-                        )
-                        correction_info = {
-                            'method': 'median_filter',
-                            'pattern_type': pattern_type,
-                            'confidence': confidence,
-                            'filter_size': recommendations.get('filter_size', 64),
-                            'stars_protected': int(np.sum(star_mask)) if star_mask is not None else 0
-                        }
-                    elif method == 'fourier_filter':
-                        corrected_image, pattern_removed, freq_mask = remove_striping_fourier(
-                            image,
-                            direction=recommendations.get('direction', 'both'),
-                            strength=recommendations.get('strength', 0.7),
-                            frequency_cutoff=recommendations.get('frequency_cutoff', 0.1)
-                        )
-                        correction_info = {
-                            'method': 'fourier_filter',
-                            'pattern_type': pattern_type,
-                            'confidence': confidence,
-                            'direction': recommendations.get('direction', 'both'),
-                            'strength': recommendations.get('strength', 0.7)
-                        }
-                    elif method == 'combined':
-                        corrected_image, pattern_removed, details = apply_combined_correction(
-                            image,
-                            gradient_filter_size=recommendations.get('gradient_filter_size', 64),
-                            fourier_strength=recommendations.get('fourier_strength', 0.5)
-                        )
-                        correction_info = {
-                            'method': 'combined',
-                            'pattern_type': pattern_type,
-                            'confidence': confidence,
-                            'gradient_filter_size': recommendations.get('gradient_filter_size', 64),
-                            'fourier_strength': recommendations.get('fourier_strength', 0.5)
-                        }
-            else:
-                # Use manually specified method
-                method = settings['method']
-                if method == 'median_filter':
-                    corrected_image, pattern_removed, star_mask = remove_gradients_median(
-                        image,
-                        filter_size=settings.get('filter_size', 64),
-                        preserve_stars=settings.get('preserve_stars', True),
-                        star_threshold=settings.get('star_threshold')
-                    )
-                    correction_info = {'method': 'median_filter', 'manual': True}
-                elif method == 'fourier_filter':
-                    corrected_image, pattern_removed, freq_mask = remove_striping_fourier(
-                        image,
-                        direction=settings.get('direction', 'both'),
-                        strength=settings.get('strength', 0.7),
-                        frequency_cutoff=settings.get('frequency_cutoff', 0.1)
-                    )
-                    correction_info = {'method': 'fourier_filter', 'manual': True}
-                elif method == 'polynomial':
-                    corrected_image, pattern_removed, model = remove_background_polynomial(
-                        image,
-                        degree=settings.get('degree', 2),
-                        sigma_clip=settings.get('sigma_clip', 3.0)
-                    )
-                    correction_info = {'method': 'polynomial', 'manual': True}
-                elif method == 'combined':
-                    corrected_image, pattern_removed, details = apply_combined_correction(
-                        image,
-                        gradient_filter_size=settings.get('gradient_filter_size', 64),
-                        fourier_strength=settings.get('fourier_strength', 0.5),
-                        preserve_stars=settings.get('preserve_stars', True),
-                        direction=settings.get('direction', 'both')
-                    )
-                    correction_info = {'method': 'combined', 'manual': True}
-                else:
-                    print(f"[PATTERN] Unknown method: {method}")
-                    corrected_image = image
-                    pattern_removed = np.zeros_like(image)
-                    correction_info = {'method': 'none', 'error': f'Unknown method: {method}'}
-
-            # Calculate improvement statistics
-            original_std = float(np.std(image))
-            corrected_std = float(np.std(corrected_image))
-            pattern_std = float(np.std(pattern_removed))
-            improvement_pct = (original_std - corrected_std) / original_std * 100 if original_std > 0 else 0
-
-            correction_info.update({
-                'original_std': original_std,
-                'corrected_std': corrected_std,
-                'pattern_std': pattern_std,
-                'improvement_percent': improvement_pct,
-                'filename': os.path.basename(file_path)
-            })
-            pattern_info.append(correction_info)
-
-            # Save corrected image
-            corrected_filename = f"corrected_{os.path.basename(file_path)}"
-            corrected_path = os.path.join(temp_dir, corrected_filename)
-            fits.PrimaryHDU(corrected_image, header=header).writeto(corrected_path, overwrite=True)
-            corrected_files.append(corrected_path)
-
-            print(f"[PATTERN] Processed {os.path.basename(file_path)}: {improvement_pct:.1f}% improvement")
+        corrected_files = [os.path.join(temp_dir, f"corrected_{os.path.basename(file_path)}") for file_path in local_files]
+        pattern_info = list(await asyncio.gather(*[
+            run_cpu(job_stages.correct_patterned_noise, file_path, settings, corrected_path)
+            for file_path, corrected_path in zip(local_files, corrected_files)
+        ]))
 
         await update_job_progress(job_id, 80)
 
@@ -845,11 +719,67 @@ async def run_patterned_noise_job(request: PatternedNoiseRequest, job_id: str):
         print(f"[FAIL] Patterned noise correction failed: job_id={job_id}, error={e}\n{tb}", flush=True)
         await insert_job(job_id, status="failed", error=f"Pattern correction failed: {e}", progress=100)
 
+async def fetch_master_bias(job: CalibrationJobRequest, job_id: str, tmpdir: str):
+    """Download the selected (or newest project) master bias; fails the job and returns None on error."""
+    master_bias_path = job.settings.get('masterBiasPath')
+    if master_bias_path:
+        print(f"[{datetime.utcnow().isoformat()}] [BG] Using manually selected master bias: {master_bias_path}")
+    else:
+        print(f"[{datetime.utcnow().isoformat()}] [BG] Auto-selecting master bias for project {job.project_id}")
+        bias_prefix = f"{job.user_id}/{job.project_id}/master-bias/"
+        from .supabase_io import list_files
+        bias_files = list_files(job.input_bucket, bias_prefix)
+        bias_fits = [f for f in bias_files if f['name'].lower().endswith(('.fit', '.fits'))]
+        if not bias_fits:
+            print(f"[{datetime.utcnow().isoformat()}] [ERROR] No master bias found for project {job.project_id}")
+            await insert_job(job_id, status="failed", error="No master bias found for this project.", progress=0)
+            return None
+        selected_bias = sorted(bias_fits, key=lambda f: f['name'], reverse=True)[0]
+        master_bias_path = bias_prefix + selected_bias['name']
+        print(f"[{datetime.utcnow().isoformat()}] [BG] Auto-selected master bias: {master_bias_path}")
+    master_bias_local = os.path.join(tmpdir, 'master_bias.fits')
+    try:
+        await storage_client.download(job.input_bucket, master_bias_path, master_bias_local)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to download master bias: {e}\n{tb}")
+        await insert_job(job_id, status="failed", error=f"Master bias download failed: {e}", progress=0)
+        return None
+    return master_bias_local
+
+async def match_darks_to_light(job: CalibrationJobRequest, download_args, reference, catalog):
+    """
+    Temperature/exposure matching (tempMatching / exposureMatching) against the first light,
+    before any dark is downloaded: darks in the frame catalog are matched on their indexed
+    values, the rest on headers fetched with range requests. Keeps all darks if none match.
+    """
+    temp_matching = job.settings.get('tempMatching', False)
+    exposure_matching = job.settings.get('exposureMatching', False)
+
+    async def header_of(spath):
+        if spath in catalog:
+            return catalog[spath].as_header()
+        return await storage_client.fetch_header(job.input_bucket, spath)
+    headers = await asyncio.gather(*[header_of(spath) for _, spath, _ in download_args], return_exceptions=True)
+    matched = []
+    for args, header in zip(download_args, headers):
+        if isinstance(header, Exception):
+            print(f"[WARN] Failed to read FITS header for temp/exptime matching: {args[1]}: {header}")
+        elif matches_reference(header, reference, temp_matching, exposure_matching):
+            matched.append(args)
+    if matched:
+        print(f"[MATCH] Using {len(matched)} darks after temp/exptime matching (of {len(download_args)})")
+        return matched
+    print(f"[WARN] No darks matched temp/exptime criteria; using all {len(download_args)} darks.")
+    return download_args
+
 async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
+    # Set by /jobs/cancel (directly or over LISTEN job_cancel); checked between stages and frames
+    cancel_token = cancellation_registry.token(job_id)
     try:
         await insert_job(job_id, status="running", progress=0)
+        await update_job_progress(job_id, 0, stage='downloading')
         fits_input_paths = [p for p in job.input_paths if p.lower().endswith((".fit", ".fits"))]
-        fits_input_paths = fits_input_paths[:10]
         print(f"[{datetime.utcnow().isoformat()}] [BG] FITS files to process: {fits_input_paths}")
         timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
         output_base_with_ts = f"{job.output_base}_{timestamp}"
@@ -859,162 +789,170 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
             local_light_files = []
             light_input_paths = getattr(job, 'light_input_paths', None)
             dark_scaling = job.settings.get('darkScaling', False)
+            # One indexed query for what /validate-fits already recorded about the inputs
+            catalog = await lookup_frames(fits_input_paths + list(light_input_paths or []))
             # --- Parallel file download optimization ---
             from time import time as _time
             download_start = _time()
-            def download_one(args):
+            async def download_one(args):
                 bucket, spath, local_path = args
                 try:
-                    download_file(bucket, spath, local_path)
+                    await storage_client.download(bucket, spath, local_path)
                     return local_path
                 except Exception as e:
                     print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to download {spath}: {e}")
                     return None
-            download_args = [(job.input_bucket, spath, os.path.join(tmpdir, f"input_{i}.fits")) for i, spath in enumerate(fits_input_paths)]
-            with ThreadPoolExecutor(max_workers=8) as executor:
-                local_files = list(executor.map(download_one, download_args))
-            local_files = [f for f in local_files if f is not None]
-            print(f"[{datetime.utcnow().isoformat()}] [OPT] Downloaded {len(local_files)} files in {(_time() - download_start):.2f} seconds.")
+            # Lights come first: darks are matched against the first light's header
+            needs_lights = dark_scaling or job.settings.get('darkOptimization', False)
+            light_header = None
             if light_input_paths:
-                light_input_paths = light_input_paths[:10]
-                for i, spath in enumerate(light_input_paths):
-                    job_status = await get_job(job_id)
-                    if job_status and job_status.get("status") == "cancelled":
-                        print(f"[CANCEL] Job {job_id} cancelled during light file download.")
-                        return
-                    if not spath.lower().endswith((".fit", ".fits")):
-                        continue
-                    local_path = os.path.join(tmpdir, f"light_{i}.fits")
-                    print(f"[{datetime.utcnow().isoformat()}] [BG] Downloading light {spath} to {local_path}")
+                light_args = [(job.input_bucket, spath, os.path.join(tmpdir, f"light_{i}.fits"))
+                              for i, spath in enumerate(light_input_paths) if spath.lower().endswith((".fit", ".fits"))]
+                if needs_lights:
+                    print(f"[{datetime.utcnow().isoformat()}] [BG] Downloading {len(light_args)} lights")
+                    # gather keeps the input order, so local_light_files[0] is still the first light
+                    local_light_files = [f for f in await asyncio.gather(*[download_one(args) for args in light_args]) if f is not None]
+                    if local_light_files:
+                        with fits.open(local_light_files[0]) as hdul:
+                            light_header = hdul[0].header.copy()
+                elif light_args and light_args[0][1] in catalog:
+                    light_header = catalog[light_args[0][1]].as_header()
+                elif light_args:
+                    # Only the matching reference is needed: read the first light's header, not the lights
                     try:
-                        download_file(job.input_bucket, spath, local_path)
+                        light_header = await storage_client.fetch_header(job.input_bucket, light_args[0][1])
                     except Exception as e:
-                        tb = traceback.format_exc()
-                        print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to download light {spath}: {e}\n{tb}")
-                        continue
-                    local_light_files.append(local_path)
-            await update_job_progress(job_id, 30)
-            # Cancellation check after downloads
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
-                print(f"[CANCEL] Job {job_id} cancelled after downloads.")
-                return
-            # Bias subtraction logic after download
-            frame_type = infer_frame_type(local_files)
+                        print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to read light header {light_args[0][1]}: {e}")
+                if cancel_token.cancelled:
+                    print(f"[CANCEL] Job {job_id} cancelled during light file download.")
+                    return
+            download_args = [(job.input_bucket, spath, os.path.join(tmpdir, f"input_{i}.fits")) for i, spath in enumerate(fits_input_paths)]
+            # Storage path of every local frame (kept through bias correction) for the master-state manifest
+            source_paths = {local_path: spath for _, spath, local_path in download_args}
+            frame_type = infer_frame_type([local_path for _, _, local_path in download_args])
+            catalog_types = {catalog[p].frame_type for p in fits_input_paths if p in catalog}
+            if frame_type == 'unknown' and len(catalog_types) == 1 and catalog_types <= set(CALIBRATION_FRAME_TYPES):
+                frame_type = catalog_types.pop()
             # If frame_type is unknown and job.frame_type is set, use it
             if frame_type == 'unknown' and getattr(job, 'frame_type', None):
                 frame_type = job.frame_type
-            bias_subtraction = job.settings.get('biasSubtraction', False)
-            master_bias_path = job.settings.get('masterBiasPath')
-            master_bias_local = None
-            if frame_type == 'dark' and bias_subtraction:
-                print(f"[{datetime.utcnow().isoformat()}] [BG] Bias subtraction enabled.")
-                if master_bias_path:
-                    print(f"[{datetime.utcnow().isoformat()}] [BG] Using manually selected master bias: {master_bias_path}")
-                    master_bias_local = os.path.join(tmpdir, 'master_bias.fits')
+            streamed = None
+            if job.settings.get('streamingPipeline', False):
+                # Pipelined mode: each frame is matched, validated, bias-subtracted and accumulated
+                # as soon as its own download finishes, overlapping network and CPU time
+                method = job.settings.get('stackingMethod', 'median')
+                sigma = float(job.settings.get('sigmaThreshold', 3.0))
+                stream_state = None
+                if job.settings.get('incrementalStatePath') and not job.settings.get('superdarkPath'):
+                    state_local = os.path.join(tmpdir, 'previous' + STATE_SUFFIX)
                     try:
-                        download_file(job.input_bucket, master_bias_path, master_bias_local)
+                        await storage_client.download(job.output_bucket, job.settings['incrementalStatePath'], state_local)
+                        stream_state = MasterState.load(state_local)
                     except Exception as e:
                         tb = traceback.format_exc()
-                        print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to download master bias: {e}\n{tb}")
-                        await insert_job(job_id, status="failed", error=f"Master bias download failed: {e}", progress=0)
-                        return
-                else:
-                    print(f"[{datetime.utcnow().isoformat()}] [BG] Auto-selecting master bias for project {job.project_id}")
-                    bias_prefix = f"{job.user_id}/{job.project_id}/master-bias/"
-                    from .supabase_io import list_files
-                    bias_files = list_files(job.input_bucket, bias_prefix)
-                    bias_fits = [f for f in bias_files if f['name'].lower().endswith(('.fit', '.fits'))]
-                    if not bias_fits:
-                        print(f"[{datetime.utcnow().isoformat()}] [ERROR] No master bias found for project {job.project_id}")
-                        await insert_job(job_id, status="failed", error="No master bias found for this project.", progress=0)
+                        print(f"[ERROR] Failed to download or load master state: {e}\n{tb}")
+                        await insert_job(job_id, status="failed", error=f"Master state download/load failed: {e}", progress=0)
                         return
-                    selected_bias = sorted(bias_fits, key=lambda f: f['name'], reverse=True)[0]
-                    master_bias_path = bias_prefix + selected_bias['name']
-                    master_bias_local = os.path.join(tmpdir, 'master_bias.fits')
-                    print(f"[{datetime.utcnow().isoformat()}] [BG] Auto-selected master bias: {master_bias_path}")
-                    try:
-                        download_file(job.input_bucket, master_bias_path, master_bias_local)
-                    except Exception as e:
-                        tb = traceback.format_exc()
-                        print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to download master bias: {e}\n{tb}")
-                        await insert_job(job_id, status="failed", error=f"Master bias download failed: {e}", progress=0)
+                    if stream_state.method != method:
+                        await insert_job(job_id, status="failed", error=f"Master state was built with method '{stream_state.method}', not '{method}'.", progress=0)
                         return
-                with fits.open(master_bias_local) as hdul:
-                    bias_data = hdul[0].data.astype(np.float32)
-                bias_corrected_files = []
-                for i, dark_path in enumerate(local_files):
-                    # Cancellation check inside bias subtraction loop
-                    job_status = await get_job(job_id)
-                    if job_status and job_status.get("status") == "cancelled":
-                        print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled during bias subtraction.")
+                elif method in INCREMENTAL_METHODS and not job.settings.get('superdarkPath'):
+                    max_iters = job.settings.get('sigmaMaxIters', 1)
+                    stream_state = MasterState.empty(
+                        method,
+                        sigma_low=float(job.settings.get('sigmaLowThreshold', sigma)),
+                        sigma_high=float(job.settings.get('sigmaHighThreshold', sigma)),
+                        sigma_center=job.settings.get('sigmaCenter', 'mean'),
+                        sigma_scale=job.settings.get('sigmaScale', 'std'),
+                        sigma_max_iters=int(max_iters) if max_iters is not None else None,
+                    )
+                bias_data = None
+                if frame_type == 'dark' and job.settings.get('biasSubtraction', False):
+                    master_bias_local = await fetch_master_bias(job, job_id, tmpdir)
+                    if master_bias_local is None:
                         return
-                    with fits.open(dark_path) as hdul:
-                        dark_data = hdul[0].data.astype(np.float32)
-                        if dark_data.shape != bias_data.shape:
-                            print(f"[{datetime.utcnow().isoformat()}] [ERROR] Shape mismatch: dark {dark_data.shape} vs bias {bias_data.shape}")
-                            await insert_job(job_id, status="failed", error="Master bias and dark frame shape mismatch.", progress=0)
-                            return
-                        corrected = dark_data - bias_data
-                        corrected_path = os.path.join(tmpdir, f"bias_corrected_{i}.fits")
-                        fits.PrimaryHDU(corrected, header=hdul[0].header).writeto(corrected_path, overwrite=True)
-                        bias_corrected_files.append(corrected_path)
+                    with fits.open(master_bias_local) as hdul:
+                        bias_data = hdul[0].data.astype(np.float32)
+                reference_header = light_header if frame_type == 'dark' else None
+                pipeline = StreamingPipeline(
+                    tmpdir,
+                    state=stream_state,
+                    bias_data=bias_data,
+                    reference_header=reference_header,
+                    temp_matching=frame_type == 'dark' and job.settings.get('tempMatching', False),
+                    exposure_matching=frame_type == 'dark' and job.settings.get('exposureMatching', False),
+                    warmup_frames=int(job.settings.get('streamingWarmupFrames', DEFAULT_WARMUP_FRAMES)),
+                    band_height=job.settings.get('stackingBandHeight'),
+                )
+
+                try:
+                    streamed = await pipeline.run(
+                        [(spath, local_path) for _, spath, local_path in download_args],
+                        functools.partial(storage_client.download, job.input_bucket),
+                        is_cancelled=cancel_token.is_cancelled,
+                    )
+                except ValueError as e:
+                    print(f"[{datetime.utcnow().isoformat()}] [ERROR] Streaming pipeline failed: {e}")
+                    await insert_job(job_id, status="failed", error=str(e), progress=0)
+                    return
+                if streamed is None:
+                    print(f"[CANCEL] Job {job_id} cancelled during streaming download.")
+                    return
+                local_files = list(streamed.valid_files)
+                source_paths.update(streamed.source_paths)
+                if streamed.skipped:
+                    print(f"[INCREMENTAL] Skipped {len(streamed.skipped)} frames already in the master state")
+                print(f"[{datetime.utcnow().isoformat()}] [OPT] Streamed {len(local_files)} accepted frames in {(_time() - download_start):.2f} seconds.")
+            else:
+                if (frame_type == 'dark' and light_header is not None
+                        and (job.settings.get('tempMatching', False) or job.settings.get('exposureMatching', False))):
+                    download_args = await match_darks_to_light(job, download_args, light_header, catalog)
+                local_files = await asyncio.gather(*[download_one(args) for args in download_args])
+                local_files = [f for f in local_files if f is not None]
+                print(f"[{datetime.utcnow().isoformat()}] [OPT] Downloaded {len(local_files)} files in {(_time() - download_start):.2f} seconds.")
+            await update_job_progress(job_id, 30, stage='validating')
+            # Cancellation check after downloads
+            if cancel_token.cancelled:
+                print(f"[CANCEL] Job {job_id} cancelled after downloads.")
+                return
+            # Bias subtraction logic after download
+            bias_subtraction = job.settings.get('biasSubtraction', False)
+            master_bias_local = None
+            if frame_type == 'dark' and bias_subtraction and streamed is None:
+                print(f"[{datetime.utcnow().isoformat()}] [BG] Bias subtraction enabled.")
+                master_bias_local = await fetch_master_bias(job, job_id, tmpdir)
+                if master_bias_local is None:
+                    return
+                try:
+                    bias_corrected_files = await run_cpu(job_stages.subtract_bias, local_files, master_bias_local, tmpdir)
+                except ValueError as e:
+                    print(f"[{datetime.utcnow().isoformat()}] [ERROR] {e}")
+                    await insert_job(job_id, status="failed", error="Master bias and dark frame shape mismatch.", progress=0)
+                    return
+                for dark_path, corrected_path in zip(local_files, bias_corrected_files):
+                    source_paths[corrected_path] = source_paths.get(dark_path, dark_path)
                 local_files = bias_corrected_files
             # Cancellation check after bias subtraction
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
+            if cancel_token.cancelled:
                 print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled after bias subtraction.")
                 return
-            # --- Temperature/Exposure Matching for Dark Frames ---
-            if frame_type == 'dark':
-                temp_matching = job.settings.get('tempMatching', False)
-                exposure_matching = job.settings.get('exposureMatching', False)
-                # Only filter if at least one is enabled and light frames are available
-                if (temp_matching or exposure_matching) and local_light_files:
-                    # Get reference temp/exptime from first light frame
-                    with fits.open(local_light_files[0]) as hdul:
-                        light_header = hdul[0].header
-                        ref_temp = light_header.get('CCD-TEMP')
-                        ref_exptime = light_header.get('EXPTIME')
-                    filtered_files = []
-                    for f in local_files:
-                        try:
-                            with fits.open(f) as hdul:
-                                header = hdul[0].header
-                                temp_ok = True
-                                exptime_ok = True
-                                if temp_matching and ref_temp is not None and header.get('CCD-TEMP') is not None:
-                                    temp_ok = abs(header.get('CCD-TEMP') - ref_temp) <= 1.0
-                                if exposure_matching and ref_exptime is not None and header.get('EXPTIME') is not None:
-                                    exptime_ok = abs(header.get('EXPTIME') - ref_exptime) <= 0.1
-                                if temp_ok and exptime_ok:
-                                    filtered_files.append(f)
-                        except Exception as e:
-                            print(f"[WARN] Failed to read FITS for temp/exptime matching: {f}: {e}")
-                    if filtered_files:
-                        print(f"[MATCH] Using {len(filtered_files)} darks after temp/exptime matching (of {len(local_files)})")
-                        local_files = filtered_files
-                    else:
-                        print(f"[WARN] No darks matched temp/exptime criteria; using all {len(local_files)} darks.")
             # --- Frame validation before stacking ---
             print(f"[{datetime.utcnow().isoformat()}] [DEBUG] Validating frames...", flush=True)
-            valid_files = []
-            rejected_files = []
-            for f in local_files:
+            # Streamed frames were validated as they arrived
+            valid_files = list(streamed.valid_files) if streamed is not None else []
+            rejected_files = list(streamed.rejected_files) if streamed is not None else []
+            for f in (local_files if streamed is None else []):
                 # Cancellation check inside validation loop
-                job_status = await get_job(job_id)
-                if job_status and job_status.get("status") == "cancelled":
+                if cancel_token.cancelled:
                     print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled during validation.")
                     return
                 try:
                     with fits.open(f) as hdul:
-                        header = hdul[0].header
-                        analysis = analyze_fits_headers(header)
-                        is_valid = analysis.confidence >= 0.7 and not any('Missing' in w or 'must' in w for w in analysis.warnings)
+                        is_valid, header_warnings = validate_header(hdul[0].header)
                         if is_valid:
                             valid_files.append(f)
                         else:
-                            rejected_files.append((f, analysis.warnings))
+                            rejected_files.append((f, header_warnings))
                 except Exception as e:
                     print(f"[{datetime.utcnow().isoformat()}] [ERROR] Exception during validation of {f}: {e}", flush=True)
                     traceback.print_exc()
@@ -1028,22 +966,23 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                 })
                 return
             # Cancellation check after validation
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
+            if cancel_token.cancelled:
                 print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled after validation.")
                 return
             # --- Prepare bad pixel map if provided ---
             bad_pixel_map = None
+            bad_pixel_map_local = None
             bpm_path = job.settings.get('badPixelMapPath')
             if bpm_path:
                 # Download BPM FITS file to tempdir
                 bpm_local_path = os.path.join(tmpdir, 'bad_pixel_map.fits')
                 try:
-                    download_file(job.input_bucket, bpm_path, bpm_local_path)
+                    await storage_client.download(job.input_bucket, bpm_path, bpm_local_path)
                     with fits.open(bpm_local_path) as hdul:
                         bpm_data = hdul[0].data
                         # Consider nonzero as bad pixel
                         bad_pixel_map = (bpm_data != 0)
+                    bad_pixel_map_local = bpm_local_path
                     print(f"[LOG] Loaded bad pixel map from {bpm_path}, shape={bad_pixel_map.shape}, bad pixels={np.sum(bad_pixel_map)}", flush=True)
                 except Exception as e:
                     print(f"[ERROR] Failed to load bad pixel map: {e}", flush=True)
@@ -1055,10 +994,10 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                 print(f"[SUPERDARK] Using Superdark: {superdark_path}")
                 superdark_local = os.path.join(tmpdir, 'superdark.fits')
                 try:
-                    download_file(job.input_bucket, superdark_path, superdark_local)
-                    with fits.open(superdark_local) as hdul:
-                        master = hdul[0].data.astype(np.float32)
-                    valid_files = [superdark_local]  # For stats/diagnostics
+                    await storage_client.download(job.input_bucket, superdark_path, superdark_local)
+                    if fits.getdata(superdark_local) is None:
+                        raise ValueError("No image data in Superdark")
+                    valid_files = [superdark_local]  # Used as the master as-is, and for stats/diagnostics
                     superdark_used = True
                 except Exception as e:
                     tb = traceback.format_exc()
@@ -1066,10 +1005,46 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                     await insert_job(job_id, status="failed", error=f"Superdark download/load failed: {e}", progress=0)
                     return
                 print(f"[SUPERDARK] Superdark loaded and will be used as master dark for calibration.")
+            # --- Incremental update: fold only frames missing from a saved master state ---
+            master_state = streamed.state if streamed is not None and not superdark_used else None
+            incremental_state_path = job.settings.get('incrementalStatePath')
+            if incremental_state_path and not superdark_used and streamed is None:
+                state_local = os.path.join(tmpdir, 'previous' + STATE_SUFFIX)
+                try:
+                    await storage_client.download(job.output_bucket, incremental_state_path, state_local)
+                    master_state = MasterState.load(state_local)
+                except Exception as e:
+                    tb = traceback.format_exc()
+                    print(f"[ERROR] Failed to download or load master state: {e}\n{tb}")
+                    await insert_job(job_id, status="failed", error=f"Master state download/load failed: {e}", progress=0)
+                    return
+                if master_state.method != job.settings.get('stackingMethod', 'median'):
+                    await insert_job(job_id, status="failed", error=f"Master state was built with method '{master_state.method}', not '{job.settings.get('stackingMethod', 'median')}'.", progress=0)
+                    return
+                new_indices = master_state.new_frames([source_paths.get(f, f) for f in valid_files])
+                print(f"[INCREMENTAL] {len(new_indices)} new of {len(valid_files)} valid frames; {master_state.n_frames} already in the master")
+                if not new_indices:
+                    await insert_job(job_id, status="failed", error="No new frames to add to the master.", progress=100)
+                    return
+                valid_files = [valid_files[i] for i in new_indices]
             # --- Proceed with stacking only valid files ---
             print(f"[{datetime.utcnow().isoformat()}] [BG] {len(valid_files)} valid frames, {len(rejected_files)} rejected.")
-            stats = analyze_frames(valid_files)
             method = job.settings.get('stackingMethod', 'median')
+            job_light_files = local_light_files if frame_type == 'dark' and needs_lights else []
+            # --- Admission: size the job from frame headers and pick in-memory or tiled execution ---
+            plan = plan_execution(
+                valid_files,
+                method if master_state is None and not superdark_used else 'mean',
+                light_files=job_light_files,
+                dark_optimization=frame_type == 'dark' and job.settings.get('darkOptimization', False),
+                band_height=job.settings.get('stackingBandHeight'),
+                workers=job.settings.get('stackingWorkers'),
+                memory_mb=job.settings.get('jobMemoryMB'),
+            )
+            print(f"[ADMISSION] {plan.reason}", flush=True)
+            if not plan.admitted:
+                await insert_job(job_id, status="failed", error=f"Job does not fit in memory: {plan.reason}", progress=0)
+                return
             sigma = float(job.settings.get('sigmaThreshold', 3.0))
             cosmetic = job.settings.get('cosmetic', None)
             cosmetic_method = job.settings.get('cosmeticMethod', 'hot_pixel_map')
@@ -1077,48 +1052,81 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
             la_cosmic_params = None
             if cosmetic_method == 'la_cosmic':
                 la_cosmic_params = job.settings.get('laCosmicParams', None)
-            rec_method, rec_sigma, reason = recommend_stacking(stats, method, sigma)
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
+            if cancel_token.cancelled:
                 print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled before stacking.")
                 return
-            if not superdark_used:
-                master = create_master_frame(
-                    valid_files,
-                    method=method,
-                    sigma_clip=sigma if method in ['sigma', 'winsorized'] else None,
-                    cosmetic=cosmetic,
-                    cosmetic_method=cosmetic_method,
-                    cosmetic_threshold=cosmetic_threshold,
-                    la_cosmic_params=la_cosmic_params,
-                    bad_pixel_map=bad_pixel_map
-                )
+            stack_options = None
+            if method == 'linear_fit':
+                stack_options = {'iterations': int(job.settings.get('linearFitIterations', 1))}
+            elif method == 'sigma':
+                # Native sigma clipping; defaults (mean/std, one pass) match the old ccdproc Combiner
+                max_iters = job.settings.get('sigmaMaxIters', 1)
+                stack_options = {
+                    'low_thresh': float(job.settings.get('sigmaLowThreshold', sigma)),
+                    'high_thresh': float(job.settings.get('sigmaHighThreshold', sigma)),
+                    'center': job.settings.get('sigmaCenter', 'mean'),
+                    'scale': job.settings.get('sigmaScale', 'std'),
+                    'max_iters': int(max_iters) if max_iters is not None else None,
+                }
+            state_input_path = None
+            if master_state is not None:
+                if streamed is not None:
+                    # The streamed state already holds every accepted frame; hand it to the stage on disk
+                    state_input_path = os.path.join(tmpdir, 'streamed' + STATE_SUFFIX)
+                    master_state.save(state_input_path)
+                else:
+                    state_input_path = state_local
+            # Analysis, stacking, master state and statistics run in the compute process pool
+            # over one shared set of opened frames, keeping the event loop free for other requests
+            spec = job_stages.MasterSpec(
+                files=valid_files,
+                out_dir=tmpdir,
+                method=method,
+                sigma=sigma,
+                names=[source_paths.get(f, f) for f in valid_files],
+                stack_options=stack_options,
+                rejection_map=bool(job.settings.get('rejectionMap', False)) and not superdark_used,
+                cosmetic=cosmetic,
+                cosmetic_method=cosmetic_method,
+                cosmetic_threshold=cosmetic_threshold,
+                la_cosmic_params=la_cosmic_params,
+                bad_pixel_map_path=bad_pixel_map_local,
+                band_height=plan.band_height,
+                in_memory=plan.in_memory,
+                workers=job.settings.get('stackingWorkers'),
+                state_path=state_input_path,
+                fold_state=streamed is None,
+                save_state=bool(job.settings.get('saveMasterState', True)) and not superdark_used,
+                superdark=superdark_used,
+            )
+            await update_job_progress(job_id, 40, stage='stacking')
+            stacked = await run_cpu(job_stages.stack_master, spec)
+            rec_method, rec_sigma, reason = stacked.recommendation
 
             # --- Compute diagnostics/stats for master frame ---
+            frame_stats = stacked.frame_stats
+            outlier_ratio = frame_stats.outlier_ratio
             master_stats = {
-                'n_frames': len(valid_files),
+                'n_frames': stacked.n_frames,
                 'stacking_method': method,
+                'execution': plan.summary(),
                 'sigma_threshold': sigma if method in ['sigma', 'winsorized'] else None,
-                'mean': float(np.mean(master)),
-                'median': float(np.median(master)),
-                'std': float(np.std(master)),
-                'min': float(np.min(master)),
-                'max': float(np.max(master)),
+                'mean': frame_stats.mean,
+                'median': frame_stats.median,
+                'std': frame_stats.std,
+                'min': frame_stats.min,
+                'max': frame_stats.max,
+                'outlier_count': frame_stats.outlier_count,
+                'outlier_ratio': outlier_ratio,
+                'histogram': frame_stats.histogram.tolist(),
+                'histogram_bins': frame_stats.bin_edges.tolist(),
             }
-            # Outlier count: pixels > 5 sigma from mean
-            mean = np.mean(master)
-            std = np.std(master)
-            outlier_count = int(np.sum(np.abs(master - mean) > 5 * std))
-            total_pixels = master.size
-            outlier_ratio = outlier_count / total_pixels if total_pixels > 0 else 0
-            master_stats['outlier_count'] = outlier_count
-            master_stats['outlier_ratio'] = outlier_ratio
-            # Histogram (list of bin counts)
-            hist, bin_edges = np.histogram(master, bins=64)
-            master_stats['histogram'] = hist.tolist()
-            master_stats['histogram_bins'] = bin_edges.tolist()
             # Add stacking recommendation reason
             master_stats['recommendation'] = reason
+            if incremental_state_path and master_state is not None:
+                master_stats['incremental'] = {'new_frames': len(valid_files), 'total_frames': stacked.n_frames}
+            if stacked.rejection is not None:
+                master_stats['rejection'] = stacked.rejection
 
             # --- Calibration Scoring Logic (per frame type) ---
             score = 10
@@ -1189,48 +1197,44 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
             master_stats['recommendations'] = recommendations
 
             # Cancellation check after stacking
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
+            if cancel_token.cancelled:
                 print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled after stacking.")
                 return
             # --- Dark scaling logic ---
+            scaling_factor = 1.0
             if frame_type == 'dark' and dark_scaling:
-                from .calibration_worker import estimate_dark_scaling_factor
                 try:
+                    # valid_files holds the Superdark alone when one is used, otherwise the stacked darks
                     if superdark_used:
                         print(f"[SUPERDARK] Dark scaling will be applied to Superdark master.")
-                        darks_for_scaling = [superdark_local]
                     else:
-                        print(f"[{datetime.utcnow().isoformat()}] [BG] Calling estimate_dark_scaling_factor with {len(local_files)} darks and {len(local_light_files)} lights...")
-                        darks_for_scaling = local_files
+                        print(f"[{datetime.utcnow().isoformat()}] [BG] Calling estimate_dark_scaling_factor with {len(valid_files)} darks and {len(local_light_files)} lights...")
                     if job.settings.get('darkScalingAuto', True):
-                        await update_job_progress(job_id, 50)
-                        scaling_factor = estimate_dark_scaling_factor(darks_for_scaling, local_light_files if local_light_files else None)
+                        await update_job_progress(job_id, 50, stage='dark_scaling')
+                        scaling_factor = await run_cpu(job_stages.dark_scaling_factor, valid_files, job_light_files)
                         print(f"[{datetime.utcnow().isoformat()}] [BG] Auto-estimated dark scaling factor: {scaling_factor:.4f}")
                     else:
                         scaling_factor = float(job.settings.get('darkScalingFactor', 1.0))
                         print(f"[{datetime.utcnow().isoformat()}] [BG] Manual dark scaling factor: {scaling_factor:.4f}")
-                    master = master * scaling_factor
-                    await update_job_progress(job_id, 60)
+                    await update_job_progress(job_id, 60, stage='saving')
                 except Exception as e:
                     tb = traceback.format_exc()
                     print(f"[{datetime.utcnow().isoformat()}] [ERROR] Exception in dark scaling: {e}\n{tb}")
                     await insert_job(job_id, status="failed", error=f"Dark scaling failed: {e}\n{tb}", progress=40)
                     return
             else:
-                await update_job_progress(job_id, 60)
+                await update_job_progress(job_id, 60, stage='saving')
             # Cancellation check before saving results
-            job_status = await get_job(job_id)
-            if job_status and job_status.get("status") == "cancelled":
+            if cancel_token.cancelled:
                 print(f"[{datetime.utcnow().isoformat()}] [CANCEL] Job {job_id} cancelled before saving results.")
                 return
             fits_path = os.path.join(tmpdir, 'master.fits')
             png_path = os.path.join(tmpdir, 'master.png')
-            print(f"[{datetime.utcnow().isoformat()}] [BG] Running save_master_frame...")
-            save_master_frame(master, fits_path)
-            print(f"[{datetime.utcnow().isoformat()}] [BG] Running save_master_preview...")
-            save_master_preview(master, png_path)
-            await update_job_progress(job_id, 75)
+            print(f"[{datetime.utcnow().isoformat()}] [BG] Running save_master_frame and save_master_preview...")
+            await run_cpu(job_stages.finalize_master, stacked.master_path, fits_path, png_path, scaling_factor)
+            state_path = stacked.state_path
+            rejection_map_path = stacked.rejection_map_path
+            await update_job_progress(job_id, 75, stage='uploading_preview')
             fits_storage_path = output_base_with_ts + '.fits'
             png_storage_path = output_base_with_ts + '.png'
             # --- Upload PNG preview first, notify frontend, then upload FITS in background ---
@@ -1244,7 +1248,7 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                 return
             print(f"[{datetime.utcnow().isoformat()}] [BG] Preview PNG uploaded to: {png_storage_path}")
             print(f"[{datetime.utcnow().isoformat()}] [BG] Preview public URL: {preview_url}")
-            await update_job_progress(job_id, 98)
+            await update_job_progress(job_id, 98, stage='finalizing')
             # --- Mark job as success for the frontend as soon as preview is ready ---
             # Always include project_id, user_id, and frameType in result JSON
             base_result = {
@@ -1254,8 +1258,26 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                 "preview_url": preview_url,
                 "preview_png_path": png_storage_path
             }
-            await insert_job(job_id, status="success", result=base_result, diagnostics=master_stats, warnings=[], error=None, progress=100)
+            await insert_job(job_id, status="success", result=base_result, diagnostics=master_stats, warnings=[], error=None, progress=100,
+                             stage='preview_ready')
             print(f"[{datetime.utcnow().isoformat()}] [BG] Notified frontend of preview availability.")
+            # The state and rejection map live in tmpdir, which is gone by the time the
+            # background FITS upload finishes, so upload them here; a failure only drops that entry
+            sidecar_result = {}
+            if state_path:
+                state_storage_path = output_base_with_ts + STATE_SUFFIX
+                try:
+                    await asyncio.to_thread(upload_file, job.output_bucket, state_storage_path, state_path, False)
+                    sidecar_result["state_path"] = state_storage_path
+                except Exception as e:
+                    print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to upload stacking state: {e}")
+            if rejection_map_path:
+                rejection_storage_path = output_base_with_ts + '_rejection_map.fits'
+                try:
+                    await asyncio.to_thread(upload_file, job.output_bucket, rejection_storage_path, rejection_map_path, False)
+                    sidecar_result["rejection_map_path"] = rejection_storage_path
+                except Exception as e:
+                    print(f"[{datetime.utcnow().isoformat()}] [ERROR] Failed to upload rejection map: {e}")
             # Now upload the FITS file in the background (does not block user)
             def upload_fits_bg():
                 try:
@@ -1268,10 +1290,12 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                     asyncio.set_event_loop(loop)
                     fits_result = {
                         **base_result,
+                        **sidecar_result,
                         "fits_path": fits_storage_path
                     }
                     print(f"[LOG] Background thread updating result for job {job_id} (not overwriting diagnostics)", flush=True)
-                    loop.run_until_complete(insert_job(job_id, status="success", result=fits_result, diagnostics=None, warnings=[], error=None, progress=100))
+                    loop.run_until_complete(insert_job(job_id, status="success", result=fits_result, diagnostics=None, warnings=[], error=None, progress=100,
+                                                       stage='fits_uploaded'))
                     loop.close()
                 except Exception as e:
                     print(f"[{datetime.utcnow().isoformat()}] [ERROR] (background) Failed to upload FITS: {e}")
@@ -1288,6 +1312,7 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
                 'rejected': len(rejected_files),
                 'rejected_details': rejected_files,
                 'master_stats': master_stats,
+                **sidecar_result,
                 "projectId": job.project_id,
                 "userId": job.user_id,
                 "frameType": frame_type
@@ -1298,40 +1323,8 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
             # --- Per-light Dark Optimization ---
             if frame_type == 'dark' and job.settings.get('darkOptimization', False) and local_light_files:
                 print(f"[OPT] Per-light dark optimization enabled. Matching each light to master dark.")
-                # Load master dark (already stacked)
-                master_dark = master
-                optimized_lights = []
-                scaling_factors = []
-                for light_path in local_light_files:
-                    with fits.open(light_path) as hdul:
-                        light_data = hdul[0].data.astype(np.float32)
-                    # Compute scaling factor (median ratio)
-                    median_light = np.median(light_data)
-                    median_dark = np.median(master_dark)
-                    scaling = median_light / median_dark if median_dark != 0 else 1.0
-                    scaling = max(0.5, min(2.0, scaling))
-                    scaled_dark = master_dark * scaling
-                    optimized = light_data - scaled_dark
-                    optimized_lights.append(optimized)
-                    scaling_factors.append(scaling)
-                print(f"[OPT] Used scaling factors for each light: {scaling_factors}")
-                # Stack optimized lights using the selected method
-                arr = np.stack(optimized_lights, axis=0)
-                if method == 'median':
-                    master = np.median(arr, axis=0)
-                elif method == 'mean':
-                    master = np.mean(arr, axis=0)
-                elif method == 'sigma':
-                    if sigma is None:
-                        sigma = 3.0
-                    med = np.median(arr, axis=0)
-                    std = np.std(arr, axis=0)
-                    mask = np.abs(arr - med) < (sigma * std)
-                    master = np.mean(np.where(mask, arr, np.nan), axis=0)
-                    master = np.nan_to_num(master)
-                else:
-                    master = np.median(arr, axis=0)  # fallback
-                print(f"[OPT] Per-light dark optimization complete. Stacked {len(optimized_lights)} optimized lights.")
+                await run_cpu(job_stages.optimize_lights, stacked.master_path, local_light_files, method, sigma,
+                              plan.band_height, scaling_factor)
     except Exception as e:
         tb = traceback.format_exc()
         print(f"[FAIL] Calibration job failed: job_id={job_id}, frame_type={getattr(job, 'frame_type', 'unknown')}, error={e}\n{tb}", flush=True)
@@ -1339,14 +1332,13 @@ async def run_calibration_job(job: CalibrationJobRequest, job_id: str):
         return
 
 @app.post("/jobs/submit")
-async def submit_job(job: CalibrationJobRequest, request: Request, background_tasks: BackgroundTasks):
+async def submit_job(job: CalibrationJobRequest, request: Request):
     try:
         print(f"[{datetime.utcnow().isoformat()}] [API] /jobs/submit called. Raw body: {await request.body()}")
         print(f"[{datetime.utcnow().isoformat()}] [API] Parsed job: {job.dict()}")
         job_id = f"job-{uuid.uuid4().hex[:8]}"
-        await insert_job(job_id, status="queued", progress=0)
+        await enqueue_job(job_id, 'calibration', job)
         print(f"[{datetime.utcnow().isoformat()}] [API] Queued calibration job: {job_id}")
-        background_tasks.add_task(run_calibration_job, job, job_id)
         return {"jobId": job_id}
     except Exception as e:
         tb = traceback.format_exc()
@@ -1434,8 +1426,67 @@ async def get_job_progress(job_id: str):
     job = await get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    print(f"[{datetime.utcnow().isoformat()}] [API] Progress for {job_id}: {job.get('progress', 0)} status={job['status']}")
-    return {"job_id": job_id, "progress": job.get("progress", 0), "status": job["status"]}
+    progress = job.get("progress", 0)
+    pending = progress_reporter.pending(job_id)
+    if pending and pending[0] is not None and job["status"] not in TERMINAL_STATUSES:
+        # Running here and not flushed yet
+        progress = pending[0]
+    print(f"[{datetime.utcnow().isoformat()}] [API] Progress for {job_id}: {progress} status={job['status']}")
+    return {"job_id": job_id, "progress": progress, "status": job["status"]}
+
+def _job_result_event(job):
+    result = job.get("result")
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "error": job.get("error"),
+        "result": json.loads(result) if isinstance(result, str) else result,
+    }
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events stream of a job: a 'snapshot', then 'progress' events
+    (progress, stage) as they happen, 'partial_result' for early success writes
+    (e.g. the preview; see PARTIAL_RESULT_STAGES), and finally 'result' once the
+    job's last terminal write lands. The database is read at the start and at the
+    end, plus once per partial result that came from another node.
+    """
+    queue = job_event_bus.subscribe(job_id)
+
+    async def stream():
+        try:
+            job = await get_job(job_id)
+            if not job:
+                yield format_sse("error", {"job_id": job_id, "error": "Job not found"})
+                return
+            pending = progress_reporter.pending(job_id)
+            progress = pending[0] if pending and pending[0] is not None else job.get("progress", 0)
+            yield format_sse("snapshot", {"job_id": job_id, "status": job["status"], "progress": progress})
+            while job["status"] not in TERMINAL_STATUSES:
+                if await request.is_disconnected():
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get("status") in TERMINAL_STATUSES and event.get("stage") in PARTIAL_RESULT_STAGES:
+                    # More of the result follows in a later write; keep streaming until then
+                    partial = event if "result" in event else (await get_job(job_id) or event)
+                    yield format_sse("partial_result", _job_result_event(partial))
+                    continue
+                if event.get("status") in TERMINAL_STATUSES:
+                    # The event may come from another node without its result; read the row once
+                    job = await get_job(job_id) or event
+                    break
+                yield format_sse("progress", {k: v for k, v in event.items() if k != "result"})
+            yield format_sse("result", _job_result_event(job))
+        finally:
+            job_event_bus.unsubscribe(job_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 def generate_png_preview(fits_path, png_path, downsample_to=512):
     with fits.open(fits_path) as hdul:
@@ -1484,9 +1535,8 @@ async def create_superdark(request: Request):
     
     # Download all files to tempdir
     import tempfile, os
-    from .supabase_io import download_file, upload_file
+    from .supabase_io import upload_file
     from .fits_analysis import analyze_fits_headers
-    from .calibration_worker import create_master_frame
     from astropy.io import fits
     import numpy as np
     
@@ -1494,10 +1544,23 @@ async def create_superdark(request: Request):
         with tempfile.TemporaryDirectory() as tmpdir:
             local_files = []
             metadata_list = []
+            # Frames in the catalog can be checked before anything is downloaded
+            catalogued = await lookup_frames(input_paths)
+            if len(catalogued) == len(set(input_paths)):
+                frames = list(catalogued.values())
+                catalog_temps = [f.temperature for f in frames if f.temperature is not None]
+                if len({f.camera for f in frames}) > 1:
+                    return JSONResponse(status_code=400, content={"error": "All files must be from the same camera."})
+                if len({f.binning for f in frames}) > 1:
+                    return JSONResponse(status_code=400, content={"error": "All files must have the same binning."})
+                if len({f.gain for f in frames}) > 1:
+                    return JSONResponse(status_code=400, content={"error": "All files must have the same gain."})
+                if catalog_temps and (max(catalog_temps) - min(catalog_temps) > 1.0):
+                    return JSONResponse(status_code=400, content={"error": "All files must have similar temperature (±1°C)."})
             for i, spath in enumerate(input_paths):
                 local_path = os.path.join(tmpdir, f"input_{i}.fits")
                 try:
-                    download_file(input_bucket, spath, local_path)
+                    await storage_client.download(input_bucket, spath, local_path)
                     local_files.append(local_path)
                     with fits.open(local_path) as hdul:
                         header = hdul[0].header
@@ -1538,22 +1601,10 @@ async def create_superdark(request: Request):
             if temps and (max(temps) - min(temps) > 1.0):
                 return JSONResponse(status_code=400, content={"error": "All files must have similar temperature (±1°C)."})
             
-            # Stack files
-            master = create_master_frame(
-                local_files,
-                method=stacking_method,
-                sigma_clip=sigma if stacking_method in ['sigma', 'winsorized'] else None,
-                cosmetic=None,
-                cosmetic_method=None,
-                cosmetic_threshold=None,
-                la_cosmic_params=None,
-                bad_pixel_map=None
-            )
-            
-            # Save Superdark
+            # Stack files and save the Superdark (compute process pool)
             from datetime import datetime
             fits_path = os.path.join(tmpdir, 'superdark.fits')
-            fits.PrimaryHDU(master).writeto(fits_path, overwrite=True)
+            await run_cpu(job_stages.stack_superdark, local_files, stacking_method, sigma, fits_path)
             storage_path = f"{user_id}/{project_id}/{superdark_name.replace(' ', '_')}_{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.fits"
             
             try:
@@ -1635,127 +1686,117 @@ async def analyze_temp_file(request: Request):
         if not temp_path or not user_id:
             raise HTTPException(status_code=400, detail="Missing tempPath or userId")
         
-        # Create a local temporary file for analysis
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-            temp_file_path = temp_file.name
-        
         try:
-            # Download the temp file from Supabase to local temp file
-            from .supabase_io import download_file
-            download_file(bucket, temp_path, temp_file_path)
+            # Only the header is analyzed: read its blocks with range requests, not the whole file
+            header, object_headers = await asyncio.gather(
+                storage_client.fetch_header(bucket, temp_path),
+                storage_client.head(bucket, temp_path),
+            )
+            # Image shape from NAXISn, numpy order (NAXIS2, NAXIS1)
+            image_shape = tuple(header.get(f'NAXIS{i}', 0) for i in range(header.get('NAXIS', 0), 0, -1))
+            file_size = int(object_headers.get('content-length', 0)) if object_headers is not None else 0
+
+            # Extract metadata
+            metadata = extract_metadata(header)
             
-            # Open and analyze the FITS file
-            with fits.open(temp_file_path) as hdul:
-                header = hdul[0].header
-                
-                # Extract metadata
-                metadata = extract_metadata(header)
-                
-                # Determine frame type
-                frame_type = get_frame_type_from_header(header)
-                
-                # Validate required metadata for superdark creation
-                validation_results = {
-                    "has_required_metadata": True,
-                    "missing_fields": [],
-                    "warnings": [],
-                    "quality_score": 100
-                }
-                
-                # Check for critical metadata fields
-                required_fields = {
-                    'instrument': metadata.get('instrument'),
-                    'binning': metadata.get('binning'),
-                    'gain': metadata.get('gain'),
-                    'temperature': metadata.get('temperature'),
-                    'exposure_time': metadata.get('exposure_time')
-                }
-                
-                for field, value in required_fields.items():
-                    if value is None or value == '':
-                        validation_results["missing_fields"].append(field)
-                        validation_results["has_required_metadata"] = False
-                        validation_results["quality_score"] -= 20
-                
-                # Check for frame type consistency
-                if frame_type != 'dark':
-                    validation_results["warnings"].append(f"Frame type detected as '{frame_type}', expected 'dark'")
-                    validation_results["quality_score"] -= 10
-                
-                # Check for reasonable temperature range (-50°C to +50°C)
-                temp = metadata.get('temperature')
-                if temp is not None:
-                    if temp < -50 or temp > 50:
-                        validation_results["warnings"].append(f"Unusual temperature: {temp}°C (expected -50°C to +50°C)")
+            # Determine frame type
+            frame_type = get_frame_type_from_header(header)
+            
+            # Validate required metadata for superdark creation
+            validation_results = {
+                "has_required_metadata": True,
+                "missing_fields": [],
+                "warnings": [],
+                "quality_score": 100
+            }
+            
+            # Check for critical metadata fields
+            required_fields = {
+                'instrument': metadata.get('instrument'),
+                'binning': metadata.get('binning'),
+                'gain': metadata.get('gain'),
+                'temperature': metadata.get('temperature'),
+                'exposure_time': metadata.get('exposure_time')
+            }
+            
+            for field, value in required_fields.items():
+                if value is None or value == '':
+                    validation_results["missing_fields"].append(field)
+                    validation_results["has_required_metadata"] = False
+                    validation_results["quality_score"] -= 20
+            
+            # Check for frame type consistency
+            if frame_type != 'dark':
+                validation_results["warnings"].append(f"Frame type detected as '{frame_type}', expected 'dark'")
+                validation_results["quality_score"] -= 10
+            
+            # Check for reasonable temperature range (-50°C to +50°C)
+            temp = metadata.get('temperature')
+            if temp is not None:
+                if temp < -50 or temp > 50:
+                    validation_results["warnings"].append(f"Unusual temperature: {temp}°C (expected -50°C to +50°C)")
+                    validation_results["quality_score"] -= 5
+            
+            # Check for reasonable gain values using camera-aware validation
+            gain = metadata.get('gain')
+            if gain is not None:
+                camera_name = metadata.get('instrument', '')
+                max_gain = get_camera_max_gain(camera_name)
+                
+                if max_gain > 0:
+                    # Camera-specific validation
+                    if gain > max_gain:
+                        validation_results["warnings"].append(f"Gain ({gain}) exceeds camera maximum ({max_gain})")
                         validation_results["quality_score"] -= 5
-                
-                # Check for reasonable gain values using camera-aware validation
-                gain = metadata.get('gain')
-                if gain is not None:
-                    camera_name = metadata.get('instrument', '')
-                    max_gain = get_camera_max_gain(camera_name)
-                    
-                    if max_gain > 0:
-                        # Camera-specific validation
-                        if gain > max_gain:
-                            validation_results["warnings"].append(f"Gain ({gain}) exceeds camera maximum ({max_gain})")
-                            validation_results["quality_score"] -= 5
-                        elif gain < 0.1:
-                            validation_results["warnings"].append(f"Gain ({gain}) is unusually low (minimum ~0.1)")
-                            validation_results["quality_score"] -= 5
-                    else:
-                        # Unknown camera - use generous threshold
-                        if gain > 1000:
-                            validation_results["warnings"].append(f"Gain ({gain}) is unusually high (>1000)")
-                            validation_results["quality_score"] -= 5
-                        elif gain < 0.1:
-                            validation_results["warnings"].append(f"Gain ({gain}) is unusually low (minimum ~0.1)")
-                            validation_results["quality_score"] -= 5
-                
-                # Check for reasonable exposure time (1s to 3600s for darks)
-                exp_time = metadata.get('exposure_time')
-                if exp_time is not None:
-                    if exp_time < 1 or exp_time > 3600:
-                        validation_results["warnings"].append(f"Unusual exposure time: {exp_time}s (expected 1s to 3600s)")
+                    elif gain < 0.1:
+                        validation_results["warnings"].append(f"Gain ({gain}) is unusually low (minimum ~0.1)")
                         validation_results["quality_score"] -= 5
-                
-                # Check image dimensions
-                if len(hdul[0].data.shape) != 2:
-                    validation_results["warnings"].append("Image is not 2D")
-                    validation_results["quality_score"] -= 15
                 else:
-                    height, width = hdul[0].data.shape
-                    if height < 100 or width < 100:
-                        validation_results["warnings"].append(f"Very small image: {width}x{height}")
-                        validation_results["quality_score"] -= 10
-                    elif height > 10000 or width > 10000:
-                        validation_results["warnings"].append(f"Very large image: {width}x{height}")
+                    # Unknown camera - use generous threshold
+                    if gain > 1000:
+                        validation_results["warnings"].append(f"Gain ({gain}) is unusually high (>1000)")
                         validation_results["quality_score"] -= 5
-                
-                # Get file size from the downloaded temp file
-                file_size_mb = round(os.path.getsize(temp_file_path) / 1024 / 1024, 2)
-                
-                return JSONResponse(
-                    status_code=200,
-                    content={
-                        "success": True,
-                        "type": frame_type,
-                        "metadata": metadata,
-                        "path": temp_path,
-                        "validation": validation_results,
-                        "file_size_mb": file_size_mb,
-                        "image_dimensions": list(hdul[0].data.shape) if len(hdul[0].data.shape) == 2 else None
-                    }
-                )
+                    elif gain < 0.1:
+                        validation_results["warnings"].append(f"Gain ({gain}) is unusually low (minimum ~0.1)")
+                        validation_results["quality_score"] -= 5
+            
+            # Check for reasonable exposure time (1s to 3600s for darks)
+            exp_time = metadata.get('exposure_time')
+            if exp_time is not None:
+                if exp_time < 1 or exp_time > 3600:
+                    validation_results["warnings"].append(f"Unusual exposure time: {exp_time}s (expected 1s to 3600s)")
+                    validation_results["quality_score"] -= 5
+            
+            # Check image dimensions
+            if len(image_shape) != 2:
+                validation_results["warnings"].append("Image is not 2D")
+                validation_results["quality_score"] -= 15
+            else:
+                height, width = image_shape
+                if height < 100 or width < 100:
+                    validation_results["warnings"].append(f"Very small image: {width}x{height}")
+                    validation_results["quality_score"] -= 10
+                elif height > 10000 or width > 10000:
+                    validation_results["warnings"].append(f"Very large image: {width}x{height}")
+                    validation_results["quality_score"] -= 5
+            
+            file_size_mb = round(file_size / 1024 / 1024, 2)
+            
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "success": True,
+                    "type": frame_type,
+                    "metadata": metadata,
+                    "path": temp_path,
+                    "validation": validation_results,
+                    "file_size_mb": file_size_mb,
+                    "image_dimensions": list(image_shape) if len(image_shape) == 2 else None
+                }
+            )
         except Exception as e:
             logger.error(f"Error processing temp file {temp_path}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
-        finally:
-            # Clean up local temp file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
                 
     except HTTPException:
         raise
@@ -1786,25 +1827,29 @@ async def analyze_superdark(request: Request):
             
         try:
             # Download from Supabase storage
-            download_file(bucket, superdark_path, local_temp_path)
+            await storage_client.download(bucket, superdark_path, local_temp_path)
             
-            # Analyze the FITS file
+            # Analyze the FITS file (the header only; the pixels are read by the stage)
             with fits.open(local_temp_path) as hdul:
                 header = hdul[0].header
-                data = hdul[0].data
                 
-                if data is None:
+                if not header.get('NAXIS'):
                     return JSONResponse(
                         status_code=400,
                         content={'success': False, 'error': 'No image data found in superdark'}
                     )
                 
-                # Calculate comprehensive statistics
-                mean_val = float(np.mean(data))
-                median_val = float(np.median(data))
-                std_val = float(np.std(data))
-                min_val = float(np.min(data))
-                max_val = float(np.max(data))
+                # Calculate comprehensive statistics in one fused scan, in a worker process
+                saturation_threshold = 60000  # Conservative threshold
+                frame_stats = await run_cpu(job_stages.image_statistics, local_temp_path, bins=100, outlier_sigma=5.0,
+                                            saturation=saturation_threshold)
+                # Read-only memory map for the region sampling below
+                data = load_image(local_temp_path)
+                mean_val = frame_stats.mean
+                median_val = frame_stats.median
+                std_val = frame_stats.std
+                min_val = frame_stats.min
+                max_val = frame_stats.max
                 
                 # Calculate quality metrics
                 recommendations = []
@@ -1836,8 +1881,7 @@ async def analyze_superdark(request: Request):
                     score -= 1.5
                 
                 # 3. Check for saturation
-                saturation_threshold = 60000  # Conservative threshold
-                saturated_pixels = np.sum(data >= saturation_threshold)
+                saturated_pixels = frame_stats.saturated_count
                 total_pixels = data.size
                 saturation_percent = (saturated_pixels / total_pixels) * 100
                 
@@ -1878,8 +1922,7 @@ async def analyze_superdark(request: Request):
                     score -= 1.5
                 
                 # 5. Check for hot pixels
-                hot_pixel_threshold = mean_val + 5 * std_val
-                hot_pixels = np.sum(data > hot_pixel_threshold)
+                hot_pixels = frame_stats.hot_count
                 hot_pixel_percent = (hot_pixels / total_pixels) * 100
                 
                 if hot_pixel_percent < 0.01:
@@ -1897,8 +1940,8 @@ async def analyze_superdark(request: Request):
                 score = max(0.0, min(10.0, score))
                 score = round(score, 1)
                 
-                # Generate histogram for display
-                hist, bins = np.histogram(data.flatten(), bins=100, range=(min_val, max_val))
+                # Histogram for display (100 bins over [min, max])
+                hist = frame_stats.histogram
                 
                 return {
                     'success': True,
@@ -2242,7 +2285,7 @@ class CosmicRayDetectionRequest(BaseModel):
     analyze_image_quality: bool = True  # Generate image quality metrics
 
 @app.post("/cosmic-rays/detect")
-async def detect_cosmic_rays(request: CosmicRayDetectionRequest, background_tasks: BackgroundTasks):
+async def detect_cosmic_rays(request: CosmicRayDetectionRequest):
     """
     Detect and remove cosmic rays from astronomical images.
     
@@ -2269,11 +2312,8 @@ async def detect_cosmic_rays(request: CosmicRayDetectionRequest, background_task
         # Generate job ID
         job_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=16))
         
-        # Insert job into database
-        await insert_job(job_id, "running", progress=0)
-        
-        # Start background task
-        background_tasks.add_task(run_cosmic_ray_job, request, job_id, validated_params)
+        # Queue the job for a worker
+        await enqueue_job(job_id, 'cosmic_ray', request, validated_params)
         
         return {"job_id": job_id, "status": "started", "message": "Cosmic ray detection job started"}
         
@@ -2295,16 +2335,16 @@ async def run_cosmic_ray_job(request: CosmicRayDetectionRequest, job_id: str, pa
             fits_paths = [f"{request.user_id}/{request.project_id}/{request.frame_type}/{filename}" 
                          for filename in request.fits_paths]
         
-        # Initialize cosmic ray detector
-        detector = CosmicRayDetector(
-            sigma_clip=params['sigma_clip'],
-            sigma_frac=params['sigma_frac'],
-            objlim=params['objlim'],
-            gain=params['gain'],
-            readnoise=params['readnoise'],
-            satlevel=params['satlevel'],
-            niter=params['niter']
-        )
+        # Cosmic ray detector settings (the detector is built in the compute process)
+        detector_params = {
+            'sigma_clip': params['sigma_clip'],
+            'sigma_frac': params['sigma_frac'],
+            'objlim': params['objlim'],
+            'gain': params['gain'],
+            'readnoise': params['readnoise'],
+            'satlevel': params['satlevel'],
+            'niter': params['niter'],
+        }
         
         # Process files
         results = []
@@ -2334,12 +2374,8 @@ async def run_cosmic_ray_job(request: CosmicRayDetectionRequest, job_id: str, pa
                 if request.save_cleaned:
                     output_path = local_temp_path.replace('.fit', '_cleaned.fits').replace('.fits', '_cleaned.fits')
                 
-                result = detector.process_fits_file(
-                    local_temp_path,
-                    output_path=output_path,
-                    method=params['method'],
-                    save_mask=params['save_mask']
-                )
+                result = await run_cpu(job_stages.detect_cosmic_rays, local_temp_path, detector_params,
+                                       params['method'], params['save_mask'], output_path)
                 
                 # Upload results back to storage if we saved them
                 if request.save_cleaned and output_path and os.path.exists(output_path):
@@ -2406,7 +2442,7 @@ async def run_cosmic_ray_job(request: CosmicRayDetectionRequest, job_id: str, pa
         await insert_job(job_id, "failed", error=str(e))
 
 @app.post("/cosmic-rays/batch-detect")
-async def batch_detect_cosmic_rays(request: CosmicRayDetectionRequest, background_tasks: BackgroundTasks):
+async def batch_detect_cosmic_rays(request: CosmicRayDetectionRequest):
     """
     Enhanced batch cosmic ray detection with auto-tuning and multi-algorithm support.
     
@@ -2440,11 +2476,8 @@ async def batch_detect_cosmic_rays(request: CosmicRayDetectionRequest, backgroun
         # Generate job ID
         job_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=16))
         
-        # Insert job into database
-        await insert_job(job_id, "running", progress=0)
-        
-        # Start enhanced background task
-        background_tasks.add_task(run_enhanced_cosmic_ray_job, request, job_id, validated_params)
+        # Queue the enhanced job for a worker
+        await enqueue_job(job_id, 'cosmic_ray_batch', request, validated_params)
         
         return {"job_id": job_id, "status": "started", "message": f"Enhanced batch cosmic ray detection started with {request.method} method"}
         
@@ -2500,16 +2533,16 @@ async def run_enhanced_cosmic_ray_job(request: CosmicRayDetectionRequest, job_id
             fits_paths = [f"{request.user_id}/{request.project_id}/{request.frame_type}/{filename}" 
                          for filename in request.fits_paths]
         
-        # Initialize cosmic ray detector
-        detector = CosmicRayDetector(
-            sigma_clip=params['sigma_clip'],
-            sigma_frac=params['sigma_frac'],
-            objlim=params['objlim'],
-            gain=params['gain'],
-            readnoise=params['readnoise'],
-            satlevel=params['satlevel'],
-            niter=params['niter']
-        )
+        # Cosmic ray detector settings (the detector is built in the compute process)
+        detector_params = {
+            'sigma_clip': params['sigma_clip'],
+            'sigma_frac': params['sigma_frac'],
+            'objlim': params['objlim'],
+            'gain': params['gain'],
+            'readnoise': params['readnoise'],
+            'satlevel': params['satlevel'],
+            'niter': params['niter'],
+        }
         
         # Process files with enhanced features
         results = []
@@ -2535,109 +2568,25 @@ async def run_enhanced_cosmic_ray_job(request: CosmicRayDetectionRequest, job_id
                     logger.warning(f"Failed to download {remote_path}, skipping")
                     continue
                 
-                # Load image data for analysis
-                with fits.open(local_temp_path) as hdul:
-                    data = hdul[0].data.astype(np.float64)
-                
-                # Phase 2: Image quality analysis
-                if params['analyze_image_quality']:
-                    quality_metrics = detector.get_image_quality_metrics(data)
+                output_path = None
+                if params['method'] not in ('multi', 'auto') and request.save_cleaned:
+                    output_path = local_temp_path.replace('.fit', '_cleaned.fits').replace('.fits', '_cleaned.fits')
+
+                # Quality analysis, auto-tuning and detection (compute process pool)
+                result, quality_metrics = await run_cpu(job_stages.detect_cosmic_rays_enhanced, local_temp_path,
+                                                        detector_params, params, output_path)
+                if quality_metrics is not None:
                     quality_metrics['file_path'] = remote_path
                     image_quality_metrics.append(quality_metrics)
-                
-                # Phase 2: Auto-tune parameters if enabled
-                original_params = {}
-                if params['auto_tune']:
-                    original_params = {
-                        'sigma_clip': detector.sigma_clip,
-                        'objlim': detector.objlim,
-                        'niter': detector.niter,
-                        'sigma_frac': detector.sigma_frac
-                    }
-                    
-                    tuned_params = detector.auto_tune_parameters(data)
-                    for param, value in tuned_params.items():
-                        setattr(detector, param, value)
-                
-                # Process with enhanced methods
-                if params['method'] == 'multi':
-                    # Multi-algorithm detection
-                    cleaned_data, crmask, multi_stats = detector.detect_multi_algorithm(
-                        data, 
-                        methods=params['multi_methods'],
-                        combine_method=params['combine_method']
-                    )
-                    
-                    result = {
-                        'method': 'multi',
-                        'num_cosmic_rays': int(np.sum(crmask)),
-                        'cosmic_ray_percentage': float(np.sum(crmask) / data.size * 100),
-                        'image_shape': data.shape,
-                        'multi_stats': multi_stats,
-                        'parameters': {
-                            'methods_used': params['multi_methods'],
-                            'combine_method': params['combine_method'],
-                            'auto_tuned': params['auto_tune']
-                        }
-                    }
-                    
-                elif params['method'] == 'auto':
-                    # Automatic method selection based on image characteristics
-                    quality = detector.get_image_quality_metrics(data)
-                    
-                    if quality['snr'] > 50 and quality['star_density'] > 0.01:
-                        # High quality image - use L.A.Cosmic
-                        cleaned_data, crmask = detector.detect_lacosmic(data)
-                        selected_method = 'lacosmic'
-                    else:
-                        # Lower quality image - use sigma clipping
-                        crmask = detector.detect_sigma_clipping(data)
-                        cleaned_data = detector.clean_cosmic_rays(data, crmask)
-                        selected_method = 'sigma_clip'
-                    
-                    result = {
-                        'method': f'auto-{selected_method}',
-                        'num_cosmic_rays': int(np.sum(crmask)),
-                        'cosmic_ray_percentage': float(np.sum(crmask) / data.size * 100),
-                        'image_shape': data.shape,
-                        'auto_selected_method': selected_method,
-                        'selection_reasoning': f"SNR: {quality['snr']:.1f}, Star density: {quality['star_density']:.3f}"
-                    }
-                    
-                else:
-                    # Standard single-method processing
-                    output_path = None
-                    if request.save_cleaned:
-                        output_path = local_temp_path.replace('.fit', '_cleaned.fits').replace('.fits', '_cleaned.fits')
-                    
-                    result = detector.process_fits_file(
-                        local_temp_path,
-                        output_path=output_path,
-                        method=params['method'],
-                        save_mask=params['save_mask']
-                    )
-                    
-                    # Upload results back to storage if we saved them
-                    if request.save_cleaned and output_path and os.path.exists(output_path):
-                        # Upload cleaned image
-                        cleaned_remote_path = remote_path.replace('.fit', '_cleaned.fits').replace('.fits', '_cleaned.fits')
-                        upload_file(request.bucket, output_path, cleaned_remote_path)
-                        result['cleaned_remote_path'] = cleaned_remote_path
-                        os.remove(output_path)  # Clean up local file
-                
-                # Add auto-tuning info
-                if params['auto_tune']:
-                    result['auto_tuned_parameters'] = {
-                        'sigma_clip': detector.sigma_clip,
-                        'objlim': detector.objlim,
-                        'niter': detector.niter,
-                        'sigma_frac': detector.sigma_frac
-                    }
-                    result['original_parameters'] = original_params
-                    # Restore original parameters
-                    for param, value in original_params.items():
-                        setattr(detector, param, value)
-                
+
+                # Upload results back to storage if we saved them
+                if output_path and os.path.exists(output_path):
+                    # Upload cleaned image
+                    cleaned_remote_path = remote_path.replace('.fit', '_cleaned.fits').replace('.fits', '_cleaned.fits')
+                    upload_file(request.bucket, output_path, cleaned_remote_path)
+                    result['cleaned_remote_path'] = cleaned_remote_path
+                    os.remove(output_path)  # Clean up local file
+
                 result['original_path'] = remote_path
                 results.append(result)
                 processed_count += 1
@@ -2791,7 +2740,6 @@ async def analyze_gradients(request: GradientAnalysisRequest, background_tasks:
 
 async def run_gradient_analysis_job(request: GradientAnalysisRequest, job_id: str):
     """Run gradient analysis job for multiple calibration frames."""
-    db = get_db()
     try:
         await insert_job(job_id, "running")
         await update_job_progress(job_id, 0)
@@ -2818,7 +2766,7 @@ async def run_gradient_analysis_job(request: GradientAnalysisRequest, job_id: st
         for i, (local_file, original_path) in enumerate(local_files):
             try:
                 # Analyze gradients in this frame
-                result = analyze_calibration_frame_gradients(local_file, request.frame_type)
+                result = await run_cpu(analyze_calibration_frame_gradients, local_file, request.frame_type)
                 
                 # Add file info to result
                 result_dict = {
@@ -2864,29 +2812,31 @@ async def run_gradient_analysis_job(request: GradientAnalysisRequest, job_id: st
         await update_job_progress(job_id, 100)
         
         # Update job with results
-        await db.fetch(
-            "UPDATE jobs SET status = $1, result = $2, diagnostics = $3 WHERE id = $4",
-            "completed",
-            json.dumps({
-                "summary": summary,
-                "frame_results": all_results,
-                "total_frames": len(all_results)
-            }),
-            json.dumps({
-                "frame_type": request.frame_type,
-                "analysis_method": "calibration_stage_detection"
-            }),
-            job_id
-        )
+        async with acquire() as conn:
+            await conn.execute(
+                "UPDATE jobs SET status = $1, result = $2, diagnostics = $3 WHERE job_id = $4",
+                "completed",
+                json.dumps({
+                    "summary": summary,
+                    "frame_results": all_results,
+                    "total_frames": len(all_results)
+                }),
+                json.dumps({
+                    "frame_type": request.frame_type,
+                    "analysis_method": "calibration_stage_detection"
+                }),
+                job_id
+            )
         
     except Exception as e:
         logger.error(f"Gradient analysis job {job_id} failed: {e}")
-        await db.fetch(
-            "UPDATE jobs SET status = $1, error = $2 WHERE id = $3",
-            "failed",
-            str(e),
-            job_id
-        )
+        async with acquire() as conn:
+            await conn.execute(
+                "UPDATE jobs SET status = $1, error = $2 WHERE job_id = $3",
+                "failed",
+                str(e),
+                job_id
+            )
 
 def generate_gradient_summary(results: list) -> dict:
     """Generate summary statistics from gradient analysis results."""
@@ -2964,6 +2914,7 @@ class HistogramAnalysisRequest(BaseModel):
     project_id: str = None
     user_id: str = None 
     frame_type: str = None  # 'bias', 'dark', 'flat' (auto-detected if None)
+    max_workers: int = None  # Frames analyzed at once (capped at HISTOGRAM_WORKERS)
 
 @app.post("/histograms/analyze")
 async def analyze_histograms(request: HistogramAnalysisRequest, background_tasks: BackgroundTasks):
@@ -3003,41 +2954,55 @@ async def analyze_histograms(request: HistogramAnalysisRequest, background_tasks
 
 async def run_histogram_analysis_job(request: HistogramAnalysisRequest, job_id: str):
     """Background task for running histogram analysis."""
+    local_files = []
     try:
-        from .histogram_analysis import analyze_calibration_frame_histograms
-        
         logger.info(f"Starting histogram analysis job {job_id}")
         
-        local_files = []
-        if request.bucket:
-            # Download from Supabase
-            logger.info(f"Downloading {len(request.fits_paths)} files from bucket {request.bucket}")
-            for fits_path in request.fits_paths:
-                local_path = f"/tmp/{job_id}_{os.path.basename(fits_path)}"
+        workers = max(1, min(request.max_workers or HISTOGRAM_WORKERS, HISTOGRAM_WORKERS))
+        analysis_slots = asyncio.Semaphore(workers)
+        
+        async def analyze_one(index: int, fits_path: str):
+            # Each frame is analyzed as soon as it is downloaded; the storage client
+            # bounds the downloads and analysis_slots the frames in the process pool
+            if request.bucket:
+                local_path = f"/tmp/{job_id}_{index}_{os.path.basename(fits_path)}"
+                local_files.append(local_path)
                 success = await download_file_with_fallback(
                     request.bucket, 
                     fits_path, 
                     local_path,
                     {"project_id": request.project_id, "user_id": request.user_id}
                 )
-                if success:
-                    local_files.append(local_path)
-                else:
+                if not success:
                     logger.warning(f"Failed to download {fits_path}")
-        else:
-            # Use local paths directly
-            local_files = request.fits_paths
+                    return None
+            else:
+                # Use local paths directly
+                local_path = fits_path
+            async with analysis_slots:
+                return await run_cpu(analyze_frame_histogram_dict, local_path, request.frame_type)
         
-        if not local_files:
+        fits_paths = request.fits_paths or []
+        if request.bucket:
+            logger.info(f"Downloading {len(fits_paths)} files from bucket {request.bucket}")
+        logger.info(f"Analyzing histograms for {len(fits_paths)} files, {workers} at a time")
+        
+        # gather keeps input order; every frame finishes before a failure is raised, so the
+        # cleanup below never deletes a file another frame is still downloading or reading
+        outcomes = await asyncio.gather(*[analyze_one(i, p) for i, p in enumerate(fits_paths)],
+                                        return_exceptions=True)
+        failure = next((r for r in outcomes if isinstance(r, BaseException)), None)
+        if failure is not None:
+            raise failure
+        frame_results = [r for r in outcomes if r is not None]
+        
+        if not frame_results:
             logger.error(f"No files available for analysis in job {job_id}")
             # Store results in memory instead of database
             job_results[job_id] = {"status": "failed", "error": "No files to analyze", "progress": 0}
             return
         
-        logger.info(f"Analyzing histograms for {len(local_files)} files")
-        
-        # Run histogram analysis
-        analysis_results = analyze_calibration_frame_histograms(local_files, request.frame_type)
+        analysis_results = summarize_frame_histograms(frame_results)
         
         # Generate summary for frontend
         summary = generate_histogram_summary(analysis_results)
@@ -3059,13 +3024,12 @@ async def run_histogram_analysis_job(request: HistogramAnalysisRequest, job_id:
     
     finally:
         # Cleanup downloaded files
-        if request.bucket and local_files:
-            for local_path in local_files:
-                if os.path.exists(local_path):
-                    try:
-                        os.unlink(local_path)
-                    except:
-                        pass
+        for local_path in local_files:
+            if os.path.exists(local_path):
+                try:
+                    os.unlink(local_path)
+                except:
+                    pass
 
 def generate_histogram_summary(analysis_results: dict) -> dict:
     """Generate a user-friendly summary of histogram analysis results."""
@@ -3141,6 +3105,14 @@ def generate_histogram_summary(analysis_results: dict) -> dict:
         "overall_recommendation": summary.get('overall_recommendation', '')
     }
 
+# --- Queued job types (claimed by JobWorker, see job_queue.py) ---
+# Calibration is what users wait on in the UI; batch cosmic-ray runs can wait behind it
+register_job_type('calibration', CalibrationJobRequest, run_calibration_job, priority=10)
+register_job_type('cosmetic_masks', CosmeticMaskRequest, run_cosmetic_mask_job)
+register_job_type('patterned_noise', PatternedNoiseRequest, run_patterned_noise_job)
+register_job_type('cosmic_ray', CosmicRayDetectionRequest, run_cosmic_ray_job)
+register_job_type('cosmic_ray_batch', CosmicRayDetectionRequest, run_enhanced_cosmic_ray_job, priority=-10)
+
 if __name__ == "__main__":
     # Force port 8000 and prevent port changes
     os.environ['PORT'] = '8000'  # Override any environment variables
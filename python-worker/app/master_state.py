@@ -0,0 +1,210 @@
+"""
+master_state.py
+
+Persisted sufficient statistics for incremental master frames.
+- Stores per-pixel Welford state (count, mean, M2) of a 'mean' or 'sigma'
+  (sigma-clipped mean) master, plus a manifest of the frames folded into it
+- New frames are folded into the saved state band by band, so updating a
+  master costs time proportional to the new frames only
+- The sidecar is a FITS file (PRIMARY header, COUNT/MEAN/M2 images and a
+  MANIFEST table) stored next to the master
+
+Sigma-clipped masters: the first fold clips the batch exactly like
+stacking.sigma_clip_combine (a pixel whose every sample is rejected keeps
+its middle sample(s), so its mean is the combiner's median fallback); later
+folds clip each new sample against the running mean/std of the saved state,
+then fold the survivors. A first fold's master() is therefore the master
+stack_tiled would build, and jobs saving a state build the master from it in
+the same band pass.
+"""
+
+import numpy as np
+from astropy.io import fits
+from typing import List, Optional, Sequence, Union
+
+from .frame_stack import FrameStack
+from .stacking import auto_band_height, sigma_clip_keep
+
+# Stacking methods whose masters can be updated incrementally
+INCREMENTAL_METHODS = ('mean', 'sigma')
+
+STATE_SUFFIX = '.state.fits'
+
+
+def _middle_samples(values: np.ndarray) -> np.ndarray:
+    """Mask of the middle sample(s) of each column: their mean is the column's median."""
+    n = values.shape[0]
+    order = np.argsort(values, axis=0)
+    columns = np.arange(values.shape[1])
+    middle = np.zeros(values.shape, dtype=bool)
+    middle[order[(n - 1) // 2], columns] = True
+    middle[order[n // 2], columns] = True
+    return middle
+
+
+class MasterState:
+    """Running per-pixel statistics of a mean-type master and the frames behind it."""
+
+    def __init__(self, method: str, count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+                 manifest: Optional[List[str]] = None, sigma_low: float = 3.0, sigma_high: float = 3.0,
+                 sigma_center: str = 'mean', sigma_scale: str = 'std', sigma_max_iters: Optional[int] = 1):
+        if method not in INCREMENTAL_METHODS:
+            raise ValueError(f"Method '{method}' cannot be updated incrementally, expected one of {INCREMENTAL_METHODS}")
+        self.method = method
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.manifest = list(manifest or [])
+        self.sigma_low = sigma_low
+        self.sigma_high = sigma_high
+        self.sigma_center = sigma_center
+        self.sigma_scale = sigma_scale
+        self.sigma_max_iters = sigma_max_iters
+
+    @classmethod
+    def empty(cls, method: str, shape=None, **sigma_options) -> 'MasterState':
+        """A state with no frames; with shape None the arrays are sized by the first fold."""
+        state = cls(method, None, None, None, **sigma_options)
+        if shape is not None:
+            state._allocate(shape)
+        return state
+
+    def _allocate(self, shape):
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    @property
+    def shape(self):
+        return None if self.mean is None else self.mean.shape
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.manifest)
+
+    def master(self) -> np.ndarray:
+        """The master frame this state describes (mean of the folded samples)."""
+        return self.mean.copy()
+
+    def std(self) -> np.ndarray:
+        """Per-pixel standard deviation of the folded samples."""
+        return np.sqrt(np.divide(self.m2, self.count, out=np.zeros_like(self.m2), where=self.count > 0))
+
+    def new_frames(self, names: Sequence[str]) -> List[int]:
+        """Indices of `names` not yet folded into this state."""
+        seen = set(self.manifest)
+        return [i for i, name in enumerate(names) if name not in seen]
+
+    def fold(self, frames: Union[FrameStack, Sequence[str]], names: Sequence[str],
+             band_height: Optional[int] = None, rejection_map: Optional[np.ndarray] = None):
+        """
+        Fold new frames (paths or a FrameStack) into the state; `names` go into the manifest.
+        rejection_map: optional uint16 (H x W) array, filled with the number of new frames
+            rejected per pixel (as sigma_clip_combine's rejection_map)
+        """
+        stack, owned = FrameStack.wrap(frames)
+        try:
+            if len(names) != len(stack):
+                raise ValueError(f"Got {len(names)} manifest names for {len(stack)} frames")
+            if self.mean is None:
+                self._allocate(stack.shape)
+            if stack.shape != self.shape:
+                raise ValueError(f"Frame shape {stack.shape} does not match master state {self.shape}")
+            height, width = self.shape
+            if band_height is None:
+                band_height = auto_band_height(len(stack), height, width)
+            first_fold = self.n_frames == 0
+            dtype = np.float32 if self.method == 'sigma' else np.float64
+            for y0, y1, band in stack.iter_bands(band_height, dtype=dtype):
+                keep = self._keep(band, y0, y1, first_fold,
+                                  None if rejection_map is None else rejection_map[y0:y1])
+                self._merge(band, keep, y0, y1)
+        finally:
+            if owned:
+                stack.close()
+        self.manifest.extend(names)
+
+    def _keep(self, band: np.ndarray, y0: int, y1: int, first_fold: bool,
+              rejection_map: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        if self.method == 'mean':
+            if rejection_map is not None:
+                rejection_map[...] = 0
+            return None
+        if first_fold:
+            keep = sigma_clip_keep(band, self.sigma_low, self.sigma_high, self.sigma_center,
+                                   self.sigma_scale, self.sigma_max_iters)
+            if rejection_map is not None:
+                rejection_map[...] = band.shape[0] - np.count_nonzero(keep, axis=0)
+            empty = ~np.any(keep, axis=0)
+            if np.any(empty):
+                keep[:, empty] = _middle_samples(band[:, empty])
+            return keep
+        mean = self.mean[y0:y1]
+        count = self.count[y0:y1]
+        std = np.sqrt(np.divide(self.m2[y0:y1], count, out=np.zeros(mean.shape), where=count > 0))
+        # Pixels without spread yet (fewer than two samples) accept anything
+        unbounded = std == 0
+        lower = np.where(unbounded, -np.inf, mean - self.sigma_low * std)
+        upper = np.where(unbounded, np.inf, mean + self.sigma_high * std)
+        keep = (band >= lower) & (band <= upper)
+        if rejection_map is not None:
+            rejection_map[...] = band.shape[0] - np.count_nonzero(keep, axis=0)
+        return keep
+
+    def _merge(self, band: np.ndarray, keep: Optional[np.ndarray], y0: int, y1: int):
+        # Batch statistics of the kept samples, merged with the running state (Chan et al.)
+        if keep is None:
+            n_b = np.full(band.shape[1:], band.shape[0], dtype=np.int64)
+            mean_b = np.mean(band, axis=0, dtype=np.float64)
+            m2_b = np.sum((band - mean_b) ** 2, axis=0, dtype=np.float64)
+        else:
+            n_b = np.count_nonzero(keep, axis=0)
+            total = np.sum(np.where(keep, band, 0.0), axis=0, dtype=np.float64)
+            mean_b = np.divide(total, n_b, out=np.zeros(total.shape), where=n_b > 0)
+            m2_b = np.sum(np.where(keep, band - mean_b, 0.0) ** 2, axis=0, dtype=np.float64)
+        count = self.count[y0:y1].astype(np.int64)
+        n = count + n_b
+        delta = mean_b - self.mean[y0:y1]
+        safe_n = np.maximum(n, 1)
+        self.mean[y0:y1] += np.where(n > 0, delta * n_b / safe_n, 0.0)
+        self.m2[y0:y1] += m2_b + np.where(n > 0, delta * delta * count * n_b / safe_n, 0.0)
+        self.count[y0:y1] = n
+
+    def save(self, path: str):
+        header = fits.Header()
+        header['METHOD'] = (self.method, 'Stacking method of the master')
+        header['NFRAMES'] = (self.n_frames, 'Frames folded into the state')
+        header['SIGLOW'] = self.sigma_low
+        header['SIGHIGH'] = self.sigma_high
+        header['SIGCEN'] = self.sigma_center
+        header['SIGSCALE'] = self.sigma_scale
+        header['SIGITER'] = (-1 if self.sigma_max_iters is None else self.sigma_max_iters, '-1 = until converged')
+        width = max([len(name) for name in self.manifest] + [1])
+        manifest = fits.BinTableHDU.from_columns(
+            [fits.Column(name='NAME', format=f'{width}A', array=np.array(self.manifest, dtype=f'U{width}'))],
+            name='MANIFEST')
+        fits.HDUList([
+            fits.PrimaryHDU(header=header),
+            fits.ImageHDU(self.count, name='COUNT'),
+            fits.ImageHDU(self.mean, name='MEAN'),
+            fits.ImageHDU(self.m2, name='M2'),
+            manifest,
+        ]).writeto(path, overwrite=True)
+
+    @classmethod
+    def load(cls, path: str) -> 'MasterState':
+        with fits.open(path) as hdul:
+            header = hdul[0].header
+            max_iters = int(header.get('SIGITER', 1))
+            return cls(
+                header['METHOD'],
+                hdul['COUNT'].data.astype(np.int32),
+                hdul['MEAN'].data.astype(np.float64),
+                hdul['M2'].data.astype(np.float64),
+                manifest=[str(name).strip() for name in hdul['MANIFEST'].data['NAME']],
+                sigma_low=float(header.get('SIGLOW', 3.0)),
+                sigma_high=float(header.get('SIGHIGH', 3.0)),
+                sigma_center=header.get('SIGCEN', 'mean'),
+                sigma_scale=header.get('SIGSCALE', 'std'),
+                sigma_max_iters=None if max_iters < 0 else max_iters,
+            )
@@ -1,10 +1,25 @@
 import numpy as np
-from astropy.io import fits
 import os
+try:
+    from .fits_io import load_image
+    from .frame_statistics import pixel_counts
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import load_image
+    from frame_statistics import pixel_counts
 
 def compute_frame_stats(fits_path):
-    with fits.open(fits_path) as hdul:
-        data = hdul[0].data.astype(np.float32)
+    data = load_image(fits_path)
+    counts = pixel_counts(data)
+    if counts is not None:
+        # 8/16-bit frames: exact values from per-value counts, no sort
+        return {
+            'path': fits_path,
+            'mean': counts.mean,
+            'median': counts.median,
+            'std': counts.std,
+            'min': counts.min,
+            'max': counts.max,
+        }
     stats = {
         'path': fits_path,
         'mean': float(np.mean(data)),
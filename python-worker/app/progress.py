@@ -0,0 +1,94 @@
+"""
+progress.py
+
+Write-behind job progress.
+- update_job_progress() only records the latest progress (and non-terminal
+  status) in memory; a flusher writes every job that changed with a single
+  UPDATE at most once per JOB_PROGRESS_FLUSH_MS
+- Terminal states (success, completed, failed, cancelled) are written
+  immediately through insert_job, which drops any buffered progress for the
+  job; buffered writes never touch a row that is already terminal
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .db import acquire
+
+# Longest a progress update waits in memory before it is written
+JOB_PROGRESS_FLUSH_MS = float(os.environ.get('JOB_PROGRESS_FLUSH_MS', 500))
+
+TERMINAL_STATUSES = ('success', 'completed', 'failed', 'cancelled')
+
+# Stages of a terminal write that is not the job's last: the row is already 'success'
+# (e.g. so the preview shows) while the rest of the result is still being written
+PARTIAL_RESULT_STAGES = ('preview_ready', 'fits_uploaded')
+
+
+async def write_progress(rows: List[Tuple[str, Optional[int], Optional[str]]]):
+    """One UPDATE for all buffered (job_id, progress, status) rows; None leaves the column as is."""
+    job_ids, progresses, statuses = (list(column) for column in zip(*rows))
+    async with acquire() as conn:
+        await conn.execute("""
+            update jobs set
+                progress = coalesce(v.progress, jobs.progress),
+                status = coalesce(v.status, jobs.status)
+            from unnest($1::text[], $2::int[], $3::text[]) as v(job_id, progress, status)
+            where jobs.job_id = v.job_id and jobs.status <> all($4::text[])
+        """, job_ids, progresses, statuses, list(TERMINAL_STATUSES))
+
+
+class ProgressReporter:
+    """Coalesces progress updates per job and flushes them in the background."""
+
+    def __init__(self, flush_ms: float = JOB_PROGRESS_FLUSH_MS,
+                 write: Callable[[List[Tuple[str, Optional[int], Optional[str]]]], Awaitable[None]] = write_progress):
+        self.flush_interval = flush_ms / 1000.0
+        self._write = write
+        self._pending: Dict[str, Tuple[Optional[int], Optional[str]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def report(self, job_id: str, progress: Optional[int] = None, status: Optional[str] = None):
+        """Buffer the job's latest progress / non-terminal status; written within flush_ms."""
+        if status in TERMINAL_STATUSES:
+            raise ValueError(f"Terminal status '{status}' must be written with insert_job")
+        previous_progress, previous_status = self._pending.get(job_id, (None, None))
+        self._pending[job_id] = (progress if progress is not None else previous_progress,
+                                 status if status is not None else previous_status)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def pending(self, job_id: str) -> Optional[Tuple[Optional[int], Optional[str]]]:
+        """Buffered (progress, status) not yet written, if any."""
+        return self._pending.get(job_id)
+
+    def discard(self, job_id: str):
+        """Drop buffered updates for a job whose terminal state is being written."""
+        self._pending.pop(job_id, None)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self._write([(job_id, progress, status) for job_id, (progress, status) in pending.items()])
+        except Exception as e:
+            print(f"[PROGRESS] Failed to write progress for {len(pending)} jobs: {e}", flush=True)
+            # Keep them for the next flush unless newer updates arrived meanwhile
+            for job_id, update in pending.items():
+                self._pending.setdefault(job_id, update)
+
+    async def close(self):
+        """Write whatever is still buffered (shutdown)."""
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+
+
+# Reporter shared by every job in this process
+progress_reporter = ProgressReporter()
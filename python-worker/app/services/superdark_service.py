@@ -8,8 +8,9 @@ from typing import Dict, Any, Optional, List
 from astropy.io import fits
 import numpy as np
 
-from supabase_io import download_file, list_files
+from supabase_io import download_file, fetch_header, list_files
 from fits_analysis import analyze_fits_headers
+from frame_catalog import FrameQuery, find_frames
 
 logger = logging.getLogger(__name__)
 
@@ -183,6 +184,15 @@ class SuperdarkService:
     async def _collect_project_darks(cls, project_id: str, user_id: str) -> List[Dict[str, Any]]:
         """Collect all dark frames from a project"""
         try:
+            # Darks validated on upload are in the frame catalog (one indexed query); the
+            # rest (never validated or backfilled) still have their headers read below
+            catalogued = {}
+            try:
+                frames = await find_frames(FrameQuery(user_id=user_id, project_ids=[project_id], frame_type='dark'))
+                catalogued = {frame.file_path: frame for frame in frames}
+            except Exception as e:
+                logger.warning(f"Frame catalog unavailable, reading dark headers instead: {e}")
+
             bucket = "fits-files"
             prefix = f"{user_id}/{project_id}/"
             
@@ -194,36 +204,70 @@ class SuperdarkService:
                 
                 # Check if it's a dark frame
                 if 'dark' in file_path.lower() and file_path.lower().endswith(('.fit', '.fits')):
-                    # Download and analyze header to get metadata
+                    frame = catalogued.pop(file_path, None) or catalogued.pop(prefix + file_path, None)
+                    if frame is not None:
+                        dark_frames.append(cls._catalogued_dark(frame, project_id, cls._listed_size(file_info)))
+                        continue
+                    # Read just the header (range request) to get metadata
                     try:
-                        with tempfile.TemporaryDirectory() as tmpdir:
-                            local_path = os.path.join(tmpdir, 'temp_dark.fits')
-                            download_file(bucket, file_path, local_path)
-                            
-                            with fits.open(local_path) as hdul:
-                                header = hdul[0].header
-                                
-                                dark_frames.append({
-                                    'path': file_path,
-                                    'name': os.path.basename(file_path),
-                                    'project': project_id,
-                                    'camera': header.get('INSTRUME', 'unknown'),
-                                    'binning': f"{header.get('XBINNING', 1)}x{header.get('YBINNING', 1)}",
-                                    'gain': header.get('GAIN', 0),
-                                    'temp': header.get('CCD-TEMP', 0),
-                                    'exposure': header.get('EXPTIME', 0),
-                                    'size': file_info.get('size', 0)
-                                })
+                        header = fetch_header(bucket, file_path)
+                        dark_frames.append({
+                            'path': file_path,
+                            'name': os.path.basename(file_path),
+                            'project': project_id,
+                            'camera': header.get('INSTRUME', 'unknown'),
+                            'binning': f"{header.get('XBINNING', 1)}x{header.get('YBINNING', 1)}",
+                            'gain': header.get('GAIN', 0),
+                            'temp': header.get('CCD-TEMP', 0),
+                            'exposure': header.get('EXPTIME', 0),
+                            'size': cls._listed_size(file_info)
+                        })
                     except Exception as e:
                         logger.warning(f"Could not analyze dark frame {file_path}: {e}")
                         continue
             
+            # Catalogued darks the listing didn't return (e.g. in a subfolder): only those under
+            # the project's prefix that are still in storage, confirmed by listing each folder once
+            folders = {}
+            for path, frame in catalogued.items():
+                if path.startswith(prefix):
+                    folders.setdefault(os.path.dirname(path), {})[os.path.basename(path)] = frame
+            for folder, folder_frames in folders.items():
+                try:
+                    listed = list_files(bucket, folder)
+                except Exception as e:
+                    logger.warning(f"Could not list {folder}, skipping its catalogued darks: {e}")
+                    continue
+                for file_info in listed:
+                    frame = folder_frames.get(file_info['name'])
+                    if frame is not None:
+                        dark_frames.append(cls._catalogued_dark(frame, project_id, cls._listed_size(file_info)))
             return dark_frames
             
         except Exception as e:
             logger.error(f"Error collecting darks from project {project_id}: {e}")
             return []
     
+    @staticmethod
+    def _listed_size(file_info: Dict[str, Any]) -> int:
+        """Size in bytes of a storage listing entry (files carry it in their metadata)"""
+        return (file_info.get('metadata') or {}).get('size', file_info.get('size', 0))
+    
+    @staticmethod
+    def _catalogued_dark(frame, project_id: str, size: int) -> Dict[str, Any]:
+        """A dark frame entry built from its catalog row instead of its header"""
+        return {
+            'path': frame.file_path,
+            'name': os.path.basename(frame.file_path),
+            'project': project_id,
+            'camera': frame.camera or 'unknown',
+            'binning': frame.binning or '1x1',
+            'gain': frame.gain or 0,
+            'temp': frame.temperature or 0,
+            'exposure': frame.exposure_time or 0,
+            'size': size
+        }
+    
     @classmethod
     def _filter_frames_by_requirements(cls, frames: List[Dict[str, Any]], 
                                      requirements: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -0,0 +1,472 @@
+"""
+stacking.py
+
+Out-of-core (tiled) stacking engine used by calibration_worker.stack_frames.
+- Every input frame is opened memory-mapped (or taken from the job's FrameStack);
+  nothing is stacked into an N x H x W array
+- The same row band is read from every frame, combined with the selected method,
+  and written into a preallocated master frame
+- Peak memory is bounded by the band size, independent of the number of frames
+- With workers > 1, bands are combined in a process pool; each worker reopens the
+  files memory-mapped and writes its bands straight into a shared-memory master,
+  so neither frames nor results are pickled
+
+Every method here is a per-pixel combine, so a band combined on its own gives
+exactly the same pixels as the whole frame would.
+"""
+
+import multiprocessing
+import numpy as np
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Union
+
+from .frame_stack import FrameStack
+
+# Working-set budget for one band (all frames), overridable per deployment
+DEFAULT_BAND_MEMORY_MB = float(os.environ.get('STACK_BAND_MEMORY_MB', 512))
+
+# Rough number of float64-sized temporaries a kernel holds per input element
+# (the band itself, sorted copies, masks, residuals...)
+_WORKING_COPIES = 4
+
+# Default process count for stack_tiled (1 = combine bands in the calling process)
+DEFAULT_STACK_WORKERS = int(os.environ.get('STACK_WORKERS', 1))
+
+# Bands queued per worker so uneven bands (e.g. heavy rejection) still balance out
+_BANDS_PER_WORKER = 4
+
+# Sigma clipping options (see sigma_clip_combine)
+SIGMA_CENTERS = ('mean', 'median')
+SIGMA_SCALES = ('std', 'mad')
+_MAD_TO_STD = 1.482602218505602
+
+# Upper bound on histogram bins per pixel for 'entropy_weighted'
+_ENTROPY_MAX_BINS = 16
+
+
+# --- Per-band combine kernels ---
+# Each kernel takes a float64 cube of shape (n_frames, rows, width) and returns (rows, width).
+# Method-specific keyword options (e.g. linear_fit iterations) are passed through by stack_tiled.
+
+def _combine_mean(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    return np.mean(cube, axis=0)
+
+def _combine_median(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    return np.median(cube, axis=0)
+
+def _kept_mean(cube: np.ndarray, keep: np.ndarray, count: np.ndarray, work: np.ndarray) -> np.ndarray:
+    np.copyto(work, 0.0)
+    np.copyto(work, cube, where=keep, casting='same_kind')
+    total = np.sum(work, axis=0, dtype=np.float64)
+    return np.divide(total, count, out=np.zeros(total.shape), where=count > 0)
+
+def _kept_median(values: np.ndarray, keep: np.ndarray, work: np.ndarray) -> np.ndarray:
+    # Rejected samples become NaN so nanmedian only sees the survivors
+    np.copyto(work, values, casting='same_kind')
+    work[~keep] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN pixels
+        return np.nanmedian(work, axis=0, overwrite_input=True).astype(np.float64)
+
+def sigma_clip_keep(cube: np.ndarray, low_thresh: float = 3.0, high_thresh: float = 3.0,
+                    center: str = 'mean', scale: str = 'std', max_iters: Optional[int] = 1,
+                    work: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Boolean mask (same shape as cube) of the samples that survive iterative
+    low/high sigma clipping along axis 0. See sigma_clip_combine for the options.
+    """
+    if center not in SIGMA_CENTERS:
+        raise ValueError(f"Unknown sigma clipping center '{center}', expected one of {SIGMA_CENTERS}")
+    if scale not in SIGMA_SCALES:
+        raise ValueError(f"Unknown sigma clipping scale '{scale}', expected one of {SIGMA_SCALES}")
+    if work is None:
+        work = np.empty(cube.shape, dtype=np.float32)
+    keep = np.ones(cube.shape, dtype=bool)
+    rejected = np.zeros(cube.shape, dtype=bool)
+    count = np.full(cube.shape[1:], cube.shape[0], dtype=np.intp)
+    iteration = 0
+    while max_iters is None or iteration < max_iters:
+        iteration += 1
+        cen = _kept_mean(cube, keep, count, work) if center == 'mean' else _kept_median(cube, keep, work)
+        if scale == 'std':
+            # Spread about the survivors' mean (np.std), as astropy's sigma_clip uses
+            mean = cen if center == 'mean' else _kept_mean(cube, keep, count, work)
+            np.subtract(cube, mean, out=work, casting='same_kind')
+            np.square(work, out=work)
+            work[~keep] = 0.0
+            var = np.sum(work, axis=0, dtype=np.float64)
+            dev = np.sqrt(np.divide(var, count, out=np.zeros(var.shape), where=count > 0))
+        else:
+            # MAD is taken about the median of the survivors, as astropy's mad_std does
+            med = cen if center == 'median' else _kept_median(cube, keep, work)
+            dev = _kept_median(np.abs(cube - med), keep, work) * _MAD_TO_STD
+        np.subtract(cube, cen, out=work, casting='same_kind')
+        np.logical_or(work < (-low_thresh * dev).astype(np.float32),
+                      work > (high_thresh * dev).astype(np.float32), out=rejected)
+        rejected &= keep
+        n_new = np.count_nonzero(rejected, axis=0)
+        if not n_new.any():
+            break
+        keep &= ~rejected
+        count -= n_new
+    return keep
+
+def sigma_clip_combine(cube: np.ndarray, low_thresh: float = 3.0, high_thresh: float = 3.0,
+                       center: str = 'mean', scale: str = 'std', max_iters: Optional[int] = 1,
+                       rejection_map: Optional[np.ndarray] = None,
+                       work: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Iterative low/high sigma-clipped mean along axis 0 of a (n_frames, rows, width) cube.
+    center: 'mean' or 'median' of the surviving samples
+    scale: 'std' or 'mad' (median absolute deviation scaled to a Gaussian std)
+    max_iters: clipping passes; stops early once a pass rejects nothing (None = until converged)
+    rejection_map: optional uint16 (rows, width) array, filled with the number of rejected frames per pixel
+    work: optional float32 scratch buffer shaped like cube, reused across calls
+    Samples outside [center - low_thresh*scale, center + high_thresh*scale] are rejected, the
+    same bounds as ccdproc's Combiner.sigma_clipping (mean/std, one pass by default).
+    """
+    if work is None:
+        work = np.empty(cube.shape, dtype=np.float32)
+    keep = sigma_clip_keep(cube, low_thresh, high_thresh, center, scale, max_iters, work=work)
+    count = np.count_nonzero(keep, axis=0)
+    result = _kept_mean(cube, keep, count, work)
+    empty = count == 0
+    if np.any(empty):
+        # Everything rejected (can only happen with aggressive thresholds): use the plain median
+        result[empty] = np.median(cube[:, empty], axis=0)
+    if rejection_map is not None:
+        rejection_map[...] = cube.shape[0] - count
+    return result
+
+def _combine_sigma(cube: np.ndarray, sigma_clip: Optional[float], low_thresh: Optional[float] = None,
+                   high_thresh: Optional[float] = None, center: str = 'mean', scale: str = 'std',
+                   max_iters: Optional[int] = 1, rejection_map: Optional[np.ndarray] = None,
+                   work: Optional[np.ndarray] = None) -> np.ndarray:
+    if sigma_clip is None:
+        sigma_clip = 3.0
+    return sigma_clip_combine(
+        cube,
+        low_thresh=sigma_clip if low_thresh is None else low_thresh,
+        high_thresh=sigma_clip if high_thresh is None else high_thresh,
+        center=center, scale=scale, max_iters=max_iters,
+        rejection_map=rejection_map, work=work,
+    )
+
+def _combine_winsorized(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    if sigma_clip is None:
+        sigma_clip = 3.0
+    med = np.median(cube, axis=0)
+    std = np.std(cube, axis=0)
+    lower = med - sigma_clip * std
+    upper = med + sigma_clip * std
+    return np.mean(np.clip(cube, lower, upper), axis=0)
+
+def _combine_minmax(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    if cube.shape[0] <= 2:
+        return np.mean(cube, axis=0)
+    cube_sorted = np.sort(cube, axis=0)
+    return np.mean(cube_sorted[1:-1, ...], axis=0)
+
+def _masked_line_fit(x: np.ndarray, cube_flat: np.ndarray, keep: np.ndarray):
+    """Per-column least-squares line through the kept samples only (closed form)."""
+    w = keep.astype(np.float64)
+    xw = x[:, None] * w
+    s = np.sum(w, axis=0)
+    sx = np.sum(xw, axis=0)
+    sxx = np.sum(xw * x[:, None], axis=0)
+    sy = np.sum(np.where(keep, cube_flat, 0.0), axis=0)
+    sxy = np.sum(np.where(keep, cube_flat, 0.0) * x[:, None], axis=0)
+    denom = s * sxx - sx * sx
+    # Fewer than two kept samples: flat line through their mean (or zero slope, zero intercept)
+    slope = np.divide(s * sxy - sx * sy, denom, out=np.zeros_like(denom), where=denom > 0)
+    intercept = np.divide(sy - slope * sx, s, out=np.zeros_like(s), where=s > 0)
+    return slope, intercept
+
+def _combine_linear_fit(cube: np.ndarray, sigma_clip: Optional[float], iterations: int = 1) -> np.ndarray:
+    """
+    Fit a line through each pixel's frame series, reject samples more than
+    sigma_clip residual std away from it, and average what is left.
+    iterations > 1 refits the line through the kept samples and re-rejects,
+    stopping early once the mask no longer changes.
+    """
+    if sigma_clip is None:
+        sigma_clip = 3.0
+    n_frames = cube.shape[0]
+    x = np.arange(n_frames, dtype=np.float64)
+    cube_flat = cube.reshape(n_frames, -1)
+    fit = np.polyfit(x, cube_flat, 1)
+    residuals = cube_flat - (np.outer(x, fit[0]) + fit[1])
+    std = np.std(residuals, axis=0)
+    mask = np.abs(residuals) < (sigma_clip * std)
+    for _ in range(max(1, int(iterations)) - 1):
+        slope, intercept = _masked_line_fit(x, cube_flat, mask)
+        residuals = cube_flat - (np.outer(x, slope) + intercept)
+        count = np.count_nonzero(mask, axis=0)
+        # Residual scatter of the samples that survived the previous pass
+        var = np.sum(np.where(mask, residuals, 0.0) ** 2, axis=0)
+        std = np.sqrt(np.divide(var, count, out=np.zeros_like(var), where=count > 0))
+        new_mask = np.abs(residuals) < (sigma_clip * std)
+        if np.array_equal(new_mask, mask):
+            break
+        mask = new_mask
+    count = np.count_nonzero(mask, axis=0)
+    total = np.sum(np.where(mask, cube_flat, 0.0), axis=0)
+    result = np.divide(total, count, out=np.zeros(count.shape, dtype=np.float64), where=count > 0)
+    empty = count == 0
+    if np.any(empty):
+        # Every sample rejected (e.g. a perfectly linear series has zero residual std)
+        result[empty] = np.mean(cube_flat[:, empty], axis=0)
+    return result.reshape(cube.shape[1:])
+
+def percentile_range(sigma_clip: Optional[float]):
+    """Map the sigma_clip argument of 'percentile_clip' onto (low, high) percentiles."""
+    if sigma_clip is None:
+        # Default: keep middle 60% (reject bottom 20% and top 20%)
+        return 20.0, 80.0
+    # e.g., sigma_clip=30 means keep middle 70% (reject bottom 15% and top 15%)
+    low_percentile = (100.0 - sigma_clip) / 2.0
+    return low_percentile, 100.0 - low_percentile
+
+def _combine_percentile_clip(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    low_percentile, high_percentile = percentile_range(sigma_clip)
+    # Same linear-interpolated percentiles as np.percentile on each pixel series
+    p_low, p_high = np.percentile(cube, [low_percentile, high_percentile], axis=0)
+    keep = (cube >= p_low) & (cube <= p_high)
+    count = np.count_nonzero(keep, axis=0)
+    # Rejected samples contribute an exact 0.0, so the masked sum matches summing the kept values
+    total = np.sum(np.where(keep, cube, 0.0), axis=0)
+    result = np.divide(total, count, out=np.zeros(count.shape, dtype=np.float64), where=count > 0)
+    empty = count == 0
+    if np.any(empty):
+        # Interpolated percentiles can fall between samples (e.g. two frames); use the median there
+        result[empty] = np.median(cube[:, empty], axis=0)
+    return result
+
+def _entropy_bin_index(values, lo, step, n_bins, hi):
+    """
+    Bin index of `values` in each pixel's equal-width histogram over [lo, hi],
+    with the same edge handling as np.histogram(pixel_series, bins=n_bins).
+    """
+    idx = ((values - lo) / (hi - lo) * n_bins).astype(np.intp)
+    idx[idx == n_bins] -= 1
+    # np.histogram re-checks each sample against the linspace edges to undo rounding
+    idx -= values < idx * step + lo
+    right = np.where(idx + 1 == n_bins, hi, (idx + 1) * step + lo)
+    idx += (values >= right) & (idx != n_bins - 1)
+    return idx
+
+def _combine_entropy_weighted(cube: np.ndarray, sigma_clip: Optional[float]) -> np.ndarray:
+    # Whole-band version of the per-pixel histogram entropy weighting: every
+    # pixel gets min(16, n_unique) equal-width bins, frames are weighted by
+    # (1 - |x - median| / max_dev) * (1 - normalized entropy), floored at 0.001.
+    n_frames = cube.shape[0]
+    ordered = np.sort(cube, axis=0)
+    lo, hi = ordered[0], ordered[-1]
+    median = 0.5 * (ordered[(n_frames - 1) // 2] + ordered[n_frames // 2])
+    n_unique = np.ones(lo.shape, dtype=np.intp)
+    for i in range(n_frames - 1):
+        n_unique += ordered[i + 1] > ordered[i]
+    del ordered
+    # Fewer bins for noisy data to avoid overestimating entropy
+    n_bins = np.minimum(_ENTROPY_MAX_BINS, n_unique)
+    binned = n_bins >= 2
+    # Pixels with a single distinct value are never binned; give them a harmless range
+    # (their bin indices are discarded below)
+    lo_b = np.where(binned, lo, 0.0)
+    hi_b = np.where(binned, hi, 1.0)
+    n_bins_b = np.where(binned, n_bins, 2)
+    step = (hi_b - lo_b) / n_bins_b
+
+    n_pixels = lo.size
+    pixel_offset = np.arange(n_pixels, dtype=np.intp).reshape(lo.shape) * _ENTROPY_MAX_BINS
+    counts = np.zeros(n_pixels * _ENTROPY_MAX_BINS, dtype=np.int32)
+    for frame in cube:
+        idx = _entropy_bin_index(frame, lo_b, step, n_bins_b, hi_b)
+        idx[~binned] = 0
+        counts += np.bincount((pixel_offset + idx).ravel(), minlength=counts.size).astype(np.int32)
+    counts = counts.reshape(lo.shape + (_ENTROPY_MAX_BINS,))
+    entropy = np.zeros(lo.shape, dtype=np.float32)
+    for b in range(_ENTROPY_MAX_BINS):
+        prob = counts[..., b].astype(np.float32) / np.float32(n_frames)
+        occupied = prob > 0
+        entropy[occupied] -= prob[occupied] * np.log2(prob[occupied])
+    del counts
+    # Lower entropy (more consistent) = higher weight
+    consistency = 1.0 - entropy / np.log2(n_bins_b).astype(np.float32)
+
+    # Frames closer to the median get more weight
+    max_dev = np.maximum(hi - median, median - lo)
+    max_dev[max_dev == 0] = 1.0
+    inv_max_dev = (1.0 / max_dev).astype(np.float32)
+    # Accumulate weighted residuals about the median so float32 keeps full ADU precision
+    weighted_residual = np.zeros(lo.shape, dtype=np.float32)
+    weight_sum = np.zeros(lo.shape, dtype=np.float32)
+    for frame in cube:
+        residual = (frame - median).astype(np.float32)
+        weight = (1.0 - np.abs(residual) * inv_max_dev) * consistency
+        weight[~binned] = 1.0
+        np.maximum(weight, np.float32(0.001), out=weight)  # Minimum weight to avoid division by zero
+        weighted_residual += weight * residual
+        weight_sum += weight
+    return median + weighted_residual / weight_sum
+
+COMBINE_KERNELS: Dict[str, Callable[..., np.ndarray]] = {
+    'mean': _combine_mean,
+    'median': _combine_median,
+    'sigma': _combine_sigma,
+    'winsorized': _combine_winsorized,
+    'minmax': _combine_minmax,
+    'linear_fit': _combine_linear_fit,
+    'percentile_clip': _combine_percentile_clip,
+    'entropy_weighted': _combine_entropy_weighted,
+}
+
+TILED_METHODS = tuple(COMBINE_KERNELS)
+
+# Kernels that work in float32: the engine reads their bands as float32 and
+# hands them a float32 scratch buffer allocated once for all bands
+FLOAT32_KERNELS = ('sigma',)
+
+
+# --- Band engine ---
+def auto_band_height(n_frames: int, height: int, width: int, memory_mb: Optional[float] = None) -> int:
+    """Pick the tallest row band whose working set fits in `memory_mb`."""
+    budget = (memory_mb if memory_mb is not None else DEFAULT_BAND_MEMORY_MB) * 1024 * 1024
+    bytes_per_row = max(1, n_frames) * width * np.dtype(np.float64).itemsize * _WORKING_COPIES
+    return int(max(1, min(height, budget // bytes_per_row)))
+
+def band_memory_mb(n_frames: int, band_height: int, width: int) -> float:
+    """Working set of one band of `band_height` rows (the inverse of auto_band_height)."""
+    bytes_per_row = max(1, n_frames) * width * np.dtype(np.float64).itemsize * _WORKING_COPIES
+    return band_height * bytes_per_row / (1024 * 1024)
+
+def stack_tiled(file_list: Union[List[str], FrameStack], method: str = 'median', sigma_clip: Optional[float] = None,
+                band_height: Optional[int] = None, memory_mb: Optional[float] = None,
+                workers: Optional[int] = None, **kernel_options) -> np.ndarray:
+    """
+    Combine FITS files band by band into a preallocated float64 master.
+    file_list: paths, or a FrameStack already opened for the job (left open afterwards)
+    band_height: rows per band; picked from `memory_mb` (or STACK_BAND_MEMORY_MB) when None
+    workers: processes to combine bands in parallel (default STACK_WORKERS); 1 runs in-process
+    kernel_options: extra keyword arguments for the method's kernel (e.g. iterations for linear_fit);
+        a full-frame `rejection_map` (uint16, H x W) for 'sigma' is filled band by band
+    """
+    if method not in COMBINE_KERNELS:
+        raise ValueError(f"Method '{method}' is not supported by the tiled stacking engine")
+    if not isinstance(file_list, FrameStack) and not file_list:
+        raise ValueError("No frames to stack")
+    kernel = COMBINE_KERNELS[method]
+    if workers is None:
+        workers = DEFAULT_STACK_WORKERS
+    workers = max(1, int(workers))
+    t0 = time.time()
+    stack, owned = FrameStack.wrap(file_list, in_memory=False)
+    try:
+        n_frames = len(stack)
+        height, width = stack.shape
+        if band_height is None:
+            # Every worker holds its own band, so they share the memory budget
+            budget = (memory_mb if memory_mb is not None else DEFAULT_BAND_MEMORY_MB) / workers
+            band_height = auto_band_height(n_frames, height, width, budget)
+            if workers > 1:
+                band_height = min(band_height, -(-height // (workers * _BANDS_PER_WORKER)))
+        band_height = int(max(1, min(band_height, height)))
+        n_bands = -(-height // band_height)
+        workers = min(workers, n_bands)
+        print(f"[tiled] {method}: {n_frames} frames of {height}x{width}, {n_bands} band(s) of {band_height} rows"
+              f"{f', {workers} workers' if workers > 1 else ''}", flush=True)
+        if method == 'minmax' and n_frames <= 2:
+            print("[WARN] Not enough frames for minmax rejection, falling back to mean.")
+        rejection_map = kernel_options.pop('rejection_map', None)
+        if rejection_map is not None and rejection_map.shape != (height, width):
+            raise ValueError(f"rejection_map shape {rejection_map.shape} does not match frames {(height, width)}")
+        if workers > 1:
+            master = _stack_bands_parallel(stack.paths, method, sigma_clip, (height, width), band_height,
+                                           workers, kernel_options, rejection_map)
+        else:
+            band_dtype = np.float32 if method in FLOAT32_KERNELS else np.float64
+            master = np.empty((height, width), dtype=np.float64)
+            scratch = np.empty((n_frames, band_height, width), dtype=band_dtype) if method in FLOAT32_KERNELS else None
+            for y0, y1, band in stack.iter_bands(band_height, dtype=band_dtype):
+                if scratch is not None:
+                    kernel_options['work'] = scratch[:, :y1 - y0]
+                if rejection_map is not None:
+                    kernel_options['rejection_map'] = rejection_map[y0:y1]
+                master[y0:y1] = kernel(band, sigma_clip, **kernel_options)
+    finally:
+        if owned:
+            stack.close()
+    print(f"[tiled] {method} complete in {time.time() - t0:.2f}s", flush=True)
+    return master
+
+
+# --- Process-parallel bands ---
+# Per-process state set up once by _init_band_worker: the reopened frames and views
+# onto the shared output buffers.
+_band_worker = {}
+
+def _attach_shared(name: str) -> shared_memory.SharedMemory:
+    try:
+        # The parent owns (and unlinks) the block; workers must not register it again
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument
+        return shared_memory.SharedMemory(name=name)
+
+def _init_band_worker(paths, method, sigma_clip, kernel_options, shape, master_name, rejection_name):
+    master_shm = _attach_shared(master_name)
+    _band_worker.update(
+        stack=FrameStack(paths, in_memory=False),
+        kernel=COMBINE_KERNELS[method],
+        float32=method in FLOAT32_KERNELS,
+        sigma_clip=sigma_clip,
+        kernel_options=kernel_options,
+        shm=[master_shm],
+        master=np.ndarray(shape, dtype=np.float64, buffer=master_shm.buf),
+        rejection=None,
+    )
+    if rejection_name is not None:
+        rejection_shm = _attach_shared(rejection_name)
+        _band_worker['shm'].append(rejection_shm)
+        _band_worker['rejection'] = np.ndarray(shape, dtype=np.uint16, buffer=rejection_shm.buf)
+
+def _combine_band(y0: int, y1: int) -> int:
+    state = _band_worker
+    band = state['stack'].read_band(y0, y1, dtype=np.float32 if state['float32'] else np.float64)
+    options = dict(state['kernel_options'])
+    if state['float32']:
+        options['work'] = np.empty_like(band)
+    if state['rejection'] is not None:
+        options['rejection_map'] = state['rejection'][y0:y1]
+    state['master'][y0:y1] = state['kernel'](band, state['sigma_clip'], **options)
+    return y1 - y0
+
+def _stack_bands_parallel(paths, method, sigma_clip, shape, band_height, workers, kernel_options, rejection_map):
+    height, width = shape
+    master_shm = shared_memory.SharedMemory(create=True, size=height * width * np.dtype(np.float64).itemsize)
+    rejection_shm = None
+    if rejection_map is not None:
+        rejection_shm = shared_memory.SharedMemory(create=True, size=max(1, rejection_map.nbytes))
+    try:
+        # spawn, not fork: the API process runs an event loop and thread pools that fork would copy mid-flight
+        ctx = multiprocessing.get_context('spawn')
+        init_args = (list(paths), method, sigma_clip, kernel_options, shape, master_shm.name,
+                     rejection_shm.name if rejection_shm is not None else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_band_worker, initargs=init_args) as pool:
+            futures = [pool.submit(_combine_band, y0, min(y0 + band_height, height))
+                       for y0 in range(0, height, band_height)]
+            for future in futures:
+                future.result()
+        master = np.ndarray(shape, dtype=np.float64, buffer=master_shm.buf).copy()
+        if rejection_map is not None:
+            rejection_map[...] = np.ndarray(shape, dtype=np.uint16, buffer=rejection_shm.buf)
+        return master
+    finally:
+        for shm in (master_shm, rejection_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,167 @@
+"""
+storage_client.py
+
+Async Supabase storage client for job code.
+- One httpx.AsyncClient (keep-alive pool, HTTP/2) per process, bound to the
+  loop it is first used on; other loops (e.g. helper threads running their
+  own loop) get a one-off client, as db.acquire() does for connections
+- Downloads stream the response body to disk in STORAGE_CHUNK_KB chunks, so
+  peak memory does not grow with the file size
+- Every transfer holds a slot of a global STORAGE_CONCURRENCY semaphore, so
+  jobs can asyncio.gather() all their downloads without flooding storage
+- FITS downloads go through the local fits_cache, like supabase_io.download_file;
+  the transfer is awaited between short threaded cache steps, never inside one
+- fetch_header() reads only a file's primary header, with range requests
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from astropy.io import fits
+
+from .fits_cache import get_fits_cache
+from .fits_io import FITS_BLOCK, HeaderReader
+
+# Transfers in flight per process (all jobs together)
+STORAGE_CONCURRENCY = int(os.environ.get('STORAGE_CONCURRENCY', 8))
+
+# Keep-alive connections kept open to storage
+STORAGE_MAX_CONNECTIONS = int(os.environ.get('STORAGE_MAX_CONNECTIONS', 16))
+
+STORAGE_CHUNK_KB = int(os.environ.get('STORAGE_CHUNK_KB', 1024))
+
+STORAGE_HTTP2 = os.environ.get('STORAGE_HTTP2', '1') == '1'
+
+# How often a download waiting for another's fill of the same cached object retries its lock
+CACHE_LOCK_POLL_S = 0.05
+
+
+class AsyncStorageClient:
+    """Streaming downloads from Supabase storage over a shared connection pool."""
+
+    def __init__(self, base_url: Optional[str] = None, key: Optional[str] = None,
+                 concurrency: int = STORAGE_CONCURRENCY, max_connections: int = STORAGE_MAX_CONNECTIONS,
+                 chunk_kb: int = STORAGE_CHUNK_KB, http2: bool = STORAGE_HTTP2, transport=None):
+        # Defaults are read when the first client is built, after supabase_io has loaded .env.local
+        self._base_url = base_url
+        self._key = key
+        self.concurrency = concurrency
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.chunk_size = chunk_kb * 1024
+        self.http2 = http2
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _new_client(self) -> httpx.AsyncClient:
+        base_url = self._base_url or os.environ.get('SUPABASE_URL', '')
+        key = self._key or os.environ.get('SUPABASE_SERVICE_KEY', '')
+        return httpx.AsyncClient(base_url=f"{base_url}/storage/v1",
+                                 headers={'Authorization': f'Bearer {key}', 'apikey': key}, limits=self.limits,
+                                 http2=self.http2, timeout=httpx.Timeout(120.0, connect=10.0),
+                                 transport=self._transport)
+
+    @asynccontextmanager
+    async def _session(self):
+        """Yield (client, semaphore) for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is None or self._loop.is_closed():
+            self._client = self._new_client()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        if loop is self._loop:
+            yield self._client, self._semaphore
+            return
+        client = self._new_client()
+        try:
+            yield client, asyncio.Semaphore(self.concurrency)
+        finally:
+            await client.aclose()
+
+    async def head(self, bucket: str, path: str) -> Optional[httpx.Headers]:
+        """Response headers (etag, content-length, ...) of a stored object, or None if it can't be read."""
+        async with self._session() as (client, _):
+            try:
+                res = await client.head(f"/object/{bucket}/{path}")
+            except httpx.HTTPError as e:
+                print(f"[STORAGE] HEAD failed for {bucket}/{path}: {e}", flush=True)
+                return None
+        return res.headers if res.status_code == 200 else None
+
+    async def etag(self, bucket: str, path: str) -> Optional[str]:
+        headers = await self.head(bucket, path)
+        return headers.get('etag') if headers is not None else None
+
+    async def fetch_header(self, bucket: str, path: str) -> fits.Header:
+        """Primary header of a stored FITS file, read a few 2880-byte blocks at a time."""
+        reader = HeaderReader()
+        async with self._session() as (client, semaphore):
+            async with semaphore:
+                while True:
+                    async with client.stream('GET', f"/object/{bucket}/{path}",
+                                             headers={'Range': reader.next_range()}) as res:
+                        if res.status_code == 416:
+                            raise ValueError(f"No END card in {bucket}/{path}")
+                        res.raise_for_status()
+                        # A 200 means the range was ignored; stop reading the body at END
+                        async for chunk in res.aiter_bytes(FITS_BLOCK):
+                            if reader.feed(chunk):
+                                return reader.header()
+                        if res.status_code != 206:
+                            raise ValueError(f"No END card in {bucket}/{path}")
+
+    async def _stream_to(self, bucket: str, path: str, local_path: str):
+        async with self._session() as (client, semaphore):
+            async with semaphore:
+                async with client.stream('GET', f"/object/{bucket}/{path}") as res:
+                    res.raise_for_status()
+                    with open(local_path, 'wb') as f:
+                        async for chunk in res.aiter_bytes(self.chunk_size):
+                            f.write(chunk)
+
+    async def download(self, bucket: str, path: str, local_path: str):
+        """Stream an object to local_path; raises httpx.HTTPStatusError if it is missing."""
+        cache = get_fits_cache()
+        etag = await self.etag(bucket, path) if cache is not None and cache.cacheable(path) else None
+        if etag is None:
+            await self._stream_to(bucket, path, local_path)
+            return
+        # FitsCache.fetch() with the transfer awaited on this loop: only the short
+        # file steps run in threads, so concurrency is bounded by the semaphore alone
+        if await asyncio.to_thread(cache.lookup, bucket, path, local_path, etag):
+            print(f"[CACHE] Hit {bucket}/{path}", flush=True)
+            return
+        lock = await asyncio.to_thread(cache.try_lock, bucket, path)
+        while lock is None:
+            # Another download (this process or another) is filling the same object
+            await asyncio.sleep(CACHE_LOCK_POLL_S)
+            lock = await asyncio.to_thread(cache.try_lock, bucket, path)
+        try:
+            if await asyncio.to_thread(cache.lookup, bucket, path, local_path, etag):
+                print(f"[CACHE] Hit {bucket}/{path}", flush=True)
+                return
+            tmp = cache.tmp_path()
+            try:
+                await self._stream_to(bucket, path, tmp)
+                content_hash = await asyncio.to_thread(cache.store, bucket, path, etag, tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        finally:
+            cache.unlock(lock)
+        await asyncio.to_thread(cache.deliver, bucket, path, content_hash, local_path)
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._semaphore = None
+        self._loop = None
+
+
+# Client shared by every job in this process
+storage_client = AsyncStorageClient()
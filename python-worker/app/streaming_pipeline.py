@@ -0,0 +1,234 @@
+"""
+streaming_pipeline.py
+
+Pipelined front end for calibration jobs: download -> match -> validate ->
+bias-subtract -> accumulate, one frame at a time.
+- Downloads run concurrently (at most max_downloads at a time): an async
+  download function runs on the loop, a blocking one in a thread pool
+- Each frame is processed as soon as its own download finishes, on the shared
+  compute executor, so network and CPU time overlap instead of adding up
+- 'mean' and 'sigma' stacks are accumulated on arrival into a MasterState;
+  one fold runs at a time and takes every frame accepted meanwhile, so a slow
+  fold batches frames instead of queueing them one by one. For other methods
+  the validated, bias-corrected files are stacked afterwards as usual
+- Frames already in a saved master state are not downloaded at all
+
+The per-frame rules (temp/exptime matching, header validation, bias
+subtraction) are the same as the batch path in run_calibration_job.
+"""
+
+import asyncio
+import inspect
+import numpy as np
+import os
+from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .compute_executor import run_cpu
+from .fits_analysis import analyze_fits_headers
+from .master_state import MasterState
+
+# Sigma-clipped streams fold this many frames as one batch before clipping new
+# frames against the running statistics
+DEFAULT_WARMUP_FRAMES = 5
+
+
+def validate_header(header: fits.Header) -> Tuple[bool, List[str]]:
+    """Header checks a frame must pass to be stacked; returns (is_valid, warnings)."""
+    analysis = analyze_fits_headers(header)
+    is_valid = analysis.confidence >= 0.7 and not any('Missing' in w or 'must' in w for w in analysis.warnings)
+    return is_valid, analysis.warnings
+
+
+def matches_reference(header: fits.Header, reference: Optional[fits.Header],
+                      temp_matching: bool, exposure_matching: bool) -> bool:
+    """Temperature (±1°C) / exposure (±0.1s) match against the reference light header."""
+    if reference is None:
+        return True
+    ref_temp = reference.get('CCD-TEMP')
+    ref_exptime = reference.get('EXPTIME')
+    if temp_matching and ref_temp is not None and header.get('CCD-TEMP') is not None:
+        if abs(header.get('CCD-TEMP') - ref_temp) > 1.0:
+            return False
+    if exposure_matching and ref_exptime is not None and header.get('EXPTIME') is not None:
+        if abs(header.get('EXPTIME') - ref_exptime) > 0.1:
+            return False
+    return True
+
+
+def prepare_frame(local_path: str, out_path: str, bias_path: Optional[str], reference_header: Optional[fits.Header],
+                  temp_matching: bool, exposure_matching: bool) -> Tuple[str, str, List[str]]:
+    """
+    Match, validate and bias-subtract one downloaded frame (a compute stage).
+    bias_path: .npy master bias to subtract; the corrected frame is written to out_path
+    Returns (status, path of the frame to stack, header warnings); status is 'valid', 'unmatched' or 'rejected'.
+    """
+    with fits.open(local_path) as hdul:
+        header = hdul[0].header
+        matched = matches_reference(header, reference_header, temp_matching, exposure_matching)
+        is_valid, warnings = validate_header(header)
+        if not is_valid:
+            return 'rejected', local_path, warnings
+        path = local_path
+        if bias_path is not None:
+            bias_data = np.load(bias_path, mmap_mode='r')
+            data = hdul[0].data.astype(np.float32)
+            if data.shape != bias_data.shape:
+                raise ValueError(f"Master bias and dark frame shape mismatch: dark {data.shape} vs bias {bias_data.shape}")
+            path = out_path
+            fits.PrimaryHDU(data - bias_data, header=header).writeto(path, overwrite=True)
+    return ('valid' if matched else 'unmatched'), path, warnings
+
+
+def fold_frames(state: MasterState, paths: List[str], names: List[str], band_height: Optional[int]) -> MasterState:
+    """Fold frames into a master state and return it (a compute stage)."""
+    state.fold(paths, names, band_height=band_height)
+    return state
+
+
+@dataclass
+class StreamedFrames:
+    """What the streaming front end hands to the stacking stage."""
+    valid_files: List[str] = field(default_factory=list)
+    rejected_files: list = field(default_factory=list)
+    source_paths: Dict[str, str] = field(default_factory=dict)
+    state: Optional[MasterState] = None
+    skipped: List[str] = field(default_factory=list)
+
+
+class StreamingPipeline:
+    """
+    Processes frames in arrival order and keeps the running accumulator.
+    state: MasterState to fold accepted frames into (None = only preprocess)
+    bias_data: master bias subtracted from every accepted frame
+    reference_header: first light's header, for temp/exposure matching
+    """
+
+    def __init__(self, tmpdir: str, state: Optional[MasterState] = None, bias_data: Optional[np.ndarray] = None,
+                 reference_header: Optional[fits.Header] = None, temp_matching: bool = False,
+                 exposure_matching: bool = False, warmup_frames: int = DEFAULT_WARMUP_FRAMES,
+                 band_height: Optional[int] = None):
+        self.tmpdir = tmpdir
+        self.state = state
+        self.bias_data = bias_data
+        self.reference_header = reference_header if (temp_matching or exposure_matching) else None
+        self.temp_matching = temp_matching
+        self.exposure_matching = exposure_matching
+        self.band_height = band_height
+        # A fresh sigma state needs a batch to clip against; a loaded one already has statistics
+        self.warmup_frames = warmup_frames if state is not None and state.method == 'sigma' and state.n_frames == 0 else 1
+        self.result = StreamedFrames(state=state)
+        self._pending: List[str] = []
+        self._unmatched: List[str] = []
+        self._n_processed = 0
+        self._bias_path: Optional[str] = None
+
+    def _record(self, status: str, path: str, source_path: str, warnings: List[str]):
+        if status == 'rejected':
+            self.result.rejected_files.append((path, warnings))
+            return
+        self.result.source_paths[path] = source_path
+        if status == 'unmatched':
+            # Only used if no frame matches at all (same fallback as the batch path)
+            self._unmatched.append(path)
+            return
+        self._accept(path)
+
+    def _accept(self, path: str):
+        self.result.valid_files.append(path)
+        if self.state is not None:
+            self._pending.append(path)
+
+    def _fold_pending(self) -> 'asyncio.Future[MasterState]':
+        """Start folding every pending frame on the compute executor."""
+        paths, self._pending = self._pending, []
+        self.warmup_frames = 1
+        return asyncio.ensure_future(run_cpu(fold_frames, self.state, paths,
+                                             [self.result.source_paths[p] for p in paths], self.band_height))
+
+    def _folded(self, folding: 'asyncio.Future[MasterState]'):
+        # In a worker process the state is folded in a copy, so take the returned one
+        self.state = self.result.state = folding.result()
+
+    async def finish(self) -> StreamedFrames:
+        if not self.result.valid_files and self._unmatched:
+            print(f"[WARN] No darks matched temp/exptime criteria; using all {len(self._unmatched)} darks.")
+            for path in self._unmatched:
+                self._accept(path)
+        elif self._unmatched:
+            print(f"[MATCH] Using {len(self.result.valid_files)} darks after temp/exptime matching "
+                  f"(of {len(self.result.valid_files) + len(self._unmatched)})")
+        if self._pending:
+            folding = self._fold_pending()
+            await folding
+            self._folded(folding)
+        return self.result
+
+    async def run(self, items: Sequence[Tuple[str, str]], download: Callable[[str, str], Optional[Awaitable[None]]],
+                  is_cancelled: Optional[Callable[[], Awaitable[bool]]] = None,
+                  max_downloads: int = 8) -> Optional[StreamedFrames]:
+        """
+        items: (source_path, local_path) pairs; download(source_path, local_path) fetches one file
+        (a coroutine function, or a blocking function that is run in a thread).
+        Frames already in the state's manifest are skipped before download.
+        Returns None if is_cancelled() reports the job was cancelled.
+        """
+        if self.state is not None:
+            fresh = set(self.state.new_frames([src for src, _ in items]))
+            self.result.skipped = [src for i, (src, _) in enumerate(items) if i not in fresh]
+            items = [item for i, item in enumerate(items) if i in fresh]
+        if self.bias_data is not None:
+            # Handed to the compute stages by path rather than pickled with every frame
+            self._bias_path = os.path.join(self.tmpdir, 'stream_bias.npy')
+            np.save(self._bias_path, self.bias_data)
+        loop = asyncio.get_running_loop()
+        is_async = inspect.iscoroutinefunction(download)
+        slots = asyncio.Semaphore(max_downloads)
+
+        async def fetch(item, io_pool):
+            source_path, local_path = item
+            try:
+                async with slots:
+                    if is_async:
+                        await download(source_path, local_path)
+                    else:
+                        await loop.run_in_executor(io_pool, download, source_path, local_path)
+                return item
+            except Exception as e:
+                print(f"[ERROR] Failed to download {source_path}: {e}")
+                return None
+
+        folding = None
+        with ThreadPoolExecutor(max_workers=max_downloads) as io_pool:
+            pending = [asyncio.ensure_future(fetch(item, io_pool)) for item in items]
+            try:
+                for next_done in asyncio.as_completed(pending):
+                    item = await next_done
+                    if is_cancelled is not None and await is_cancelled():
+                        return None
+                    if item is None:
+                        continue
+                    out_path = os.path.join(self.tmpdir, f"bias_corrected_{self._n_processed}.fits")
+                    self._n_processed += 1
+                    status, path, warnings = await run_cpu(prepare_frame, item[1], out_path, self._bias_path,
+                                                           self.reference_header, self.temp_matching,
+                                                           self.exposure_matching)
+                    self._record(status, path, item[0], warnings)
+                    print(f"[STREAM] {item[0]}: {status}", flush=True)
+                    if folding is not None and folding.done():
+                        self._folded(folding)
+                        folding = None
+                    if folding is None and self.state is not None and len(self._pending) >= self.warmup_frames:
+                        folding = self._fold_pending()
+                if folding is not None:
+                    await folding
+                    self._folded(folding)
+                    folding = None
+            finally:
+                for future in pending:
+                    future.cancel()
+                if folding is not None:
+                    folding.cancel()
+        return await self.finish()
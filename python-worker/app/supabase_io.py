@@ -9,15 +9,75 @@ load_dotenv(dotenv_path=env_path)
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
 from supabase import create_client, Client
+from astropy.io import fits
+try:
+    from .fits_cache import get_fits_cache
+    from .fits_io import FITS_BLOCK, HeaderReader
+except ImportError:  # imported as a top-level module by app/services
+    from fits_cache import get_fits_cache
+    from fits_io import FITS_BLOCK, HeaderReader
 
 # Create an httpx client with a longer timeout for large file uploads
 httpx_client = httpx.Client(timeout=120.0)  # 2 minutes
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+storage_headers = {"Authorization": f"Bearer {SUPABASE_KEY}", "apikey": SUPABASE_KEY}
+
+def _download_uncached(bucket: str, path: str, local_path: str):
+    # Stream to disk rather than holding the whole object in memory
+    with httpx_client.stream(
+        "GET",
+        f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}",
+        headers=storage_headers,
+    ) as res:
+        res.raise_for_status()
+        with open(local_path, "wb") as f:
+            for chunk in res.iter_bytes(1 << 20):
+                f.write(chunk)
+
+def object_etag(bucket: str, path: str):
+    """ETag of a stored object from a HEAD request, or None if it can't be read."""
+    try:
+        res = httpx_client.head(
+            f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}",
+            headers=storage_headers,
+        )
+        if res.status_code == 200:
+            return res.headers.get("etag")
+    except httpx.HTTPError as e:
+        print(f"[CACHE] HEAD failed for {bucket}/{path}: {e}")
+    return None
 
 def download_file(bucket: str, path: str, local_path: str):
-    res = supabase.storage.from_(bucket).download(path)
-    with open(local_path, "wb") as f:
-        f.write(res)
+    """Download an object to local_path; FITS frames go through the local cache."""
+    cache = get_fits_cache()
+    etag = object_etag(bucket, path) if cache is not None and cache.cacheable(path) else None
+    if etag is None:
+        # Without an ETag we can't tell whether a cached copy is stale
+        _download_uncached(bucket, path, local_path)
+        return
+    hit = cache.fetch(bucket, path, local_path, etag,
+                      lambda tmp_path: _download_uncached(bucket, path, tmp_path))
+    if hit:
+        print(f"[CACHE] Hit {bucket}/{path}")
+
+def fetch_header(bucket: str, path: str) -> fits.Header:
+    """Primary header of a stored FITS file, read a few 2880-byte blocks at a time with range requests."""
+    reader = HeaderReader()
+    while True:
+        with httpx_client.stream(
+            "GET",
+            f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}",
+            headers={**storage_headers, "Range": reader.next_range()},
+        ) as res:
+            if res.status_code == 416:
+                raise ValueError(f"No END card in {bucket}/{path}")
+            res.raise_for_status()
+            # A 200 means the range was ignored; stop reading the body at END
+            for chunk in res.iter_bytes(FITS_BLOCK):
+                if reader.feed(chunk):
+                    return reader.header()
+            if res.status_code != 206:
+                raise ValueError(f"No END card in {bucket}/{path}")
 
 def upload_file(bucket: str, path: str, local_path: str, public: bool = False):
     with open(local_path, "rb") as f:
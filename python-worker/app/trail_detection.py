@@ -7,6 +7,10 @@ from skimage.transform import probabilistic_hough_line
 from skimage import img_as_ubyte
 import matplotlib.pyplot as plt
 import os
+try:
+    from .fits_io import load_image
+except ImportError:  # imported as a top-level module by app/services
+    from fits_io import load_image
 
 
 def detect_trails(
@@ -43,10 +47,10 @@ def detect_trails(
     """
     os.makedirs(output_dir, exist_ok=True)
     # 1. Read FITS
-    with fits.open(fits_path) as hdul:
-        data = hdul[0].data.astype(np.float32)
-    # 2. Normalize and median filter
-    norm = (data - np.percentile(data, 5)) / (np.percentile(data, 99) - np.percentile(data, 5))
+    data = load_image(fits_path)
+    # 2. Normalize and median filter (float32 from here on)
+    p5, p99 = np.percentile(data, [5, 99])
+    norm = np.subtract(data, p5, dtype=np.float32) / np.float32(p99 - p5)
     norm = np.clip(norm, 0, 1)
     med = median(norm, disk(3))
     # 3. Subtract background
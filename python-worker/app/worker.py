@@ -0,0 +1,47 @@
+"""
+worker.py
+
+Job worker entry point: python -m app.worker
+- Claims queued jobs from the `jobs` table and runs them (see job_queue.py);
+  start one per node, as many nodes as the load needs
+- Per-type limits come from JOB_CONCURRENCY, CPU stages run in the node's
+  compute process pool (JOB_PROCESSES)
+- SIGTERM/SIGINT stop claiming and wait for the running jobs to finish
+"""
+
+import asyncio
+import signal
+
+from .compute_executor import compute_executor
+from .db import close_pool, init_db, init_pool
+from .job_queue import JobWorker
+from .job_events import job_event_bus
+from .progress import progress_reporter
+from .storage_client import storage_client
+from . import main  # noqa: F401  registers the job types
+
+
+async def run_worker():
+    try:
+        await init_pool()
+        await init_db()
+    except Exception as e:
+        print(f"[QUEUE] Database initialization failed: {e}", flush=True)
+    # Progress / status events reach the API nodes' /jobs/{job_id}/events streams over NOTIFY
+    job_event_bus.start()
+    worker = JobWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        compute_executor.shutdown(wait=False)
+        await progress_reporter.close()
+        await job_event_bus.close()
+        await storage_client.aclose()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
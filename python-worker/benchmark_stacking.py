@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the vectorized stacking kernels in app/stacking.py.
+
+Each vectorized kernel is timed against the per-pixel Python loop it replaced,
+and the two outputs are compared so a kernel can be switched on without
+re-validating existing masters.
+
+Usage:
+    python3 benchmark_stacking.py                      # all kernels, default sizes
+    python3 benchmark_stacking.py --frames 20 --size 256
+    python3 benchmark_stacking.py --method percentile_clip
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from app.stacking import COMBINE_KERNELS, percentile_range
+
+
+# --- Reference (pre-vectorization) implementations ---
+def legacy_percentile_clip(cube, sigma_clip=None):
+    low_percentile, high_percentile = percentile_range(sigma_clip)
+    n_frames, height, width = cube.shape
+    result = np.zeros((height, width), dtype=np.float64)
+    for y in range(height):
+        for x in range(width):
+            pixel_values = cube[:, y, x]
+            p_low = np.percentile(pixel_values, low_percentile)
+            p_high = np.percentile(pixel_values, high_percentile)
+            valid_values = pixel_values[(pixel_values >= p_low) & (pixel_values <= p_high)]
+            if len(valid_values) > 0:
+                result[y, x] = np.mean(valid_values)
+            else:
+                result[y, x] = np.median(pixel_values)
+    return result
+
+def legacy_entropy_weighted(cube, sigma_clip=None):
+    n_frames, height, width = cube.shape
+    weights = np.zeros((n_frames, height, width), dtype=np.float64)
+    for y in range(height):
+        for x in range(width):
+            pixel_series = cube[:, y, x]
+            bins = min(16, len(np.unique(pixel_series)))
+            if bins < 2:
+                weights[:, y, x] = 1.0
+                continue
+            hist, _ = np.histogram(pixel_series, bins=bins)
+            hist = hist.astype(np.float64)
+            hist = hist / hist.sum()
+            hist = hist[hist > 0]
+            entropy = -np.sum(hist * np.log2(hist))
+            max_entropy = np.log2(bins)
+            normalized_entropy = entropy / max_entropy if max_entropy > 0 else 0
+            consistency_score = 1.0 - normalized_entropy
+            median_val = np.median(pixel_series)
+            deviations = np.abs(pixel_series - median_val)
+            max_dev = np.max(deviations) if np.max(deviations) > 0 else 1.0
+            frame_weights = 1.0 - (deviations / max_dev)
+            weights[:, y, x] = frame_weights * consistency_score
+    weights = np.maximum(weights, 0.001)
+    weight_sums = np.sum(weights, axis=0)
+    weight_sums[weight_sums == 0] = 1.0
+    return np.sum(cube * weights, axis=0) / weight_sums
+
+def legacy_linear_fit(cube, sigma_clip=None):
+    if sigma_clip is None:
+        sigma_clip = 3.0
+    n_frames = cube.shape[0]
+    x = np.arange(n_frames)
+    cube_flat = cube.reshape(n_frames, -1)
+    fit = np.polyfit(x, cube_flat, 1)
+    fit_vals = np.outer(x, fit[0]) + fit[1]
+    residuals = cube_flat - fit_vals
+    std = np.std(residuals, axis=0)
+    mask = np.abs(residuals) < (sigma_clip * std)
+    result = np.zeros(cube_flat.shape[1])
+    for i in range(cube_flat.shape[1]):
+        valid = cube_flat[mask[:, i], i]
+        if valid.size > 0:
+            result[i] = np.mean(valid)
+        else:
+            result[i] = np.mean(cube_flat[:, i])
+    return result.reshape(cube.shape[1:])
+
+# Largest acceptable |vectorized - loop| in ADU; float32-accumulating kernels get a looser bound
+TOLERANCE = {
+    'entropy_weighted': 1e-3,
+}
+DEFAULT_TOLERANCE = 1e-9
+
+LEGACY_KERNELS = {
+    'percentile_clip': legacy_percentile_clip,
+    'linear_fit': legacy_linear_fit,
+    'entropy_weighted': legacy_entropy_weighted,
+}
+
+
+def make_cube(n_frames, size, seed=42):
+    """Synthetic uint16-like bias stack with hot pixels and cosmic-ray hits."""
+    rng = np.random.default_rng(seed)
+    cube = np.round(rng.normal(1000, 10, (n_frames, size, size)))
+    hits = rng.random(cube.shape) < 0.001
+    cube[hits] = rng.integers(20000, 65535, np.count_nonzero(hits))
+    return cube
+
+
+def run_benchmark(method, n_frames, size, sigma_clip=None):
+    cube = make_cube(n_frames, size)
+    legacy = LEGACY_KERNELS[method]
+    vectorized = COMBINE_KERNELS[method]
+
+    t0 = time.perf_counter()
+    expected = legacy(cube, sigma_clip)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    actual = vectorized(cube, sigma_clip)
+    t_vec = time.perf_counter() - t0
+
+    max_abs = float(np.max(np.abs(actual - expected)))
+    identical = float(np.mean(actual == expected)) * 100
+    print(f"{method:>18} | {n_frames:3d} x {size}x{size} | loop {t_legacy:8.3f}s | vectorized {t_vec:7.4f}s | "
+          f"speedup {t_legacy / max(t_vec, 1e-9):8.1f}x | max |diff| {max_abs:.3e} | identical {identical:6.2f}%")
+    return max_abs / TOLERANCE.get(method, DEFAULT_TOLERANCE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized stacking kernels against the legacy loops.")
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--size', type=int, default=128)
+    parser.add_argument('--method', choices=sorted(LEGACY_KERNELS), default=None)
+    parser.add_argument('--sigma', type=float, default=None)
+    args = parser.parse_args()
+
+    methods = [args.method] if args.method else sorted(LEGACY_KERNELS)
+    print("STACKING KERNEL BENCHMARK")
+    print("=" * 60)
+    worst = 0.0
+    for method in methods:
+        worst = max(worst, run_benchmark(method, args.frames, args.size, args.sigma))
+    # Integer-valued (raw ADU) stacks match bit for bit for the float64 kernels; non-integer data
+    # agrees to float64 rounding because masked sums are ordered differently than np.mean's
+    sys.exit(0 if worst < 1.0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+
+
+@pytest.fixture
+def write_frames(tmp_path, request):
+    """
+    Factory that writes synthetic FITS frames into tmp_path and returns their paths.
+    level: mean of every frame, or one level per frame (sets n_frames); step is added per frame index
+    noise: Gaussian sigma around the level (0 = constant frames)
+    hits: {frame index: (region, value)} patches, e.g. {0: (np.s_[5:8, 5:8], 60000)};
+        negative indices count from the end
+    start: index of the first frame (names and seed), to write more frames next to earlier ones
+    A test module can set FRAME_DEFAULTS = dict(...) to change these defaults for its tests.
+    """
+    defaults = dict(n_frames=4, shape=(21, 13), dtype=np.uint16, level=1000.0, step=0.0, noise=10.0,
+                    seed=0, start=0, prefix="frame", hits=None, header=None)
+    defaults.update(getattr(request.module, 'FRAME_DEFAULTS', {}))
+
+    def write(n_frames=None, **options):
+        options = {**defaults, **options}
+        levels = options['level']
+        if np.ndim(levels):
+            n_frames = len(levels)
+        else:
+            n_frames = options['n_frames'] if n_frames is None else n_frames
+            levels = [levels] * n_frames
+        start = options['start']
+        hits = {(i if i >= 0 else start + n_frames + i): hit for i, hit in (options['hits'] or {}).items()}
+        rng = np.random.default_rng(options['seed'] + start)
+        paths = []
+        for i in range(start, start + n_frames):
+            level = levels[i - start] + options['step'] * (i - start)
+            if options['noise']:
+                data = rng.normal(level, options['noise'], options['shape'])
+            else:
+                data = np.full(options['shape'], level, dtype=np.float64)
+            if i in hits:
+                region, value = hits[i]
+                data[region] = value
+            hdu = fits.PrimaryHDU(np.clip(data, 0, 65535).astype(options['dtype']))
+            for key, value in (options['header'] or {}).items():
+                hdu.header[key] = value
+            path = os.path.join(tmp_path, f"{options['prefix']}_{i:03d}.fits")
+            hdu.writeto(path)
+            paths.append(path)
+        return paths
+    return write
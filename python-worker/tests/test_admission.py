@@ -0,0 +1,49 @@
+import numpy as np
+from app.admission import plan_execution, frame_geometry
+
+
+FRAME_DEFAULTS = dict(n_frames=3, shape=(40, 30), noise=0)
+
+
+def test_geometry_from_header(write_frames):
+    assert frame_geometry(write_frames(1)[0]) == ((40, 30), np.dtype(np.float32))
+    assert frame_geometry(write_frames(1, dtype=np.float32, prefix="f")[0]) == ((40, 30), np.dtype(np.float64))
+
+
+def test_small_job_runs_in_memory(write_frames):
+    plan = plan_execution(write_frames(), "median", memory_mb=1024)
+    assert plan.admitted and plan.in_memory
+    assert plan.band_height == 40
+
+
+def test_large_job_falls_back_to_tiled(write_frames):
+    """A cube bigger than the budget is stacked memory-mapped in bands that fit."""
+    paths = write_frames(n_frames=300, shape=(400, 300))
+    plan = plan_execution(paths, "sigma", memory_mb=250)  # ~69 MB float32 cube, ~46 MB left over
+    assert plan.admitted and not plan.in_memory
+    assert plan.band_height < 400
+    assert plan.estimated_peak_mb <= plan.budget_mb
+
+
+def test_full_cube_method_over_budget_is_rejected(write_frames):
+    paths = write_frames(n_frames=300, shape=(400, 300))
+    plan = plan_execution(paths, "superbias", memory_mb=250)
+    assert not plan.admitted
+    assert "superbias" in plan.reason
+
+
+def test_workers_share_the_band_budget(write_frames):
+    """Each band worker holds its own band, so more workers get shorter bands for the same peak."""
+    paths = write_frames(n_frames=300, shape=(400, 300))
+    single = plan_execution(paths, "sigma", memory_mb=250, workers=1)
+    parallel = plan_execution(paths, "sigma", memory_mb=250, workers=4)
+    assert parallel.band_height <= single.band_height // 4 + 1
+    assert parallel.estimated_peak_mb <= parallel.budget_mb
+
+
+def test_explicit_band_height_is_counted_per_worker(write_frames):
+    paths = write_frames(n_frames=300, shape=(400, 300))
+    one = plan_execution(paths, "sigma", memory_mb=250, band_height=20, workers=1)
+    four = plan_execution(paths, "sigma", memory_mb=250, band_height=20, workers=4)
+    assert four.band_memory_mb == 4 * one.band_memory_mb
+    assert four.estimated_peak_mb - one.estimated_peak_mb == 3 * one.band_memory_mb
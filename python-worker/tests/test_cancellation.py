@@ -0,0 +1,39 @@
+import asyncio
+from app.cancellation import CANCEL_CHANNEL, CancellationRegistry
+
+
+class FakeListenConnection:
+    def __init__(self):
+        self.listeners = {}
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+
+def test_cancel_sets_registered_token():
+    registry = CancellationRegistry()
+    token = registry.token('job-1')
+    assert registry.token('job-1') is token
+    assert not token.cancelled
+    assert registry.cancel('job-1')
+    assert token.cancelled
+    assert asyncio.run(token.is_cancelled())
+
+
+def test_cancel_unknown_job_is_not_local():
+    registry = CancellationRegistry()
+    assert not registry.cancel('job-elsewhere')
+    token = registry.token('job-2')
+    registry.release('job-2')
+    assert registry.get('job-2') is None
+    assert not registry.cancel('job-2')
+    assert not token.cancelled
+
+
+def test_notify_from_another_node_cancels():
+    registry = CancellationRegistry()
+    conn = FakeListenConnection()
+    asyncio.run(registry.listen(conn))
+    token = registry.token('job-3')
+    conn.listeners[CANCEL_CHANNEL](conn, 1234, CANCEL_CHANNEL, 'job-3')
+    assert token.cancelled
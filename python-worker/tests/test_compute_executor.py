@@ -0,0 +1,46 @@
+import asyncio
+import os
+import numpy as np
+from app.compute_executor import ComputeExecutor
+from app.frame_statistics import compute_frame_statistics
+
+
+def run(executor, fn, *args, **kwargs):
+    async def stage():
+        return await executor.run(fn, *args, **kwargs)
+    return asyncio.run(stage())
+
+
+def test_stage_runs_in_worker_process():
+    executor = ComputeExecutor(max_workers=1)
+    try:
+        assert run(executor, os.getpid) != os.getpid()
+        data = np.arange(1000, dtype=np.float32).reshape(25, 40)
+        stats = run(executor, compute_frame_statistics, data, bins=10, saturation=900)
+        assert stats.count == 1000
+        assert stats.saturated_count == 100
+        assert np.isclose(stats.mean, data.mean())
+        assert executor.active == 0
+    finally:
+        executor.shutdown()
+
+
+def test_zero_processes_runs_in_thread():
+    executor = ComputeExecutor(max_workers=0)
+    assert run(executor, os.getpid) == os.getpid()
+    assert executor._get_pool() is None
+
+
+def test_stage_errors_reach_the_caller():
+    executor = ComputeExecutor(max_workers=1)
+    try:
+        try:
+            run(executor, compute_frame_statistics, np.array([]))
+        except ValueError as e:
+            assert "empty" in str(e)
+        else:
+            raise AssertionError("expected ValueError")
+        # The pool survives an exception raised by a stage
+        assert run(executor, abs, -3) == 3
+    finally:
+        executor.shutdown()
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from app.cosmetic_masking import repair_bad_pixels
+
+
+def _repair_loop(image, bad):
+    """Per-pixel reference: median of the good reflected 3x3 neighbours."""
+    padded = np.pad(image.astype(np.float64), 1, mode='reflect')
+    padded_bad = np.pad(bad, 1, mode='reflect')
+    corrected = image.copy()
+    for y, x in np.argwhere(bad):
+        values = padded[y:y + 3, x:x + 3]
+        good = ~padded_bad[y:y + 3, x:x + 3]
+        corrected[y, x] = np.median(values[good]) if good.any() else np.median(values)
+    return corrected
+
+
+@pytest.mark.parametrize("tile_rows", [None, 1, 4])
+def test_matches_pixel_loop(tile_rows):
+    rng = np.random.default_rng(0)
+    image = rng.normal(1000, 10, (17, 13))
+    bad = rng.random(image.shape) < 0.2
+    bad[0, 0] = bad[-1, -1] = bad[0, 5] = True  # corners and edges use reflected neighbours
+    image[bad] = 60000
+    np.testing.assert_array_equal(repair_bad_pixels(image, bad, tile_rows=tile_rows), _repair_loop(image, bad))
+
+
+def test_bad_neighbours_do_not_leak_into_repair():
+    """A hot cluster is filled from the background around it, not from its own hot pixels."""
+    image = np.full((9, 9), 100.0)
+    image[3:5, 3:5] = 50000
+    bad = image > 1000
+    repaired = repair_bad_pixels(image, bad)
+    assert np.all(repaired[3:5, 3:5] == 100.0)
+    assert not np.shares_memory(repaired, image)
+
+
+def test_pixel_without_good_neighbours_uses_full_neighbourhood():
+    image = np.arange(25, dtype=np.float64).reshape(5, 5)
+    bad = np.ones((5, 5), dtype=bool)
+    np.testing.assert_array_equal(repair_bad_pixels(image, bad)[2, 2], np.median(image[1:4, 1:4]))
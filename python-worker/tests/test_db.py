@@ -0,0 +1,77 @@
+import asyncio
+from app import db
+
+
+class FakeConnection:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.acquired = 0
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                pool.acquired += 1
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+        return Acquire()
+
+
+def test_acquire_uses_pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, '_pool', pool)
+
+    async def use():
+        monkeypatch.setattr(db, '_pool_loop', asyncio.get_running_loop())
+        for _ in range(3):
+            async with db.acquire() as conn:
+                assert conn is pool.conn
+    asyncio.run(use())
+    assert pool.acquired == 3
+    # Pooled connections are returned, not closed
+    assert not pool.conn.closed
+
+
+def test_acquire_without_pool_opens_and_closes(monkeypatch):
+    opened = []
+
+    async def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    monkeypatch.setattr(db, '_pool', None)
+    monkeypatch.setattr(db, 'get_db', connect)
+
+    async def use():
+        async with db.acquire() as conn:
+            return conn
+    conn = asyncio.run(use())
+    assert opened == [conn] and conn.closed
+
+
+def test_acquire_from_another_loop_does_not_use_pool(monkeypatch):
+    # e.g. the FITS upload thread in run_calibration_job runs insert_job on its own loop
+    pool = FakePool()
+    opened = []
+
+    async def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    monkeypatch.setattr(db, '_pool', pool)
+    monkeypatch.setattr(db, '_pool_loop', object())
+    monkeypatch.setattr(db, 'get_db', connect)
+
+    async def use():
+        async with db.acquire():
+            pass
+    asyncio.run(use())
+    assert pool.acquired == 0 and opened[0].closed
@@ -0,0 +1,58 @@
+import os
+from app.fits_cache import FitsCache
+
+
+def writer(content, calls):
+    def download(tmp_path):
+        calls.append(tmp_path)
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+    return download
+
+
+def test_same_etag_downloads_once(tmp_path):
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    calls = []
+    for i in range(3):
+        local = str(tmp_path / f'frame{i}.fits')
+        hit = cache.fetch('raw-frames', 'u/p/light/a.fits', local, '"e1"', writer(b'SIMPLE', calls))
+        assert hit == (i > 0)
+        assert open(local, 'rb').read() == b'SIMPLE'
+    assert len(calls) == 1
+    # Temp files never linger in the cache
+    assert os.listdir(tmp_path / 'cache' / 'tmp') == []
+
+
+def test_changed_etag_refetches(tmp_path):
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    calls = []
+    local = str(tmp_path / 'a.fits')
+    cache.fetch('raw-frames', 'a.fits', local, '"e1"', writer(b'old', calls))
+    assert not cache.fetch('raw-frames', 'a.fits', local, '"e2"', writer(b'new', calls))
+    assert open(local, 'rb').read() == b'new'
+    assert len(calls) == 2
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    calls = []
+    cache.fetch('raw-frames', 'a.fits', str(tmp_path / 'a.fits'), '"e1"', writer(b'same', calls))
+    cache.fetch('raw-frames', 'b.fits', str(tmp_path / 'b.fits'), '"e9"', writer(b'same', calls))
+    assert len(os.listdir(tmp_path / 'cache' / 'blobs')) == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=2.5 / 1024)  # 2.5 KiB
+    calls = []
+    local = str(tmp_path / 'out.fits')
+    for name in ('a', 'b'):
+        cache.fetch('raw-frames', name, local, 'e', writer(name.encode() * 1024, calls))
+    # Use 'a' again so 'b' is the least recently used
+    blobs = tmp_path / 'cache' / 'blobs'
+    for entry in os.listdir(blobs):
+        os.utime(blobs / entry, (0, 0))
+    assert cache.fetch('raw-frames', 'a', local, 'e', writer(b'', calls))
+    cache.fetch('raw-frames', 'c', local, 'e', writer(b'c' * 1024, calls))
+    assert cache.size_bytes() <= cache.max_bytes
+    assert cache.fetch('raw-frames', 'a', local, 'e', writer(b'', calls))
+    assert not cache.fetch('raw-frames', 'b', local, 'e', writer(b'b' * 1024, calls))
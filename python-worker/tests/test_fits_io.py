@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+from app.fits_io import MemmapImage, load_image
+from app.frame_consistency import compute_frame_statistics
+from app.frame_stack import FrameStack
+from app.outlier_rejection import compute_frame_stats
+
+
+def write(tmp_path, data, name="frame.fits", **cards):
+    path = str(tmp_path / name)
+    hdu = fits.PrimaryHDU(data)
+    for key, value in cards.items():
+        hdu.header[key] = value
+    hdu.writeto(path)
+    return path
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.uint32])
+def test_unsigned_stays_unsigned(tmp_path, dtype):
+    data = np.array([[0, 1, 32767], [32768, 40000, 65535]], dtype=dtype)
+    image = load_image(write(tmp_path, data))
+    assert image.dtype == dtype
+    np.testing.assert_array_equal(image, data)
+    assert not image.flags.writeable
+
+
+def test_unscaled_data_is_the_memory_map(tmp_path):
+    data = np.arange(12, dtype=np.float32).reshape(3, 4)
+    with MemmapImage(write(tmp_path, data)) as frame:
+        image = frame.pixels()
+        assert np.shares_memory(image, frame._raw)
+    np.testing.assert_array_equal(image, data)
+    assert not image.flags.writeable
+    with pytest.raises(ValueError):
+        image[0, 0] = 1
+
+
+def test_other_scaling_decodes_to_float32(tmp_path):
+    path = write(tmp_path, np.arange(12, dtype=np.int16).reshape(3, 4), BSCALE=2.0, BZERO=10.0)
+    image = load_image(path)
+    assert image.dtype == np.float32
+    np.testing.assert_array_equal(image, fits.getdata(path))
+
+
+@pytest.mark.parametrize("data", [
+    np.arange(60, dtype=np.uint16).reshape(3, 4, 5),
+    np.arange(60, dtype=np.int16).reshape(3, 4, 5) - 30,
+])
+def test_colour_cube_decodes_like_astropy(tmp_path, data):
+    path = write(tmp_path, data)
+    image = load_image(path)
+    assert image.shape == (3, 4, 5)
+    np.testing.assert_array_equal(image, fits.getdata(path))
+    assert compute_frame_stats(path)['mean'] == pytest.approx(data.mean())
+    stats = compute_frame_statistics(path)
+    assert stats['shape'] == (3, 4, 5)
+    assert stats['quadrant_means']['top_left'] == pytest.approx(data[:, :2, :2].mean())
+
+
+def test_frame_stack_needs_2d_frames(tmp_path):
+    with pytest.raises(ValueError):
+        FrameStack([write(tmp_path, np.zeros((3, 4, 5), dtype=np.uint16))])
+
+
+def test_stats_match_float_decode(tmp_path):
+    rng = np.random.default_rng(0)
+    data = np.clip(rng.normal(30000, 2000, (64, 48)), 0, 65535).astype(np.uint16)
+    path = write(tmp_path, data)
+    stats = compute_frame_stats(path)
+    reference = data.astype(np.float64)
+    assert stats['mean'] == pytest.approx(reference.mean())
+    assert stats['std'] == pytest.approx(reference.std())
+    assert (stats['min'], stats['max']) == (reference.min(), reference.max())
+
+
+def test_histogram_analysis_counted_path_matches_float_path(tmp_path):
+    from app.histogram_analysis import HistogramAnalyzer
+    rng = np.random.default_rng(3)
+    data = np.clip(rng.normal(1500, 30, (120, 80)), 0, 65535).astype(np.uint16)
+    data[:2, :5] = 65000
+    analyzer = HistogramAnalyzer()
+    counted = analyzer.analyze_frame_histogram(write(tmp_path, data, "u16.fits"), frame_type='dark')
+    floated = analyzer.analyze_frame_histogram(write(tmp_path, data.astype(np.float32), "f32.fits"), frame_type='dark')
+    for name in ('mean', 'median', 'std', 'mad', 'skewness', 'kurtosis', 'mode', 'saturation_percent'):
+        assert getattr(counted, name) == pytest.approx(getattr(floated, name), rel=1e-6), name
+    for name in ('outlier_count', 'hot_pixel_count', 'cold_pixel_count', 'peak_count'):
+        assert getattr(counted, name) == getattr(floated, name), name
+    np.testing.assert_array_equal(counted.histogram, floated.histogram)
@@ -0,0 +1,76 @@
+import asyncio
+from contextlib import asynccontextmanager
+from app import frame_catalog
+from app.frame_catalog import CatalogFrame, FrameQuery, build_query, find_frames, lookup_frames
+from app.streaming_pipeline import matches_reference
+
+
+def row(path, temperature=-10.0, exposure_time=60.0):
+    return {'file_path': path, 'project_id': 'p1', 'frame_type': 'dark', 'camera': 'ZWO ASI294MM Pro',
+            'binning': '1x1', 'gain': 120.0, 'temperature': temperature, 'exposure_time': exposure_time,
+            'metadata': '{"instrument": "ZWO ASI294MM Pro"}'}
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def fetch(self, sql, *args):
+        self.queries.append((sql, args))
+        return self.rows
+
+
+def use_connection(monkeypatch, conn):
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+    monkeypatch.setattr(frame_catalog, 'acquire', acquire)
+
+
+def test_build_query_uses_tolerances():
+    sql, args = build_query(FrameQuery(user_id='u1', project_ids=['p1', 'p2'], frame_type='dark',
+                                       camera='ZWO ASI294MM Pro', temperature=-10, exposure_time=60))
+    assert 'project_id = any($2::text[])' in sql
+    assert 'frame_type = $3' in sql and 'camera = $4' in sql
+    assert 'temperature between $5 and $6' in sql and 'exposure_time between $7 and $8' in sql
+    assert args == ['u1', ['p1', 'p2'], 'dark', 'ZWO ASI294MM Pro', -11.0, -9.0, 59.9, 60.1]
+
+
+def test_build_query_exact_gain():
+    sql, args = build_query(FrameQuery(user_id='u1', gain=120))
+    assert sql.count('$') == 2 and 'gain = $2' in sql and args == ['u1', 120.0]
+
+
+def test_find_frames_is_one_query(monkeypatch):
+    conn = FakeConnection([row('u1/p1/dark/a.fits'), row('u1/p1/dark/b.fits')])
+    use_connection(monkeypatch, conn)
+    frames = asyncio.run(find_frames(FrameQuery(user_id='u1', frame_type='dark')))
+    assert [f.file_path for f in frames] == ['u1/p1/dark/a.fits', 'u1/p1/dark/b.fits']
+    assert frames[0].metadata == {'instrument': 'ZWO ASI294MM Pro'}
+    assert len(conn.queries) == 1
+
+
+def test_lookup_frames_by_path(monkeypatch):
+    conn = FakeConnection([row('u1/p1/dark/a.fits', temperature=-5.0)])
+    use_connection(monkeypatch, conn)
+    found = asyncio.run(lookup_frames(['u1/p1/dark/a.fits', 'u1/p1/dark/missing.fits']))
+    assert list(found) == ['u1/p1/dark/a.fits']
+    assert asyncio.run(lookup_frames([])) == {}
+
+
+def test_lookup_frames_without_database(monkeypatch):
+    @asynccontextmanager
+    async def acquire():
+        raise OSError('connection refused')
+        yield
+    monkeypatch.setattr(frame_catalog, 'acquire', acquire)
+    assert asyncio.run(lookup_frames(['a.fits'])) == {}
+
+
+def test_catalog_values_match_like_headers():
+    light = CatalogFrame(**{**row('u1/p1/light/l.fits'), 'metadata': {}}).as_header()
+    warm = CatalogFrame(**{**row('u1/p1/dark/w.fits', temperature=-4.0), 'metadata': {}}).as_header()
+    cold = CatalogFrame(**{**row('u1/p1/dark/c.fits', temperature=-10.5), 'metadata': {}}).as_header()
+    assert matches_reference(cold, light, temp_matching=True, exposure_matching=True)
+    assert not matches_reference(warm, light, temp_matching=True, exposure_matching=False)
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+from app.frame_stack import FrameStack
+from app.stacking import stack_tiled
+
+
+FRAME_DEFAULTS = dict(step=50.0, noise=20.0, seed=1)
+
+
+def load_cube(paths):
+    return np.stack([fits.getdata(p).astype(np.float64) for p in paths])
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_bands_match_full_decode(write_frames, in_memory):
+    paths = write_frames()
+    with FrameStack(paths, in_memory=in_memory) as stack:
+        assert stack.in_memory is in_memory
+        assert len(stack) == 4 and stack.shape == (21, 13)
+        bands = [band.copy() for _, _, band in stack.iter_bands(5)]
+        np.testing.assert_array_equal(np.concatenate(bands, axis=1), load_cube(paths))
+        np.testing.assert_array_equal(stack.frame(2), fits.getdata(paths[2]).astype(np.float32))
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+@pytest.mark.parametrize("n_frames", [3, 4])
+def test_median_matches_numpy(write_frames, in_memory, n_frames):
+    paths = write_frames(n_frames=n_frames, shape=(7, 9))
+    expected = float(np.median(np.stack([fits.getdata(p) for p in paths])))
+    with FrameStack(paths, in_memory=in_memory) as stack:
+        assert stack.median() == expected
+
+
+def test_auto_mode_respects_memory_budget(write_frames):
+    paths = write_frames()
+    with FrameStack(paths, memory_mb=1) as stack:
+        assert stack.in_memory
+    with FrameStack(paths, memory_mb=1e-6) as stack:
+        assert not stack.in_memory
+
+
+def test_float_frames_keep_float64(write_frames):
+    paths = write_frames(dtype=np.float32)
+    with FrameStack(paths, in_memory=True) as stack:
+        assert not stack.is_integer
+        assert stack.median() == pytest.approx(float(np.median(np.stack([fits.getdata(p) for p in paths]))), rel=1e-6)
+
+
+@pytest.mark.parametrize("n_frames", [3, 4])
+def test_memmapped_float_median_is_exact(tmp_path, n_frames):
+    """Radix selection over bands gives exactly np.median, negative values and outliers included."""
+    rng = np.random.default_rng(n_frames)
+    paths = []
+    for i in range(n_frames):
+        data = rng.normal(0, 10, (9, 7)).astype(np.float32)
+        data[0, 0] = 50000
+        path = os.path.join(tmp_path, f"float_{i}.fits")
+        fits.PrimaryHDU(data).writeto(path)
+        paths.append(path)
+    with FrameStack(paths, in_memory=False) as stack:
+        assert stack.median() == float(np.median(load_cube(paths)))
+
+
+def test_stack_is_shared_and_left_open(write_frames):
+    """stack_tiled reuses an open FrameStack and gives the same master as reading the files itself."""
+    paths = write_frames()
+    with FrameStack(paths, in_memory=True) as stack:
+        from_stack = stack_tiled(stack, method="median", band_height=4)
+        assert len(stack) == 4  # still open for the next consumer
+        again = stack_tiled(stack, method="mean")
+    np.testing.assert_array_equal(from_stack, stack_tiled(paths, method="median"))
+    np.testing.assert_allclose(again, load_cube(paths).mean(axis=0), rtol=1e-12)
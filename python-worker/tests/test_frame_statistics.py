@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import scipy.stats
+from app.frame_statistics import compute_frame_statistics, pixel_counts
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.uint16])
+def test_matches_numpy(dtype):
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000, 10, (301, 299))
+    data[5, 5] = 60000
+    data[7, 7] = 0
+    data = data.astype(dtype)
+    stats = compute_frame_statistics(data, bins=64, outlier_sigma=5.0, saturation=60000)
+    reference = data.astype(np.float64)
+    assert stats.count == data.size
+    assert stats.mean == pytest.approx(reference.mean(), rel=1e-12)
+    assert stats.std == pytest.approx(reference.std(), rel=1e-12)
+    assert (stats.min, stats.max) == (reference.min(), reference.max())
+    hist, edges = np.histogram(data, bins=64)
+    np.testing.assert_array_equal(stats.histogram, hist)
+    np.testing.assert_allclose(stats.bin_edges, edges)
+    deviation = np.abs(reference - reference.mean())
+    assert stats.outlier_count == np.count_nonzero(deviation > 5 * reference.std())
+    assert stats.hot_count == np.count_nonzero(reference > reference.mean() + 5 * reference.std())
+    assert stats.saturated_count == 1
+    # The median is read from a fine histogram spanning mean ± std
+    assert abs(stats.median - np.median(reference)) <= 2 * stats.std / 2 ** 16
+
+
+def test_chunked_scan_merges_moments():
+    """Images larger than one chunk give the same moments as a single pass."""
+    rng = np.random.default_rng(1)
+    data = rng.normal(-3, 2, (1500, 1000))
+    stats = compute_frame_statistics(data)
+    assert stats.mean == pytest.approx(data.mean(), rel=1e-12)
+    assert stats.std == pytest.approx(data.std(), rel=1e-12)
+    assert abs(stats.median - np.median(data)) <= 4 / 2 ** 16
+
+
+@pytest.mark.parametrize("data,expected", [(np.full((4, 4), 7.0), 7.0), (np.arange(8.0), 3.5)])
+def test_small_and_constant_images(data, expected):
+    assert compute_frame_statistics(data).median == pytest.approx(expected, abs=1e-3)
+
+
+@pytest.mark.parametrize("shape", [(301, 299), (1, 1), (2, 3)])
+def test_pixel_counts_match_numpy(shape):
+    rng = np.random.default_rng(2)
+    data = np.clip(rng.normal(1000, 40, shape), 0, 65535).astype(np.uint16)
+    data.flat[0] = 60000
+    counts = pixel_counts(data)
+    reference = data.astype(np.float64)
+    q = [1, 5, 25, 50, 75, 95, 99]
+    np.testing.assert_allclose(counts.percentile(q), np.percentile(reference, q))
+    assert counts.median == np.median(reference)
+    assert counts.mad() == np.median(np.abs(reference - np.median(reference)))
+    assert counts.mean == pytest.approx(reference.mean(), rel=1e-12)
+    assert counts.std == pytest.approx(reference.std(), rel=1e-12)
+    assert (counts.min, counts.max) == (reference.min(), reference.max())
+    if data.size > 2:
+        assert counts.skewness == pytest.approx(scipy.stats.skew(reference.ravel()))
+        assert counts.kurtosis == pytest.approx(scipy.stats.kurtosis(reference.ravel()))
+    for density in (False, True):
+        hist, edges = counts.histogram(100, density=density)
+        expected, expected_edges = np.histogram(data, bins=100, density=density)
+        np.testing.assert_allclose(hist, expected)
+        np.testing.assert_allclose(edges, expected_edges)
+
+
+def test_pixel_counts_only_for_small_unsigned():
+    assert pixel_counts(np.zeros(4, dtype=np.uint8)) is not None
+    for dtype in (np.int16, np.uint32, np.float32):
+        assert pixel_counts(np.zeros(4, dtype=dtype)) is None
+
+
+def test_uint16_median_is_exact():
+    data = np.array([3, 1, 2, 10], dtype=np.uint16)
+    assert compute_frame_statistics(data).median == 2.5
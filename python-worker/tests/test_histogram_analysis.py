@@ -0,0 +1,27 @@
+import asyncio
+from app.compute_executor import ComputeExecutor
+from app.histogram_analysis import (analyze_calibration_frame_histograms, analyze_frame_histogram_dict,
+                                    summarize_frame_histograms)
+
+
+FRAME_DEFAULTS = dict(level=(1000, 1500, 800, 1200), noise=25.0, shape=(60, 40), seed=4, prefix="dark",
+                      header={'IMAGETYP': 'Dark Frame', 'EXPTIME': 60.0})
+
+
+def test_fanned_out_frames_match_serial_analysis(write_frames):
+    paths = write_frames()
+    executor = ComputeExecutor(max_workers=2)
+
+    async def fan_out():
+        return await asyncio.gather(*[executor.run(analyze_frame_histogram_dict, p, 'dark') for p in paths])
+    try:
+        combined = summarize_frame_histograms(asyncio.run(fan_out()))
+    finally:
+        executor.shutdown()
+    serial = analyze_calibration_frame_histograms(paths, 'dark')
+    assert [r['frame_path'] for r in combined['frame_results']] == paths
+    assert combined == serial
+
+
+def test_summary_of_no_frames():
+    assert summarize_frame_histograms([])['summary']['total_frames'] == 0
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+from app import job_events
+from app.job_events import EVENTS_CHANNEL, JobEventBus, format_sse
+
+
+def test_local_subscribers_receive_events():
+    async def scenario():
+        bus = JobEventBus(notify=False)
+        queue = bus.subscribe('job-1')
+        other = bus.subscribe('job-2')
+        bus.publish('job-1', progress=40, stage='stacking')
+        bus.publish('job-1', status='success', progress=100, result={'preview_url': 'x'})
+        first, second = queue.get_nowait(), queue.get_nowait()
+        assert first == {'job_id': 'job-1', 'progress': 40, 'stage': 'stacking'}
+        assert second['status'] == 'success' and second['result'] == {'preview_url': 'x'}
+        assert other.empty()
+        bus.unsubscribe('job-1', queue)
+        assert not bus.watching('job-1')
+    asyncio.run(scenario())
+
+
+def test_publish_from_another_thread_reaches_subscriber():
+    async def scenario():
+        bus = JobEventBus(notify=False)
+        queue = bus.subscribe('job-1')
+        # e.g. insert_job in the FITS upload thread, on its own event loop
+        thread = threading.Thread(target=lambda: asyncio.run(_publish(bus)))
+        thread.start()
+        event = await asyncio.wait_for(queue.get(), timeout=2)
+        thread.join()
+        assert event == {'job_id': 'job-1', 'status': 'success'}
+    asyncio.run(scenario())
+
+
+async def _publish(bus):
+    bus.publish('job-1', status='success')
+
+
+def test_remote_events_are_coalesced_and_own_events_ignored(monkeypatch):
+    sent = []
+
+    class FakeConnection:
+        async def execute(self, sql, channel, payloads):
+            sent.append((channel, [json.loads(p) for p in payloads]))
+
+    class FakeAcquire:
+        async def __aenter__(self):
+            return FakeConnection()
+
+        async def __aexit__(self, *exc):
+            return False
+
+    async def scenario():
+        bus = JobEventBus(flush_ms=10)
+        bus.start()
+        bus.publish('job-1', progress=10, stage='validating')
+        bus.publish('job-1', progress=40, stage='stacking')
+        bus.publish('job-1', status='success', result={'big': 'x' * 10})
+        await bus.close()
+        channel, events = sent[0]
+        assert channel == EVENTS_CHANNEL and len(events) == 1
+        event = events[0]
+        assert (event['progress'], event['stage'], event['status']) == (40, 'stacking', 'success')
+        assert 'result' not in event
+        # Our own NOTIFY comes back on the listener and is ignored; another node's is delivered
+        queue = bus.subscribe('job-1')
+        bus._on_notify(None, 1, EVENTS_CHANNEL, json.dumps(event))
+        assert queue.empty()
+        bus._on_notify(None, 1, EVENTS_CHANNEL, json.dumps({**event, 'origin': 'other-node'}))
+        assert queue.get_nowait()['status'] == 'success'
+
+    monkeypatch.setattr(job_events, 'acquire', FakeAcquire)
+    asyncio.run(scenario())
+
+
+def test_format_sse():
+    assert format_sse('progress', {'progress': 5}) == 'event: progress\ndata: {"progress": 5}\n\n'
@@ -0,0 +1,52 @@
+import pytest
+from pydantic import BaseModel
+from app import job_queue
+from app.job_queue import JobWorker, decode_payload, encode_payload, parse_limits, register_job_type
+
+
+class ExampleRequest(BaseModel):
+    input_paths: list[str]
+    settings: dict = {}
+
+
+async def run_example(request, job_id, params=None):
+    return request, job_id, params
+
+
+@pytest.fixture
+def job_types(monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_TYPES', {})
+    register_job_type('calibration', ExampleRequest, run_example, priority=10)
+    register_job_type('cosmic_ray', ExampleRequest, run_example)
+    return job_queue.JOB_TYPES
+
+
+def test_parse_limits():
+    assert parse_limits('calibration=1, cosmic_ray=3,*=2') == {'calibration': 1, 'cosmic_ray': 3, '*': 2}
+    assert parse_limits('') == {}
+    with pytest.raises(ValueError):
+        parse_limits('calibration')
+
+
+def test_priority_override(monkeypatch, job_types):
+    monkeypatch.setattr(job_queue, 'DEFAULT_JOB_PRIORITIES', 'cosmic_ray=20')
+    register_job_type('cosmic_ray', ExampleRequest, run_example)
+    assert job_types['calibration'].priority == 10
+    assert job_types['cosmic_ray'].priority == 20
+
+
+def test_payload_round_trip(job_types):
+    request = ExampleRequest(input_paths=['a.fits', 'b.fits'], settings={'stackingMethod': 'median'})
+    decoded, args = decode_payload(job_types['cosmic_ray'], encode_payload(request, [{'sigma_clip': 4.5}]))
+    assert decoded == request
+    assert args == [{'sigma_clip': 4.5}]
+
+
+def test_claimable_types_respect_limits(job_types):
+    worker = JobWorker(worker_id='test', limits={'calibration': 1, '*': 2})
+    assert worker.claimable_types() == ['calibration', 'cosmic_ray']
+    worker._active['calibration'] += 1
+    worker._active['cosmic_ray'] += 1
+    assert worker.claimable_types() == ['cosmic_ray']
+    worker._active['cosmic_ray'] += 1
+    assert worker.claimable_types() == []
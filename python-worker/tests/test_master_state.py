@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+from app.master_state import MasterState
+from app.stacking import stack_tiled
+
+
+HIT = (np.s_[4:6, 2:4], 50000)  # cosmic-ray-like hit
+FRAME_DEFAULTS = dict(shape=(15, 11), seed=2, prefix="dark", hits={3: HIT})
+
+
+def test_incremental_mean_matches_full_stack(write_frames):
+    first = write_frames(6)
+    second = write_frames(4, start=6)
+    state = MasterState.empty('mean', (15, 11))
+    state.fold(first, [os.path.basename(p) for p in first], band_height=4)
+    state.fold(second, [os.path.basename(p) for p in second], band_height=5)
+    full = stack_tiled(first + second, method='mean')
+    np.testing.assert_allclose(state.master(), full, rtol=1e-12)
+    cube = np.stack([fits.getdata(p).astype(np.float64) for p in first + second])
+    np.testing.assert_allclose(state.std(), cube.std(axis=0), rtol=1e-9)
+    assert state.n_frames == 10 and np.all(state.count == 10)
+
+
+def test_first_sigma_fold_matches_sigma_stack(write_frames):
+    paths = write_frames(8)
+    state = MasterState.empty('sigma', (15, 11), sigma_low=2.5, sigma_high=2.5)
+    state.fold(paths, paths)
+    np.testing.assert_allclose(state.master(), stack_tiled(paths, method='sigma', sigma_clip=2.5), rtol=1e-12)
+
+
+def test_fully_rejected_pixels_fall_back_like_the_combiner(write_frames):
+    paths = write_frames(5, hits={})
+    state = MasterState.empty('sigma', (15, 11), sigma_low=0.05, sigma_high=0.05)
+    state_map = np.zeros((15, 11), dtype=np.uint16)
+    state.fold(paths, paths, band_height=4, rejection_map=state_map)
+    stack_map = np.zeros((15, 11), dtype=np.uint16)
+    full = stack_tiled(paths, method='sigma', low_thresh=0.05, high_thresh=0.05, workers=1,
+                       rejection_map=stack_map)
+    assert np.any(stack_map == 5)
+    np.testing.assert_allclose(state.master(), full, rtol=1e-12)
+    np.testing.assert_array_equal(state_map, stack_map)
+
+
+def test_sigma_fold_rejects_outliers_in_new_frames(write_frames):
+    first = write_frames(8, hits={})
+    state = MasterState.empty('sigma', (15, 11))
+    state.fold(first, first)
+    hot = write_frames(1, start=10, hits={10: HIT})
+    state.fold(hot, hot)
+    assert state.master()[4:6, 2:4].max() < 1100
+    assert np.all(state.count[4:6, 2:4] == 8) and np.all(state.count[0] == 9)
+
+
+def test_roundtrip_and_manifest(write_frames, tmp_path):
+    paths = write_frames(3)
+    state = MasterState.empty('sigma', (15, 11), sigma_low=2.0, sigma_high=4.0, sigma_max_iters=None)
+    state.fold(paths, ["a/dark_0.fits", "a/dark_1.fits", "a/dark_2.fits"])
+    sidecar = os.path.join(tmp_path, "master.state.fits")
+    state.save(sidecar)
+    loaded = MasterState.load(sidecar)
+    assert loaded.method == 'sigma' and loaded.sigma_max_iters is None
+    assert (loaded.sigma_low, loaded.sigma_high) == (2.0, 4.0)
+    assert loaded.manifest == state.manifest
+    assert loaded.new_frames(["a/dark_1.fits", "a/dark_9.fits"]) == [1]
+    np.testing.assert_array_equal(loaded.mean, state.mean)
+    np.testing.assert_array_equal(loaded.count, state.count)
+
+
+def test_rejects_unsupported_method_and_shape(write_frames):
+    with pytest.raises(ValueError):
+        MasterState.empty('median', (4, 4))
+    state = MasterState.empty('mean', (4, 4))
+    paths = write_frames(2)
+    with pytest.raises(ValueError):
+        state.fold(paths, paths)
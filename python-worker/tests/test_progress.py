@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from app.progress import ProgressReporter
+
+
+def test_updates_coalesce_into_one_write():
+    writes = []
+
+    async def write(rows):
+        writes.append(sorted(rows))
+
+    async def scenario():
+        reporter = ProgressReporter(flush_ms=20, write=write)
+        for progress in (10, 20, 30):
+            reporter.report('job-a', progress)
+        reporter.report('job-b', 5, status='running')
+        reporter.report('job-b', 50)
+        assert reporter.pending('job-a') == (30, None)
+        await asyncio.sleep(0.05)
+        assert reporter.pending('job-a') is None
+        await reporter.close()
+
+    asyncio.run(scenario())
+    assert writes == [[('job-a', 30, None), ('job-b', 50, 'running')]]
+
+
+def test_discarded_progress_is_not_written():
+    writes = []
+
+    async def write(rows):
+        writes.append(rows)
+
+    async def scenario():
+        reporter = ProgressReporter(flush_ms=10, write=write)
+        reporter.report('job-a', 90)
+        reporter.discard('job-a')
+        await reporter.close()
+
+    asyncio.run(scenario())
+    assert writes == []
+
+
+def test_failed_write_is_retried():
+    attempts = []
+
+    async def write(rows):
+        attempts.append(rows)
+        if len(attempts) == 1:
+            raise ConnectionError("database unavailable")
+
+    async def scenario():
+        reporter = ProgressReporter(flush_ms=10, write=write)
+        reporter.report('job-a', 40)
+        await reporter.flush()
+        assert reporter.pending('job-a') == (40, None)
+        await reporter.close()
+
+    asyncio.run(scenario())
+    assert attempts[-1] == [('job-a', 40, None)]
+
+
+def test_terminal_status_is_not_buffered():
+    async def scenario():
+        with pytest.raises(ValueError):
+            ProgressReporter().report('job-a', 100, status='success')
+
+    asyncio.run(scenario())
@@ -0,0 +1,212 @@
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+from app.stacking import stack_tiled, auto_band_height, sigma_clip_combine, TILED_METHODS, COMBINE_KERNELS
+
+
+# Synthetic frames with a hot cluster in the first and a cold one in the last
+FRAME_DEFAULTS = dict(n_frames=5, shape=(23, 17),
+                      hits={0: (np.s_[5:8, 5:8], 60000), -1: (np.s_[10:12, 3:6], 100)})
+
+
+def load_cube(paths):
+    return np.stack([fits.getdata(p).astype(np.float64) for p in paths])
+
+
+@pytest.mark.parametrize("method", TILED_METHODS)
+def test_band_size_does_not_change_result(write_frames, method):
+    """Combining band by band must give the same pixels as one full-frame band."""
+    paths = write_frames()
+    full = stack_tiled(paths, method=method, band_height=10_000)
+    banded = stack_tiled(paths, method=method, band_height=4)
+    assert full.shape == (23, 17)
+    np.testing.assert_allclose(banded, full, rtol=1e-12)
+
+
+@pytest.mark.parametrize("method", ["mean", "median", "minmax", "winsorized"])
+def test_matches_in_memory_stack(write_frames, method):
+    """Memory-mapped reads with BZERO applied per band reproduce the in-memory numbers."""
+    paths = write_frames()
+    cube = load_cube(paths)
+    expected = COMBINE_KERNELS[method](cube, None)
+    np.testing.assert_allclose(stack_tiled(paths, method=method, band_height=3), expected, rtol=1e-12)
+
+
+def test_float_frames(write_frames):
+    paths = write_frames(dtype=np.float32)
+    np.testing.assert_allclose(stack_tiled(paths, method="mean", band_height=5),
+                               np.mean(load_cube(paths), axis=0), rtol=1e-12)
+
+
+def test_mismatched_shapes_rejected(write_frames, tmp_path):
+    paths = write_frames(n_frames=2)
+    odd = os.path.join(tmp_path, "odd.fits")
+    fits.PrimaryHDU(np.zeros((5, 5), dtype=np.uint16)).writeto(odd)
+    with pytest.raises(ValueError):
+        stack_tiled(paths + [odd], method="mean")
+
+
+def test_unknown_method_rejected(write_frames):
+    with pytest.raises(ValueError):
+        stack_tiled(write_frames(n_frames=2), method="superbias")
+
+
+def test_auto_band_height_is_bounded():
+    assert auto_band_height(100, 9576, 6388, memory_mb=512) < 9576
+    assert auto_band_height(3, 50, 50, memory_mb=512) == 50
+    assert auto_band_height(10_000, 100, 100_000, memory_mb=1) == 1
+
+
+def _percentile_clip_loop(cube, low, high):
+    """Per-pixel reference for the vectorized percentile_clip kernel."""
+    result = np.zeros(cube.shape[1:])
+    for y in range(cube.shape[1]):
+        for x in range(cube.shape[2]):
+            values = cube[:, y, x]
+            p_low, p_high = np.percentile(values, low), np.percentile(values, high)
+            valid = values[(values >= p_low) & (values <= p_high)]
+            result[y, x] = np.mean(valid) if valid.size else np.median(values)
+    return result
+
+
+@pytest.mark.parametrize("n_frames", [2, 5, 12])
+def test_percentile_clip_matches_pixel_loop(n_frames):
+    rng = np.random.default_rng(n_frames)
+    adu = np.round(rng.normal(1000, 10, (n_frames, 9, 11)))
+    adu[0, 2, 3] = 60000
+    kernel = COMBINE_KERNELS["percentile_clip"]
+    # Raw ADU values are integers, so the masked sums are exact
+    np.testing.assert_array_equal(kernel(adu, None), _percentile_clip_loop(adu, 20.0, 80.0))
+    np.testing.assert_array_equal(kernel(adu, 30.0), _percentile_clip_loop(adu, 35.0, 65.0))
+    scaled = rng.normal(0.5, 0.01, (n_frames, 9, 11))
+    np.testing.assert_allclose(kernel(scaled, None), _percentile_clip_loop(scaled, 20.0, 80.0), rtol=1e-12)
+
+
+def _entropy_weighted_loop(cube):
+    """Per-pixel reference for the vectorized entropy_weighted kernel."""
+    weights = np.zeros(cube.shape)
+    for y in range(cube.shape[1]):
+        for x in range(cube.shape[2]):
+            values = cube[:, y, x]
+            bins = min(16, len(np.unique(values)))
+            if bins < 2:
+                weights[:, y, x] = 1.0
+                continue
+            hist, _ = np.histogram(values, bins=bins)
+            p = hist[hist > 0] / hist.sum()
+            consistency = 1.0 - (-np.sum(p * np.log2(p))) / np.log2(bins)
+            dev = np.abs(values - np.median(values))
+            weights[:, y, x] = (1.0 - dev / (dev.max() or 1.0)) * consistency
+    weights = np.maximum(weights, 0.001)
+    return np.sum(cube * weights, axis=0) / np.sum(weights, axis=0)
+
+
+@pytest.mark.parametrize("n_frames", [2, 3, 7, 20])
+def test_entropy_weighted_matches_pixel_loop(n_frames):
+    rng = np.random.default_rng(n_frames)
+    cube = np.round(rng.normal(1000, 10, (n_frames, 9, 11)))
+    cube[0, 2, 3] = 60000
+    cube[:, 4, 4] = 1234  # constant pixel: single distinct value, equal weights
+    # Weights are accumulated in float32, so agreement is to float32 rounding
+    np.testing.assert_allclose(COMBINE_KERNELS["entropy_weighted"](cube, None), _entropy_weighted_loop(cube),
+                               rtol=1e-6)
+
+
+def test_linear_fit_single_pass_matches_pixel_loop():
+    rng = np.random.default_rng(3)
+    cube = np.round(rng.normal(1000, 10, (9, 8, 7)))
+    cube[4, 1, 1] = 50000
+    n = cube.shape[0]
+    flat = cube.reshape(n, -1)
+    fit = np.polyfit(np.arange(n), flat, 1)
+    residuals = flat - (np.outer(np.arange(n), fit[0]) + fit[1])
+    mask = np.abs(residuals) < 3.0 * np.std(residuals, axis=0)
+    expected = np.array([flat[mask[:, i], i].mean() for i in range(flat.shape[1])]).reshape(cube.shape[1:])
+    np.testing.assert_allclose(COMBINE_KERNELS["linear_fit"](cube, None), expected, rtol=1e-12)
+
+
+def test_linear_fit_refit_rejects_masked_outliers():
+    """One pass leaves the smaller of two outliers in; refitting without the big one rejects it too."""
+    x = np.arange(12, dtype=np.float64)
+    series = 1000.0 + 2.0 * x + np.random.default_rng(4).normal(0, 5, x.size)
+    series[3] += 40000
+    series[8] += 300
+    cube = series[:, None, None] * np.ones((1, 2, 3))
+    single = COMBINE_KERNELS["linear_fit"](cube, 2.5)
+    refit = COMBINE_KERNELS["linear_fit"](cube, 2.5, iterations=5)
+    clean = np.delete(series, [3, 8]).mean()
+    assert abs(single[0, 0] - clean) > 1.0
+    np.testing.assert_allclose(refit, clean, rtol=1e-12)
+
+
+def test_linear_fit_iterations_through_tiled_engine(write_frames):
+    paths = write_frames(n_frames=8)
+    full = stack_tiled(paths, method="linear_fit", band_height=10_000, iterations=3)
+    banded = stack_tiled(paths, method="linear_fit", band_height=5, iterations=3)
+    np.testing.assert_allclose(banded, full, rtol=1e-12)
+
+
+def test_sigma_matches_ccdproc_combiner():
+    """Default sigma options (mean/std, one pass) reproduce the ccdproc Combiner it replaced."""
+    from astropy.nddata import CCDData
+    from ccdproc import Combiner
+    rng = np.random.default_rng(5)
+    cube = np.round(rng.normal(1000, 10, (15, 12, 10)))
+    cube[3, 2:4, 5] = 40000
+    comb = Combiner([CCDData(frame, unit="adu") for frame in cube])
+    comb.sigma_clipping(low_thresh=2.0, high_thresh=2.5)
+    expected = comb.average_combine().data
+    np.testing.assert_allclose(COMBINE_KERNELS["sigma"](cube, None, low_thresh=2.0, high_thresh=2.5), expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize("center,scale", [("mean", "std"), ("median", "mad"), ("median", "std")])
+def test_sigma_clip_iterations_match_astropy(center, scale):
+    from astropy.stats import sigma_clip
+    rng = np.random.default_rng(6)
+    cube = np.round(rng.normal(1000, 10, (20, 6, 7)))
+    cube[0, 1, 1] = 60000
+    cube[1, 1, 1] = 1500
+    cube[2, 1, 1] = 1060
+    clipped = sigma_clip(cube, sigma_lower=2.0, sigma_upper=2.0, maxiters=None, axis=0,
+                         cenfunc=center, stdfunc="mad_std" if scale == "mad" else "std")
+    rejection_map = np.zeros(cube.shape[1:], dtype=np.uint16)
+    result = sigma_clip_combine(cube, 2.0, 2.0, center=center, scale=scale, max_iters=None,
+                                rejection_map=rejection_map)
+    np.testing.assert_allclose(result, clipped.mean(axis=0).filled(np.nan), rtol=1e-6)
+    np.testing.assert_array_equal(rejection_map, np.count_nonzero(clipped.mask, axis=0))
+    assert rejection_map[1, 1] >= 2
+
+
+def test_sigma_rejection_map_through_tiled_engine(write_frames):
+    paths = write_frames(n_frames=10)
+    full_map = np.zeros((23, 17), dtype=np.uint16)
+    banded_map = np.zeros((23, 17), dtype=np.uint16)
+    full = stack_tiled(paths, method="sigma", sigma_clip=2.5, band_height=10_000, rejection_map=full_map)
+    banded = stack_tiled(paths, method="sigma", sigma_clip=2.5, band_height=4, rejection_map=banded_map)
+    np.testing.assert_array_equal(banded, full)
+    np.testing.assert_array_equal(banded_map, full_map)
+    # The hot cluster in the first frame is rejected in every pixel it covers
+    assert np.all(full_map[5:8, 5:8] >= 1)
+    assert full[5:8, 5:8].max() < 1100
+
+
+def test_sigma_clip_rejects_unknown_options():
+    with pytest.raises(ValueError):
+        sigma_clip_combine(np.zeros((3, 2, 2)), center="mode")
+    with pytest.raises(ValueError):
+        sigma_clip_combine(np.zeros((3, 2, 2)), scale="iqr")
+
+
+@pytest.mark.parametrize("method", ["median", "sigma"])
+def test_process_pool_matches_serial(write_frames, method):
+    """Bands combined in worker processes land in the shared master exactly as serial bands do."""
+    paths = write_frames(n_frames=6)
+    serial_map = np.zeros((23, 17), dtype=np.uint16)
+    parallel_map = np.zeros((23, 17), dtype=np.uint16)
+    options = {"rejection_map": serial_map} if method == "sigma" else {}
+    serial = stack_tiled(paths, method=method, band_height=3, workers=1, **options)
+    options = {"rejection_map": parallel_map} if method == "sigma" else {}
+    parallel = stack_tiled(paths, method=method, band_height=3, workers=2, **options)
+    np.testing.assert_array_equal(parallel, serial)
+    np.testing.assert_array_equal(parallel_map, serial_map)
@@ -0,0 +1,185 @@
+import asyncio
+import io
+import httpx
+import numpy as np
+from astropy.io import fits
+from app import storage_client as storage_module
+from app.storage_client import AsyncStorageClient
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """Fake storage: serves /object/<bucket>/<path> and tracks transfers in flight."""
+
+    def __init__(self, objects, ranges=True):
+        self.objects = objects
+        self.ranges = ranges
+        self.in_flight = 0
+        self.peak = 0
+        self.gets = 0
+        self.bytes_sent = 0
+
+    async def handle_async_request(self, request):
+        path = request.url.path.split('/object/', 1)[1]
+        if path not in self.objects:
+            return httpx.Response(404)
+        if request.method == 'HEAD':
+            return httpx.Response(200, headers={'etag': '"v1"'})
+        self.gets += 1
+        body = self.objects[path]
+        byte_range = request.headers.get('range')
+        if byte_range and self.ranges:
+            start, stop = (int(v) for v in byte_range.split('=')[1].split('-'))
+            if start >= len(body):
+                return httpx.Response(416)
+            self.bytes_sent += len(body[start:stop + 1])
+            return httpx.Response(206, content=body[start:stop + 1])
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        self.bytes_sent += len(body)
+        return httpx.Response(200, content=body)
+
+
+def make_client(transport, **kwargs):
+    return AsyncStorageClient(base_url='https://x.supabase.co', key='k', http2=False, transport=transport, **kwargs)
+
+
+def test_gather_downloads_respect_concurrency(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_module, 'get_fits_cache', lambda: None)
+    objects = {f'raw-frames/f{i}.fits': bytes([i]) * 5000 for i in range(10)}
+    transport = CountingTransport(objects)
+    client = make_client(transport, concurrency=3, chunk_kb=1)
+
+    async def run():
+        await asyncio.gather(*[client.download('raw-frames', f'f{i}.fits', str(tmp_path / f'{i}.fits'))
+                               for i in range(10)])
+        await client.aclose()
+    asyncio.run(run())
+    assert transport.peak <= 3
+    for i in range(10):
+        assert (tmp_path / f'{i}.fits').read_bytes() == bytes([i]) * 5000
+
+
+def test_missing_object_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_module, 'get_fits_cache', lambda: None)
+    client = make_client(CountingTransport({}))
+
+    async def run():
+        try:
+            await client.download('raw-frames', 'missing.fits', str(tmp_path / 'm.fits'))
+        finally:
+            await client.aclose()
+    try:
+        asyncio.run(run())
+        assert False, 'expected HTTPStatusError'
+    except httpx.HTTPStatusError as e:
+        assert e.response.status_code == 404
+
+
+def test_cached_download_fetches_once(tmp_path, monkeypatch):
+    from app.fits_cache import FitsCache
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    monkeypatch.setattr(storage_module, 'get_fits_cache', lambda: cache)
+    transport = CountingTransport({'raw-frames/a.fits': b'SIMPLE'})
+    client = make_client(transport)
+
+    async def run():
+        for name in ('one', 'two'):
+            await client.download('raw-frames', 'a.fits', str(tmp_path / f'{name}.fits'))
+        await client.aclose()
+    asyncio.run(run())
+    assert transport.gets == 1
+    assert (tmp_path / 'two.fits').read_bytes() == b'SIMPLE'
+
+
+def fits_bytes(n_cards=0, shape=(200, 300)):
+    header = fits.Header()
+    header['EXPTIME'] = 120.0
+    header['CCD-TEMP'] = -10.0
+    for i in range(n_cards):
+        header[f'HIERARCH EXTRA{i}'] = i
+    buffer = io.BytesIO()
+    fits.PrimaryHDU(np.zeros(shape, dtype=np.uint16), header=header).writeto(buffer)
+    return buffer.getvalue()
+
+
+def test_fetch_header_reads_only_header_blocks():
+    # ~150 extra cards make a 5-block header, so the reader needs a second range request
+    body = fits_bytes(n_cards=150)
+    transport = CountingTransport({'raw-frames/dark.fits': body})
+    client = make_client(transport)
+
+    async def run():
+        try:
+            return await client.fetch_header('raw-frames', 'dark.fits')
+        finally:
+            await client.aclose()
+    header = asyncio.run(run())
+    assert header['EXPTIME'] == 120.0 and header['NAXIS1'] == 300 and header['EXTRA149'] == 149
+    assert transport.gets == 2
+    assert transport.bytes_sent < len(body) // 4
+
+
+def test_fetch_header_when_range_is_ignored():
+    transport = CountingTransport({'raw-frames/dark.fits': fits_bytes()}, ranges=False)
+    client = make_client(transport)
+
+    async def run():
+        try:
+            return await client.fetch_header('raw-frames', 'dark.fits')
+        finally:
+            await client.aclose()
+    assert asyncio.run(run())['CCD-TEMP'] == -10.0
+
+
+def test_fetch_header_rejects_non_fits():
+    client = make_client(CountingTransport({'raw-frames/x.fits': b'not a fits file' * 100}))
+
+    async def run():
+        try:
+            await client.fetch_header('raw-frames', 'x.fits')
+        finally:
+            await client.aclose()
+    try:
+        asyncio.run(run())
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_cached_downloads_are_not_bounded_by_threads(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.fits_cache import FitsCache
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    monkeypatch.setattr(storage_module, 'get_fits_cache', lambda: cache)
+    objects = {f'raw-frames/f{i}.fits': bytes([i]) * 5000 for i in range(6)}
+    transport = CountingTransport(objects)
+    client = make_client(transport, concurrency=3)
+
+    async def run():
+        # A single helper thread: transfers must still overlap up to the semaphore
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        await asyncio.gather(*[client.download('raw-frames', f'f{i}.fits', str(tmp_path / f'{i}.fits'))
+                               for i in range(6)])
+        await client.aclose()
+    asyncio.run(run())
+    assert transport.peak == 3
+    for i in range(6):
+        assert (tmp_path / f'{i}.fits').read_bytes() == bytes([i]) * 5000
+
+
+def test_concurrent_cached_downloads_of_one_object_fetch_once(tmp_path, monkeypatch):
+    from app.fits_cache import FitsCache
+    cache = FitsCache(str(tmp_path / 'cache'), max_mb=10)
+    monkeypatch.setattr(storage_module, 'get_fits_cache', lambda: cache)
+    transport = CountingTransport({'raw-frames/a.fits': b'SIMPLE' * 100})
+    client = make_client(transport)
+
+    async def run():
+        await asyncio.gather(*[client.download('raw-frames', 'a.fits', str(tmp_path / f'{i}.fits'))
+                               for i in range(4)])
+        await client.aclose()
+    asyncio.run(run())
+    assert transport.gets == 1
+    assert all((tmp_path / f'{i}.fits').read_bytes() == b'SIMPLE' * 100 for i in range(4))
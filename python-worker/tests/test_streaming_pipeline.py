@@ -0,0 +1,102 @@
+import asyncio
+import os
+import shutil
+import numpy as np
+from astropy.io import fits
+from app.master_state import MasterState
+from app.streaming_pipeline import StreamingPipeline
+from app.stacking import stack_tiled
+
+
+def dark_header(temp=-10.0, exptime=60.0):
+    header = fits.Header()
+    header['IMAGETYP'] = 'Dark Frame'
+    header['EXPTIME'] = exptime
+    header['CCD-TEMP'] = temp
+    header['INSTRUME'] = 'ZWO ASI294MM Pro'
+    header['GAIN'] = 120
+    return header
+
+
+def write_store(tmp_path, n_frames, temps=None, bad=(), shape=(12, 9)):
+    """Fake storage bucket: returns the 'remote' paths of n dark frames."""
+    store = os.path.join(tmp_path, "store")
+    os.makedirs(store, exist_ok=True)
+    rng = np.random.default_rng(7)
+    paths = []
+    for i in range(n_frames):
+        header = fits.Header() if i in bad else dark_header(temp=temps[i] if temps else -10.0)
+        data = np.round(rng.normal(1000, 10, shape)).astype(np.uint16)
+        path = os.path.join(store, f"dark_{i:02d}.fits")
+        fits.PrimaryHDU(data, header=header).writeto(path)
+        paths.append(path)
+    return paths
+
+
+def run_pipeline(tmp_path, remote, pipeline):
+    work = os.path.join(tmp_path, "work")
+    os.makedirs(work, exist_ok=True)
+    items = [(src, os.path.join(work, f"input_{i}.fits")) for i, src in enumerate(remote)]
+    return asyncio.run(pipeline.run(items, shutil.copyfile, max_downloads=3))
+
+
+def test_streamed_mean_matches_batch_stack(tmp_path):
+    remote = write_store(tmp_path, 7, bad=(2,))
+    pipeline = StreamingPipeline(str(tmp_path), state=MasterState.empty('mean'))
+    result = run_pipeline(tmp_path, remote, pipeline)
+    assert len(result.valid_files) == 6 and len(result.rejected_files) == 1
+    assert sorted(result.state.manifest) == [p for i, p in enumerate(remote) if i != 2]
+    good = [p for i, p in enumerate(remote) if i != 2]
+    np.testing.assert_allclose(result.state.master(), stack_tiled(good, method='mean'), rtol=1e-12)
+
+
+def test_bias_subtracted_on_arrival(tmp_path):
+    remote = write_store(tmp_path, 3)
+    bias = np.full((12, 9), 100.0, dtype=np.float32)
+    result = run_pipeline(tmp_path, remote, StreamingPipeline(str(tmp_path), bias_data=bias))
+    for path in result.valid_files:
+        source = result.source_paths[path]
+        np.testing.assert_array_equal(fits.getdata(path), fits.getdata(source).astype(np.float32) - 100.0)
+
+
+def test_temperature_matching_with_fallback(tmp_path):
+    remote = write_store(tmp_path, 4, temps=[-10.0, -10.5, -5.0, -10.2])
+    matched = run_pipeline(tmp_path, remote, StreamingPipeline(
+        str(tmp_path), reference_header=dark_header(temp=-10.0), temp_matching=True))
+    assert sorted(matched.source_paths[p] for p in matched.valid_files) == [remote[0], remote[1], remote[3]]
+    # Nothing matches: every valid dark is used, as in the batch path
+    nothing = run_pipeline(tmp_path, remote, StreamingPipeline(
+        str(tmp_path), reference_header=dark_header(temp=20.0), temp_matching=True))
+    assert len(nothing.valid_files) == 4
+
+
+def test_frames_in_saved_state_are_not_downloaded(tmp_path):
+    remote = write_store(tmp_path, 5)
+    state = MasterState.empty('mean')
+    state.fold(remote[:3], remote[:3])
+    downloaded = []
+
+    def download(src, dst):
+        downloaded.append(src)
+        shutil.copyfile(src, dst)
+
+    work = os.path.join(tmp_path, "work")
+    os.makedirs(work)
+    items = [(src, os.path.join(work, f"input_{i}.fits")) for i, src in enumerate(remote)]
+    result = asyncio.run(StreamingPipeline(str(tmp_path), state=state).run(items, download))
+    assert sorted(downloaded) == remote[3:] and result.skipped == remote[:3]
+    np.testing.assert_allclose(result.state.master(), stack_tiled(remote, method='mean'), rtol=1e-12)
+
+
+def test_async_download_function(tmp_path):
+    remote = write_store(tmp_path, 4)
+
+    async def download(src, dst):
+        await asyncio.sleep(0)
+        shutil.copyfile(src, dst)
+    work = os.path.join(tmp_path, "work")
+    os.makedirs(work)
+    items = [(src, os.path.join(work, f"input_{i}.fits")) for i, src in enumerate(remote)]
+    pipeline = StreamingPipeline(str(tmp_path), state=MasterState.empty('mean'))
+    result = asyncio.run(pipeline.run(items, download, max_downloads=2))
+    assert len(result.valid_files) == 4
@@ -0,0 +1,19 @@
+-- Frame catalog (python-worker/app/frame_catalog.py): typed columns over the
+-- fits_metadata JSONB, so frames can be selected without reading their headers.
+-- Adding STORED columns rewrites the table once, here, instead of at worker startup.
+
+-- Reads a number without failing on header values like '' or 'N/A'
+CREATE OR REPLACE FUNCTION public.fits_num(value TEXT) RETURNS DOUBLE PRECISION
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT CASE WHEN value ~ '^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+                    THEN value::DOUBLE PRECISION END
+    $$;
+
+ALTER TABLE public.fits_metadata
+    ADD COLUMN IF NOT EXISTS frame_type TEXT GENERATED ALWAYS AS
+        (lower(coalesce(metadata->>'frame_type', nullif(split_part(file_path, '/', 3), '')))) STORED,
+    ADD COLUMN IF NOT EXISTS camera TEXT GENERATED ALWAYS AS (metadata->>'instrument') STORED,
+    ADD COLUMN IF NOT EXISTS binning TEXT GENERATED ALWAYS AS (metadata->>'binning') STORED,
+    ADD COLUMN IF NOT EXISTS gain DOUBLE PRECISION GENERATED ALWAYS AS (public.fits_num(metadata->>'gain')) STORED,
+    ADD COLUMN IF NOT EXISTS temperature DOUBLE PRECISION GENERATED ALWAYS AS (public.fits_num(metadata->>'temperature')) STORED,
+    ADD COLUMN IF NOT EXISTS exposure_time DOUBLE PRECISION GENERATED ALWAYS AS (public.fits_num(metadata->>'exposure_time')) STORED;
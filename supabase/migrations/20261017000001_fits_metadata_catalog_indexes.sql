@@ -0,0 +1,9 @@
+-- Frame catalog indexes, built without blocking writes to fits_metadata.
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so these
+-- statements live in their own migration.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS fits_metadata_catalog_idx
+    ON public.fits_metadata (user_id, frame_type, camera, binning, gain, exposure_time, temperature);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS fits_metadata_project_idx
+    ON public.fits_metadata (project_id, frame_type);